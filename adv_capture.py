@@ -0,0 +1,205 @@
+import struct
+import time
+import uuid
+from typing import BinaryIO, Dict, Iterator, NamedTuple, Optional, Tuple
+
+MAGIC = b"SBADV01\n"
+# Record header: body length, timestamp, RSSI (-128 = unknown), name length,
+# address length (_MAC_ADDRESS = 6-byte binary MAC), manufacturer entry
+# count, service entry count.
+_RECORD = struct.Struct("<HdbBBBB")
+# Manufacturer entry: company ID, data length.
+_MANUFACTURER = struct.Struct("<HB")
+# Service entry: 16-bit UUID (Bluetooth base UUID), data length.
+_SERVICE16 = struct.Struct("<HB")
+# Service entry: 128-bit UUID, data length.
+_SERVICE128 = struct.Struct("<16sB")
+_NO_RSSI = -128
+_MAC_ADDRESS = 0xFF
+_SERVICE_128_FLAG = 0x80
+_BASE_UUID_SUFFIX = "-0000-1000-8000-00805f9b34fb"
+
+
+class Frame(NamedTuple):
+    ts: float
+    address: str
+    name: str
+    rssi: Optional[int]
+    manufacturer_data: Dict[int, bytes]
+    service_data: Dict[str, bytes]
+
+
+class CapturedDevice:
+    """Stand-in for a BLEDevice in scanner callbacks."""
+
+    __slots__ = ("address", "name")
+
+    def __init__(self, address: str, name: Optional[str]) -> None:
+        self.address = address
+        self.name = name
+
+
+class CapturedAdvertisement:
+    """Stand-in for Bleak's AdvertisementData in scanner callbacks."""
+
+    __slots__ = ("rssi", "manufacturer_data", "service_data", "local_name")
+
+    def __init__(self, rssi: Optional[int], manufacturer_data: Dict[int, bytes], service_data: Dict[str, bytes]) -> None:
+        self.rssi = rssi
+        self.manufacturer_data = manufacturer_data
+        self.service_data = service_data
+        self.local_name = None
+
+
+def to_callback_args(frame: Frame) -> tuple[CapturedDevice, CapturedAdvertisement]:
+    device = CapturedDevice(frame.address, frame.name or None)
+    return device, CapturedAdvertisement(frame.rssi, frame.manufacturer_data, frame.service_data)
+
+
+def frame_from_callback(device, adv, ts: Optional[float] = None) -> Frame:
+    return Frame(
+        time.time() if ts is None else ts,
+        device.address,
+        device.name or "",
+        getattr(adv, "rssi", None),
+        dict(adv.manufacturer_data or {}),
+        dict(adv.service_data or {}),
+    )
+
+
+def _encode_address(address: str) -> tuple[int, bytes]:
+    if len(address) == 17 and address[2] == ":":
+        try:
+            return _MAC_ADDRESS, bytes.fromhex(address.replace(":", ""))
+        except ValueError:
+            pass
+    raw = address.encode()[:254]
+    return len(raw), raw
+
+
+def _encode_service(service_uuid: str, data: bytes) -> bytes:
+    # Service entries start with a kind byte: 0 = 16-bit UUID, _SERVICE_128_FLAG = 128-bit UUID.
+    u = service_uuid.lower()
+    if u.startswith("0000") and u.endswith(_BASE_UUID_SUFFIX):
+        return b"\x00" + _SERVICE16.pack(int(u[4:8], 16), len(data)) + data
+    return bytes([_SERVICE_128_FLAG]) + _SERVICE128.pack(uuid.UUID(u).bytes, len(data)) + data
+
+
+def encode_frame(frame: Frame) -> bytes:
+    addr_len, address = _encode_address(frame.address)
+    name = frame.name.encode()[:255]
+    parts = [address, name]
+    for company_id, data in frame.manufacturer_data.items():
+        parts.append(_MANUFACTURER.pack(company_id, len(data)))
+        parts.append(data)
+    for service_uuid, data in frame.service_data.items():
+        parts.append(_encode_service(service_uuid, data))
+    body = b"".join(parts)
+    rssi = _NO_RSSI if frame.rssi is None else max(-127, min(127, frame.rssi))
+    header = _RECORD.pack(
+        len(body),
+        frame.ts,
+        rssi,
+        len(name),
+        addr_len,
+        len(frame.manufacturer_data),
+        len(frame.service_data),
+    )
+    return header + body
+
+
+def decode_frame(header: tuple, body: bytes) -> Frame:
+    _, ts, rssi, name_len, addr_len, n_manufacturer, n_service = header
+    if addr_len == _MAC_ADDRESS:
+        addr_len = 6
+        address = body[:6].hex(":").upper()
+    else:
+        address = body[:addr_len].decode()
+    pos = addr_len + name_len
+    name = body[addr_len:pos].decode(errors="replace")
+    manufacturer_data: Dict[int, bytes] = {}
+    for _ in range(n_manufacturer):
+        company_id, length = _MANUFACTURER.unpack_from(body, pos)
+        pos += _MANUFACTURER.size
+        manufacturer_data[company_id] = body[pos : pos + length]
+        pos += length
+    service_data: Dict[str, bytes] = {}
+    for _ in range(n_service):
+        kind = body[pos]
+        pos += 1
+        if kind == _SERVICE_128_FLAG:
+            raw_uuid, length = _SERVICE128.unpack_from(body, pos)
+            pos += _SERVICE128.size
+            service_uuid = str(uuid.UUID(bytes=raw_uuid))
+        else:
+            uuid16, length = _SERVICE16.unpack_from(body, pos)
+            pos += _SERVICE16.size
+            service_uuid = f"0000{uuid16:04x}{_BASE_UUID_SUFFIX}"
+        service_data[service_uuid] = body[pos : pos + length]
+        pos += length
+    return Frame(ts, address, name, None if rssi == _NO_RSSI else rssi, manufacturer_data, service_data)
+
+
+class CaptureWriter:
+    """Append raw advertisements to a capture file."""
+
+    def __init__(self, path: str) -> None:
+        self._fh: BinaryIO = open(path, "wb")
+        self._fh.write(MAGIC)
+        self.count = 0
+
+    def write(self, device, adv, ts: Optional[float] = None) -> None:
+        self._fh.write(encode_frame(frame_from_callback(device, adv, ts)))
+        self.count += 1
+
+    def close(self) -> None:
+        self._fh.close()
+
+    def __enter__(self) -> "CaptureWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def iter_records(data: bytes, pos: int = 0) -> Iterator[Tuple[tuple, bytes]]:
+    """(header, body) of records packed back to back in a buffer; a truncated tail is ignored."""
+    end = len(data)
+    while pos + _RECORD.size <= end:
+        header = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        if pos + header[0] > end:
+            return
+        yield header, data[pos : pos + header[0]]
+        pos += header[0]
+
+
+def record_key(header: tuple, body: bytes) -> bytes:
+    """Address and payload of a record without its name, to spot the same advertisement from several scanners."""
+    addr_len = 6 if header[4] == _MAC_ADDRESS else header[4]
+    return body[:addr_len] + body[addr_len + header[3] :]
+
+
+def record_rssi(header: tuple) -> Optional[int]:
+    return None if header[2] == _NO_RSSI else header[2]
+
+
+def decode_frames(data: bytes, pos: int = 0) -> Iterator[Frame]:
+    for header, body in iter_records(data, pos):
+        yield decode_frame(header, body)
+
+
+def read_capture(path: str) -> Iterator[Frame]:
+    """Stream frames from a capture file."""
+    with open(path, "rb") as fh:
+        if fh.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an advertisement capture")
+        while True:
+            raw = fh.read(_RECORD.size)
+            if len(raw) < _RECORD.size:
+                return
+            header = _RECORD.unpack(raw)
+            body = fh.read(header[0])
+            if len(body) < header[0]:
+                return
+            yield decode_frame(header, body)
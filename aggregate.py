@@ -0,0 +1,197 @@
+import math
+from array import array
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class SampleWindow:
+    """Array-backed ring buffer of one sensor's (tempc, hum) samples since the last write.
+
+    Once `capacity` samples are buffered the oldest are overwritten; `count`
+    keeps counting every sample added to the window.
+    """
+
+    __slots__ = ("capacity", "count", "_temp", "_hum", "_next", "last")
+
+    def __init__(self, capacity: int = 512) -> None:
+        self.capacity = capacity
+        self._temp = array("d", bytes(8 * capacity))
+        self._hum = array("d", bytes(8 * capacity))
+        self._next = 0
+        self.count = 0
+        self.last: Optional[Tuple[float, float]] = None
+
+    def add(self, tempc: float, hum: float) -> None:
+        i = self._next
+        self._temp[i] = tempc
+        self._hum[i] = hum
+        self._next = (i + 1) % self.capacity
+        self.count += 1
+        self.last = (tempc, hum)
+
+    def fields(self) -> Dict[str, float]:
+        """min/max/mean/last of the buffered samples plus the sample count."""
+        if not self.count:
+            return {}
+        n = min(self.count, self.capacity)
+        temp = self._temp if n == self.capacity else self._temp[:n]
+        hum = self._hum if n == self.capacity else self._hum[:n]
+        return {
+            "tempc": self.last[0],
+            "tempc_min": min(temp),
+            "tempc_max": max(temp),
+            "tempc_mean": round(sum(temp) / n, 2),
+            "hum": self.last[1],
+            "hum_min": min(hum),
+            "hum_max": max(hum),
+            "hum_mean": round(sum(hum) / n, 2),
+            "samples": self.count,
+        }
+
+    def clear(self) -> None:
+        self._next = 0
+        self.count = 0
+
+
+class Deadband:
+    """Decide whether a reading moved enough (or is old enough) to be written."""
+
+    def __init__(self, temp_delta: float = 0.0, hum_delta: float = 0.0, heartbeat: float = 600.0) -> None:
+        self.temp_delta = temp_delta
+        self.hum_delta = hum_delta
+        self.heartbeat = heartbeat
+        self._written: Dict[str, Tuple[float, float, float]] = {}
+        self.suppressed = 0
+
+    def should_write(self, mac: str, tempc: float, hum: float, now: float) -> bool:
+        prev = self._written.get(mac)
+        if (
+            prev is None
+            or now - prev[2] >= self.heartbeat
+            or abs(tempc - prev[0]) >= self.temp_delta > 0
+            or abs(hum - prev[1]) >= self.hum_delta > 0
+        ):
+            self._written[mac] = (tempc, hum, now)
+            return True
+        self.suppressed += 1
+        return False
+
+    def retain(self, macs: Iterable[str]) -> None:
+        """Forget every sensor not in `macs` (the registry's active ones), so churned MACs don't pile up."""
+        keep = set(macs)
+        for mac in [mac for mac in self._written if mac not in keep]:
+            del self._written[mac]
+
+
+def _percentile(ordered: list, p: float) -> float:
+    k = (len(ordered) - 1) * p
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class LinkStats:
+    """Constant-memory link statistics of one device's advertisements.
+
+    RSSI is tracked as an EWMA plus the last `capacity` values in a ring for
+    percentiles. Inter-arrival gaps go into a second ring; jitter is the
+    RFC 3550 running mean of successive gap differences. Loss compares the
+    advertisements received since the last `report` with those expected at
+    the nominal interval: `interval` if given, else the lower quartile of
+    recent gaps (meters advertise at a fixed rate, so missed packets only
+    ever lengthen gaps). Gaps shorter than `min_gap` are repeats of the same
+    advertisement and are not counted.
+    """
+
+    __slots__ = (
+        "capacity",
+        "alpha",
+        "interval",
+        "min_gap",
+        "_rssi",
+        "_rssi_count",
+        "_gaps",
+        "_gap_count",
+        "ewma",
+        "jitter",
+        "count",
+        "last_rssi",
+        "last_seen",
+        "_last_gap",
+        "_window_count",
+        "_window_start",
+    )
+
+    def __init__(
+        self, capacity: int = 64, alpha: float = 0.1, interval: Optional[float] = None, min_gap: float = 0.02
+    ) -> None:
+        self.capacity = capacity
+        self.alpha = alpha
+        self.interval = interval
+        self.min_gap = min_gap
+        self._rssi = array("d", bytes(8 * capacity))
+        self._rssi_count = 0
+        self._gaps = array("d", bytes(8 * capacity))
+        self._gap_count = 0
+        self.ewma: Optional[float] = None
+        self.jitter = 0.0
+        self.count = 0
+        self.last_rssi: Optional[int] = None
+        self.last_seen: Optional[float] = None
+        self._last_gap: Optional[float] = None
+        self._window_count = 0
+        self._window_start: Optional[float] = None
+
+    def add(self, rssi: Optional[int], now: float) -> None:
+        last = self.last_seen
+        if last is not None:
+            gap = now - last
+            if gap < self.min_gap:
+                return
+            self._gaps[self._gap_count % self.capacity] = gap
+            self._gap_count += 1
+            if self._last_gap is not None:
+                self.jitter += (abs(gap - self._last_gap) - self.jitter) / 16
+            self._last_gap = gap
+        elif self._window_start is None:
+            self._window_start = now
+        self.last_seen = now
+        self.count += 1
+        self._window_count += 1
+        if rssi is not None:
+            self._rssi[self._rssi_count % self.capacity] = rssi
+            self._rssi_count += 1
+            self.last_rssi = rssi
+            self.ewma = float(rssi) if self.ewma is None else self.ewma + self.alpha * (rssi - self.ewma)
+
+    def _ring(self, ring: array, count: int) -> list:
+        return sorted(ring if count >= self.capacity else ring[:count])
+
+    def nominal_interval(self) -> float:
+        if self.interval:
+            return self.interval
+        gaps = self._ring(self._gaps, self._gap_count)
+        return _percentile(gaps, 0.25) if gaps else math.nan
+
+    def report(self, now: float) -> Dict[str, float]:
+        """Fields for the window since the previous report, which starts a new window.
+
+        Statistics that need data the device has not sent yet are left out.
+        """
+        fields: Dict[str, float] = {"received": self._window_count, "jitter_ms": round(self.jitter * 1000, 1)}
+        if self.last_seen is not None:
+            fields["age"] = round(now - self.last_seen, 1)
+        if self.ewma is not None:
+            rssi = self._ring(self._rssi, self._rssi_count)
+            fields["rssi_ewma"] = round(self.ewma, 2)
+            fields["rssi_p10"] = _percentile(rssi, 0.1)
+            fields["rssi_p50"] = _percentile(rssi, 0.5)
+            fields["rssi_p90"] = _percentile(rssi, 0.9)
+        interval = self.nominal_interval()
+        if interval > 0:
+            fields["interval"] = round(interval, 3)
+            if self._window_start is not None and now > self._window_start:
+                expected = (now - self._window_start) / interval
+                fields["loss"] = round(max(0.0, 1.0 - self._window_count / expected), 3)
+        self._window_count = 0
+        self._window_start = now
+        return fields
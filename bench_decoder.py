@@ -0,0 +1,65 @@
+import argparse
+import time
+from types import SimpleNamespace
+from typing import Callable, List
+
+import switchbot_decoder
+from switchbot_decoder import FD3D_UUID, _decode_with_theengs, _make_theengs_payload, decode_advertisement
+
+# Sample frames: (name, address, manufacturer_data, service_data).
+SAMPLES = [
+    # WoSensorTH: 21.5 C, 48 %, battery 87 %.
+    ("", "EA:06:06:3B:35:B7", {0x0969: bytes.fromhex("ea06063b35b7")}, {FD3D_UUID: bytes.fromhex("540057059530")}),
+    # Outdoor meter (sample from meter.md with a real MAC): 22.2 C, 55 %, battery 100 %.
+    ("", "C7:8D:2F:CB:6B:1A", {0x0969: bytes.fromhex("c78d2fcb6b1a360302963700")}, {FD3D_UUID: bytes.fromhex("770064")}),
+    # Meter Plus: -3.4 C, 71 %, battery 64 %.
+    ("", "DB:97:62:4B:B7:BE", {0x0969: bytes.fromhex("db97624bb7be")}, {FD3D_UUID: bytes.fromhex("690040040347")}),
+]
+
+
+def _frames() -> List[tuple]:
+    frames = []
+    for name, address, manufacturer_data, service_data in SAMPLES:
+        device = SimpleNamespace(name=name, address=address)
+        adv = SimpleNamespace(rssi=-70, manufacturer_data=manufacturer_data, service_data=service_data)
+        frames.append((device, adv))
+    return frames
+
+
+def _native(device, adv):
+    return decode_advertisement(device, adv, fallback=False)
+
+
+def _theengs(device, adv):
+    return _decode_with_theengs(_make_theengs_payload(device.name or "", device.address, adv.rssi, adv))
+
+
+def _bench(fn: Callable, frames: List[tuple], count: int) -> float:
+    n = len(frames)
+    start = time.perf_counter()
+    for i in range(count):
+        device, adv = frames[i % n]
+        fn(device, adv)
+    return count / (time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare native and TheengsDecoder decode throughput.")
+    parser.add_argument("--count", type=int, default=200_000, help="Decodes per run")
+    args = parser.parse_args()
+
+    frames = _frames()
+    for device, adv in frames:
+        print(f"{device.address}: {_native(device, adv)}")
+
+    native = _bench(_native, frames, args.count)
+    print(f"native:  {native:12,.0f} decodes/s")
+    if switchbot_decoder._load_theengs() is None:
+        print("theengs: (not installed)")
+        return
+    theengs = _bench(_theengs, frames, args.count)
+    print(f"theengs: {theengs:12,.0f} decodes/s ({native / theengs:.1f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+import argparse
+import csv
+import math
+import time
+from typing import Dict, Iterable, Iterator, Optional
+
+import numpy as np
+
+from adv_capture import MAGIC as CAPTURE_MAGIC
+from adv_capture import Frame, read_capture
+from switchbot_decoder import FD3D_UUID, SWITCHBOT_COMPANY_IDS, _fd3d, _switchbot_manufacturer
+
+MAGIC = b"SBFRM01\n"
+# One fixed-width record per SwitchBot advertisement, so a whole file can be
+# memory-mapped and decoded column by column. Data shorter than its slot is
+# zero-padded; the *_len fields keep the real length.
+FRAME = np.dtype(
+    [
+        ("ts", "<f8"),  # NaN when the source had no timestamps (scan dumps)
+        ("mac", "u1", 6),  # from the manufacturer data, else the address; zeros if neither is a MAC
+        ("rssi", "i1"),  # -128 = unknown
+        ("service_len", "u1"),
+        ("service", "u1", 8),  # fd3d service data
+        ("manufacturer_len", "u1"),
+        ("manufacturer", "u1", 12),  # SwitchBot manufacturer data, without the company ID
+    ]
+)
+_SERVICE_WIDTH = FRAME["service"].shape[0]
+_MANUFACTURER_WIDTH = FRAME["manufacturer"].shape[0]
+_NO_RSSI = -128
+
+# Device type byte -> model, matching switchbot_decoder._DECODERS.
+MODELS = {0x54: "Meter", 0x69: "Meter Plus", 0x77: "Outdoor Meter"}
+_METER_TYPES = (0x54, 0x69)
+_OUTDOOR_TYPE = 0x77
+_HEX_DIGITS = np.frombuffer(b"0123456789ABCDEF", dtype=np.uint8)
+
+COLUMNS = ("ts", "mac", "rssi", "model", "tempc", "hum", "batt", "tempalert", "humalert")
+
+
+def _mac_bytes(frame: Frame, manufacturer: Optional[bytes]) -> bytes:
+    if manufacturer is not None and len(manufacturer) >= 6:
+        return manufacturer[:6]
+    if len(frame.address) == 17:
+        try:
+            return bytes.fromhex(frame.address.replace(":", ""))
+        except ValueError:
+            pass
+    return bytes(6)
+
+
+def pack(frames: Iterable[Frame]) -> np.ndarray:
+    """Fixed-width FRAME records for the advertisements that carry fd3d service data; others are skipped."""
+    rows = []
+    for frame in frames:
+        service = _fd3d(frame.service_data)
+        if not service:
+            continue
+        manufacturer = _switchbot_manufacturer(frame.manufacturer_data) or b""
+        rows.append(
+            (
+                frame.ts,
+                tuple(_mac_bytes(frame, manufacturer)),
+                _NO_RSSI if frame.rssi is None else max(-127, min(127, frame.rssi)),
+                min(len(service), _SERVICE_WIDTH),
+                tuple(service[:_SERVICE_WIDTH].ljust(_SERVICE_WIDTH, b"\0")),
+                min(len(manufacturer), _MANUFACTURER_WIDTH),
+                tuple(manufacturer[:_MANUFACTURER_WIDTH].ljust(_MANUFACTURER_WIDTH, b"\0")),
+            )
+        )
+    return np.array(rows, dtype=FRAME)
+
+
+def read_dump(path: str) -> Iterator[Frame]:
+    """Frames from the text `scan_switchbot.py` prints (Address/RSSI/Manufacturer/Service blocks).
+
+    Lines may carry a prefix (journald, timestamps); the dump has no capture
+    time, so `ts` is NaN.
+    """
+    block: Dict[str, str] = {}
+    with open(path, errors="replace") as f:
+        for line in f:
+            for key in ("Name:", "Address:", "RSSI:", "Manufacturer:", "Service:"):
+                at = line.find(key)
+                if at < 0:
+                    continue
+                block[key] = line[at + len(key) :].strip()
+                if key == "Service:":
+                    frame = _dump_frame(block)
+                    if frame is not None:
+                        yield frame
+                    block = {}
+                break
+
+
+def _dump_frame(block: Dict[str, str]) -> Optional[Frame]:
+    manufacturer_data: Dict[int, bytes] = {}
+    service_data: Dict[str, bytes] = {}
+    try:
+        raw = block.get("Manufacturer:", "None")
+        if raw != "None":
+            data = bytes.fromhex(raw)
+            company_id = int.from_bytes(data[:2], "little")
+            if company_id in SWITCHBOT_COMPANY_IDS:
+                manufacturer_data[company_id] = data[2:]
+        service_hex, _, uuid16 = block["Service:"].partition(" ")
+        if service_hex != "None" and uuid16.strip() == "fd3d":
+            service_data[FD3D_UUID] = bytes.fromhex(service_hex)
+        rssi = block.get("RSSI:", "None")
+        return Frame(
+            math.nan,
+            block.get("Address:", ""),
+            block.get("Name:", ""),
+            None if rssi == "None" else int(rssi),
+            manufacturer_data,
+            service_data,
+        )
+    except (KeyError, ValueError):
+        return None
+
+
+def read_frames(path: str) -> Iterator[Frame]:
+    """Frames from a capture file (`--capture`) or a text scan dump, told apart by the capture magic."""
+    with open(path, "rb") as f:
+        magic = f.read(len(CAPTURE_MAGIC))
+    return read_capture(path) if magic == CAPTURE_MAGIC else read_dump(path)
+
+
+def save_frames(path: str, frames: np.ndarray) -> None:
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(frames.tobytes())
+
+
+def load_frames(path: str) -> np.ndarray:
+    """Memory-map a packed frame file; nothing is read until a column is touched."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: not a packed frame file")
+    return np.memmap(path, dtype=FRAME, mode="r", offset=len(MAGIC))
+
+
+def decode_batch(frames: np.ndarray) -> Dict[str, np.ndarray]:
+    """Decode every FRAME record at once into columns.
+
+    Same rules as `switchbot_decoder.decode`. Rows that are not a supported
+    meter, or lack the bytes their model needs, come back with NaN tempc and
+    -1 in the integer columns; `valid` marks the decoded ones. `rssi` keeps
+    the capture's -128 for unknown.
+    """
+    service = frames["service"]
+    manufacturer = frames["manufacturer"]
+    service_len = frames["service_len"]
+    kind = service[:, 0] & 0x7F
+
+    meter = np.isin(kind, _METER_TYPES)
+    # Meters read from the service data; newer meter firmware and the outdoor meter from the manufacturer data.
+    from_service = meter & (service_len >= 6)
+    from_manufacturer = ~from_service & (meter | (kind == _OUTDOOR_TYPE)) & (frames["manufacturer_len"] >= 11)
+    valid = from_service | from_manufacturer
+
+    frac = np.where(from_service, service[:, 3], manufacturer[:, 8])
+    whole = np.where(from_service, service[:, 4], manufacturer[:, 9])
+    hum = np.where(from_service, service[:, 5], manufacturer[:, 10]) & 0x7F
+    tenths = (whole & 0x7F).astype(np.int16) * 10 + (frac & 0x0F)
+    tenths = np.where(whole & 0x80, tenths, -tenths)
+
+    alert = service[:, 3]
+    has_batt = valid & (service_len >= 3)
+    return {
+        "ts": np.asarray(frames["ts"]),
+        "mac": np.asarray(frames["mac"]),
+        "rssi": np.array(frames["rssi"]),
+        "model": np.where(valid, kind, 0).astype(np.uint8),
+        "tempc": np.where(valid, tenths / 10.0, np.nan),
+        "hum": np.where(valid, hum, -1).astype(np.int8),
+        "batt": np.where(has_batt, service[:, 2] & 0x7F, -1).astype(np.int8),
+        "tempalert": np.where(from_service, (alert >> 6) & 0x03, -1).astype(np.int8),
+        "humalert": np.where(from_service, (alert >> 4) & 0x03, -1).astype(np.int8),
+        "valid": valid,
+    }
+
+
+def mac_strings(mac: np.ndarray) -> np.ndarray:
+    """(N, 6) uint8 -> N 'AA:BB:CC:DD:EE:FF' strings, without a Python loop."""
+    out = np.full((len(mac), 17), ord(":"), dtype=np.uint8)
+    out[:, 0::3] = _HEX_DIGITS[mac >> 4]
+    out[:, 1::3] = _HEX_DIGITS[mac & 0x0F]
+    return out.view("S17").ravel().astype(str)
+
+
+def _rows(columns: Dict[str, np.ndarray]) -> Dict[str, list]:
+    keep = columns["valid"]
+    models = np.array([MODELS.get(i, "") for i in range(256)], dtype=object)
+    out = {name: columns[name][keep].tolist() for name in COLUMNS if name not in ("mac", "model")}
+    out["mac"] = mac_strings(columns["mac"][keep]).tolist()
+    out["model"] = models[columns["model"][keep]].tolist()
+    return {name: out[name] for name in COLUMNS}
+
+
+def _table(columns: Dict[str, np.ndarray]):
+    import pyarrow as pa
+
+    keep = columns["valid"]
+    data = {name: columns[name][keep] for name in COLUMNS}
+    data["mac"] = mac_strings(data["mac"])
+    data["model"] = pa.DictionaryArray.from_arrays(data["model"], [MODELS.get(i, "") for i in range(256)])
+    return pa.table(data)
+
+
+def _pyarrow(what: str, required: bool):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        if required:
+            raise SystemExit(f"{what} needs pyarrow: python -m pip install pyarrow") from None
+        return False
+    return True
+
+
+def iter_batches(frames: np.ndarray, chunk: int = 1 << 20) -> Iterator[Dict[str, np.ndarray]]:
+    for start in range(0, len(frames), chunk):
+        yield decode_batch(frames[start : start + chunk])
+
+
+def write_csv(path: str, frames: np.ndarray, chunk: int = 1 << 20) -> int:
+    """Decode `frames` chunk by chunk into a CSV of the valid rows; returns the row count.
+
+    Uses pyarrow's CSV writer when it is installed; the csv module is several
+    times slower on millions of rows.
+    """
+    count = 0
+    if _pyarrow("CSV", required=False):
+        from pyarrow import csv as pa_csv
+
+        writer = None
+        try:
+            for columns in iter_batches(frames, chunk):
+                table = _table(columns)
+                table = table.set_column(3, "model", table.column("model").cast("string"))
+                if writer is None:
+                    writer = pa_csv.CSVWriter(path, table.schema)
+                writer.write_table(table)
+                count += table.num_rows
+        finally:
+            if writer is not None:
+                writer.close()
+        return count
+    with open(path, "w", newline="") as f:
+        out = csv.writer(f)
+        out.writerow(COLUMNS)
+        for columns in iter_batches(frames, chunk):
+            rows = _rows(columns)
+            out.writerows(zip(*rows.values()))
+            count += len(rows["ts"])
+    return count
+
+
+def write_parquet(path: str, frames: np.ndarray, chunk: int = 1 << 20) -> int:
+    _pyarrow("Parquet output", required=True)
+    import pyarrow.parquet as pq
+
+    count = 0
+    writer = None
+    try:
+        for columns in iter_batches(frames, chunk):
+            table = _table(columns)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            count += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def _load(path: str) -> np.ndarray:
+    with open(path, "rb") as f:
+        magic = f.read(len(MAGIC))
+    return load_frames(path) if magic == MAGIC else pack(read_frames(path))
+
+
+def synthetic(count: int, seed: int = 0) -> np.ndarray:
+    """Random meter, meter plus and outdoor meter frames in equal parts, for benchmarking."""
+    rng = np.random.default_rng(seed)
+    frames = np.zeros(count, dtype=FRAME)
+    frames["ts"] = 1.7e9 + np.arange(count) * 0.01
+    frames["mac"] = rng.integers(0, 256, (count, 6), dtype=np.uint8)
+    frames["rssi"] = rng.integers(-100, -30, count)
+    kinds = np.array([0x54, 0x69, 0x77], dtype=np.uint8)[rng.integers(0, 3, count)]
+    service = rng.integers(0, 256, (count, _SERVICE_WIDTH), dtype=np.uint8)
+    service[:, 0] = kinds | (rng.integers(0, 2, count, dtype=np.uint8) << 7)
+    service[:, 3] = (service[:, 3] & 0xF0) | rng.integers(0, 10, count, dtype=np.uint8)
+    frames["service"] = service
+    frames["service_len"] = np.where(kinds == 0x77, 3, 6)
+    manufacturer = rng.integers(0, 256, (count, _MANUFACTURER_WIDTH), dtype=np.uint8)
+    manufacturer[:, :6] = frames["mac"]
+    manufacturer[:, 8] = rng.integers(0, 10, count, dtype=np.uint8)
+    frames["manufacturer"] = manufacturer
+    frames["manufacturer_len"] = 12
+    return frames
+
+
+def check(frames: np.ndarray, limit: int = 20_000) -> int:
+    """Compare decode_batch with the scalar decoder on up to `limit` frames; returns the mismatch count."""
+    from switchbot_decoder import decode
+
+    frames = frames[:limit]
+    columns = decode_batch(frames)
+    mismatches = 0
+    for i, rec in enumerate(frames):
+        service = bytes(rec["service"][: rec["service_len"]])
+        manufacturer = bytes(rec["manufacturer"][: rec["manufacturer_len"]])
+        expected = decode("", "", None, {0x0969: manufacturer} if manufacturer else {}, {FD3D_UUID: service})
+        if expected is None:
+            mismatches += bool(columns["valid"][i])
+            continue
+        got = (columns["tempc"][i], columns["hum"][i], columns["batt"][i], columns["tempalert"][i])
+        want = (expected["tempc"], expected["hum"], expected.get("batt", -1), expected.get("tempalert", -1))
+        mismatches += got != want
+    return mismatches
+
+
+def bench(count: int, repeat: int) -> None:
+    frames = synthetic(count)
+    decode_batch(frames[:1000])
+    best = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        decode_batch(frames)
+        best = min(best, time.perf_counter() - started)
+    print(f"decode_batch: {count} frames in {best * 1000:.1f} ms = {count / best / 1e6:.2f} M frames/s")
+    print(f"mismatches against switchbot_decoder.decode: {check(frames)} / {min(count, 20_000)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Decode large SwitchBot advertisement dumps in bulk with NumPy.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("pack", help="Pack captures/scan dumps into a fixed-width frame file for memory-mapping")
+    p.add_argument("inputs", nargs="+", help="Capture files (--capture) or text output of scan_switchbot.py")
+    p.add_argument("-o", "--out", required=True, help="Frame file to write")
+
+    p = sub.add_parser("decode", help="Decode a frame file, capture or scan dump to CSV or Parquet")
+    p.add_argument("input", help="Packed frame file, capture file or scan dump")
+    p.add_argument("-o", "--out", required=True, help="Output path; .parquet writes Parquet, anything else CSV")
+    p.add_argument("--chunk", type=int, default=1 << 20, help="Frames decoded per batch")
+
+    p = sub.add_parser("bench", help="Time decode_batch on synthetic frames and check it against the scalar decoder")
+    p.add_argument("--frames", type=int, default=2_000_000)
+    p.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.cmd == "pack":
+        frames = np.concatenate([pack(read_frames(path)) for path in args.inputs])
+        save_frames(args.out, frames)
+        print(f"packed {len(frames)} frame(s) into {args.out}")
+    elif args.cmd == "decode":
+        frames = _load(args.input)
+        started = time.perf_counter()
+        write = write_parquet if args.out.endswith(".parquet") else write_csv
+        count = write(args.out, frames, max(1, args.chunk))
+        elapsed = time.perf_counter() - started
+        print(f"wrote {count} reading(s) from {len(frames)} frame(s) to {args.out} in {elapsed:.2f}s")
+    else:
+        bench(args.frames, max(1, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
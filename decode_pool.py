@@ -0,0 +1,404 @@
+import argparse
+import asyncio
+import functools
+import json
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Deque, List, Optional, Sequence, Tuple
+
+from adv_capture import CapturedAdvertisement, CapturedDevice, Frame, to_callback_args
+from metrics import DECODE_BUCKETS, REGISTRY, SIZE_BUCKETS
+from sensor_registry import SensorRegistry, mac_to_int
+from switchbot_decoder import FD3D_UUID, decode_advertisement
+
+MODES = ("thread", "process")
+
+_QUEUED = REGISTRY.gauge("switchbot_decode_queue_depth", "Advertisements waiting for a decode worker")
+_DROPPED = REGISTRY.counter(
+    "switchbot_decode_dropped_total", "Advertisements dropped because the decode queue was full"
+)
+_BATCH = REGISTRY.histogram("switchbot_decode_batch_size", "Advertisements per decode batch", SIZE_BUCKETS)
+_BATCH_SECONDS = REGISTRY.histogram(
+    "switchbot_decode_batch_seconds", "Time a worker spent decoding one batch", DECODE_BUCKETS[2:] + (0.1, 1.0)
+)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def decode_frames(frames: Sequence[Frame]) -> Tuple[List[Optional[dict]], float]:
+    """Decode a batch in a worker; returns one result per frame and the seconds it took."""
+    started = time.perf_counter()
+    results = [decode_advertisement(*to_callback_args(frame)) for frame in frames]
+    return results, time.perf_counter() - started
+
+
+class DecodePool:
+    """Decode advertisements in batches on a thread or process pool instead of in the scanner callback.
+
+    `submit` is all the callback does: it keeps the raw bytes in a bounded
+    queue (dropping the advertisement when the queue is full) and returns.
+    A task on the loop hands the queue to the workers in batches of up to
+    `batch_size`, keeping at most two batches per worker in flight, and calls
+    `on_decoded(frame, decoded)` on the loop in arrival order, so results can
+    be merged into loop-owned state without locks. Under a burst, batches
+    grow instead of the number of hand-offs.
+
+    `decode` must be a module-level function with the signature of
+    `decode_frames` so process workers can unpickle it.
+    """
+
+    def __init__(
+        self,
+        on_decoded: Callable[[Frame, Optional[dict]], None],
+        *,
+        workers: int = 1,
+        mode: str = "thread",
+        batch_size: int = 64,
+        max_queue: int = 4096,
+        decode: Callable = decode_frames,
+    ) -> None:
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}, got {mode!r}")
+        self.on_decoded = on_decoded
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.batch_size = max(1, batch_size)
+        self.max_queue = max(1, max_queue)
+        self.decode = decode
+        self.queue: Deque[Frame] = deque()
+        self.submitted = 0
+        self.dropped = 0
+        self.decoded = 0
+        self.failed_batches = 0
+        self._wake = asyncio.Event()
+        self._executor: Optional[Executor] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def submit(self, device, adv, ts: Optional[float] = None) -> bool:
+        """Queue one advertisement from the scanner callback; False if it was dropped."""
+        if len(self.queue) >= self.max_queue:
+            self.dropped += 1
+            _DROPPED.inc()
+            return False
+        self.queue.append(
+            Frame(
+                time.time() if ts is None else ts,
+                device.address,
+                device.name or "",
+                getattr(adv, "rssi", None),
+                adv.manufacturer_data,
+                adv.service_data,
+            )
+        )
+        self.submitted += 1
+        if not self._wake.is_set():
+            self._wake.set()
+        return True
+
+    def _take(self) -> List[Frame]:
+        queue = self.queue
+        return [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+
+    def _merge(self, batch: List[Frame], results: List[Optional[dict]]) -> None:
+        self.decoded += len(batch)
+        for frame, decoded in zip(batch, results):
+            self.on_decoded(frame, decoded)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        pending: Deque[Tuple[List[Frame], asyncio.Future]] = deque()
+        in_flight = 2 * self.workers
+        while True:
+            while self.queue and len(pending) < in_flight:
+                batch = self._take()
+                _BATCH.observe(len(batch))
+                pending.append((batch, loop.run_in_executor(self._executor, self.decode, batch)))
+            _QUEUED.set(len(self.queue))
+            if not pending:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            batch, future = pending.popleft()
+            try:
+                results, seconds = await future
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                # A crashed worker loses its batch, not the logger.
+                self.failed_batches += 1
+                print(f"[{_now().isoformat()}] decode batch of {len(batch)} failed: {exc!r}", flush=True)
+                results, seconds = [None] * len(batch), 0.0
+            _BATCH_SECONDS.observe(seconds)
+            self._merge(batch, results)
+
+    async def start(self) -> None:
+        if self.mode == "process":
+            from concurrent.futures import ProcessPoolExecutor  # pulls in multiprocessing
+
+            self._executor = ProcessPoolExecutor(self.workers)
+        else:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="decode")
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        if self.dropped:
+            print(f"[{_now().isoformat()}] decode queue dropped {self.dropped} advertisement(s)", flush=True)
+
+
+def add_decode_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--decode-workers",
+        type=int,
+        default=0,
+        help="Decode advertisements on this many workers instead of in the scanner callback (0 = inline)",
+    )
+    parser.add_argument("--decode-mode", choices=MODES, default="thread", help="Worker type for --decode-workers")
+    parser.add_argument("--decode-batch", type=int, default=64, help="Max advertisements per decode batch")
+    parser.add_argument(
+        "--decode-queue", type=int, default=4096, help="Advertisements buffered for the workers before dropping"
+    )
+
+
+def decode_options(args: argparse.Namespace) -> Optional[dict]:
+    """DecodePool keyword arguments, or None when decoding stays inline."""
+    if args.decode_workers <= 0:
+        return None
+    return {
+        "workers": args.decode_workers,
+        "mode": args.decode_mode,
+        "batch_size": args.decode_batch,
+        "max_queue": args.decode_queue,
+    }
+
+
+def costly_decode(frames: Sequence[Frame], cost: float = 0.0) -> Tuple[List[Optional[dict]], float]:
+    """`decode_frames` plus `cost` seconds of Python work per frame (stand-in for a slow decoder or a Pi Zero)."""
+    started = time.perf_counter()
+    results = []
+    for frame in frames:
+        results.append(decode_advertisement(*to_callback_args(frame)))
+        until = time.perf_counter() + cost
+        while time.perf_counter() < until:
+            pass
+    return results, time.perf_counter() - started
+
+
+def _bench_frames(sensors: int) -> List[Tuple[CapturedDevice, CapturedAdvertisement]]:
+    """Meter advertisements (21.5 C, 48 %) from `sensors` distinct MACs."""
+    frames = []
+    for i in range(sensors):
+        mac = bytes([0xEA, 0x06, 0x06, 0x3B, i >> 8, i & 0xFF])
+        device = CapturedDevice(mac.hex(":").upper(), None)
+        adv = CapturedAdvertisement(-70, {0x0969: mac}, {FD3D_UUID: bytes.fromhex("540057059530")})
+        frames.append((device, adv))
+    return frames
+
+
+class _Radio(threading.Thread):
+    """Emits advertisements at `rate`/s into a bounded receive buffer, like BlueZ filling the D-Bus socket.
+
+    When the loop does not read fast enough the buffer overflows and the
+    advertisement is lost, which is what happens to a blocked bleak client.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, reader: Callable, frames: list, rate: float, buffer: int):
+        super().__init__(daemon=True)
+        self.loop = loop
+        self.reader = reader
+        self.frames = frames
+        self.rate = rate
+        self.buffer: Deque[tuple] = deque()
+        self.capacity = buffer
+        self.sent = 0
+        self.lost = 0
+        self.running = True
+        self.scheduled = threading.Event()
+
+    def run(self) -> None:
+        start = time.perf_counter()
+        n = len(self.frames)
+        while self.running:
+            due = int((time.perf_counter() - start) * self.rate)
+            while self.sent < due:
+                device, adv = self.frames[self.sent % n]
+                self.sent += 1
+                if len(self.buffer) >= self.capacity:
+                    self.lost += 1
+                else:
+                    self.buffer.append((time.time(), device, adv))
+            if self.buffer and not self.scheduled.is_set():
+                self.scheduled.set()
+                self.loop.call_soon_threadsafe(self.reader)
+            time.sleep(0.001)
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def bench_once(
+    workers: int,
+    mode: str,
+    rate: float,
+    seconds: float,
+    cost: float,
+    sensors: int = 50,
+    buffer: int = 512,
+    batch_size: int = 64,
+    max_queue: int = 4096,
+) -> dict:
+    """Feed `rate` advertisements/s for `seconds` through inline decoding (workers=0) or a DecodePool."""
+    loop = asyncio.get_running_loop()
+    registry = SensorRegistry(120.0, max(256, sensors))
+    latencies: List[float] = []
+    lags: List[float] = []
+    decode = functools.partial(costly_decode, cost=cost)
+    failed = 0
+
+    def merge(ts: float, decoded: Optional[dict]) -> None:
+        nonlocal failed
+        if not decoded or "mac" not in decoded:
+            failed += 1
+            return
+        now = time.time()
+        registry.update(mac_to_int(decoded["mac"]), decoded, now)
+        latencies.append(now - ts)
+
+    pool = None
+    if workers > 0:
+        pool = DecodePool(
+            lambda frame, decoded: merge(frame.ts, decoded),
+            workers=workers,
+            mode=mode,
+            batch_size=batch_size,
+            max_queue=max_queue,
+            decode=decode,
+        )
+        await pool.start()
+
+    def cb(ts: float, device, adv) -> None:
+        if pool is not None:
+            pool.submit(device, adv, ts)
+            return
+        results, _ = decode([Frame(ts, device.address, "", adv.rssi, adv.manufacturer_data, adv.service_data)])
+        merge(ts, results[0])
+
+    def read(chunk: int = 64) -> None:
+        # Dispatch like a D-Bus reader: a chunk of messages per loop iteration.
+        radio.scheduled.clear()
+        buf = radio.buffer
+        for _ in range(min(chunk, len(buf))):
+            cb(*buf.popleft())
+        if buf and not radio.scheduled.is_set():
+            radio.scheduled.set()
+            loop.call_soon(read)
+
+    radio = _Radio(loop, read, _bench_frames(sensors), rate, buffer)
+    cpu, wall = time.process_time(), time.perf_counter()
+    radio.start()
+    end = loop.time() + seconds
+    while loop.time() < end:
+        expected = loop.time() + 0.01
+        await asyncio.sleep(0.01)
+        lags.append(max(0.0, loop.time() - expected))
+    radio.running = False
+    radio.join()
+    offered = radio.sent
+    # Let what was already received drain before counting.
+    while radio.buffer or (pool is not None and (pool.queue or pool.decoded < pool.submitted)):
+        await asyncio.sleep(0.01)
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    if pool is not None:
+        await pool.close()
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return None if value is None else round(value * 1000, 2)
+
+    queue_dropped = pool.dropped if pool is not None else 0
+    return {
+        "decoder": "inline" if pool is None else f"{mode}x{workers}",
+        "offered": offered,
+        "decoded": len(latencies),
+        "rx_dropped": radio.lost,
+        "queue_dropped": queue_dropped,
+        "drop_rate": round((radio.lost + queue_dropped) / offered, 4) if offered else 0.0,
+        "lag_p50_ms": ms(_percentile(lags, 0.5)),
+        "lag_p99_ms": ms(_percentile(lags, 0.99)),
+        "lag_max_ms": ms(max(lags) if lags else None),
+        "latency_p50_ms": ms(_percentile(latencies, 0.5)),
+        "latency_p99_ms": ms(_percentile(latencies, 0.99)),
+        "seconds": round(wall, 2),  # includes draining the backlog after the radio stopped
+        "cpu_percent": round(100 * cpu / wall, 1),  # this process only, not process-pool workers
+        "failed": failed,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Measure event-loop lag and advertisement drops with inline decoding vs. a decode pool."
+    )
+    parser.add_argument("--rate", type=float, default=2000.0, help="Advertisements per second")
+    parser.add_argument("--seconds", type=float, default=5.0, help="Duration of each run")
+    parser.add_argument(
+        "--cost-us", type=float, default=200.0, help="Extra decode work per advertisement in microseconds"
+    )
+    parser.add_argument("--workers", default="0,1,2", help="Comma-separated worker counts to compare (0 = inline)")
+    parser.add_argument("--mode", choices=MODES + ("both",), default="both", help="Worker type for workers > 0")
+    parser.add_argument("--sensors", type=int, default=50, help="Distinct MACs in the stream")
+    parser.add_argument("--rx-buffer", type=int, default=512, help="Advertisements the receive buffer holds")
+    parser.add_argument("--batch", type=int, default=64, help="Max advertisements per decode batch")
+    parser.add_argument("--queue", type=int, default=4096, help="Decode queue size")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    runs = []
+    for workers in sorted({int(w) for w in args.workers.split(",") if w.strip()}):
+        modes = [MODES[0]] if workers == 0 else (MODES if args.mode == "both" else (args.mode,))
+        runs += [(workers, mode) for mode in modes]
+    results = []
+    for workers, mode in runs:
+        result = asyncio.run(
+            bench_once(
+                workers,
+                mode,
+                args.rate,
+                args.seconds,
+                args.cost_us / 1e6,
+                sensors=args.sensors,
+                buffer=args.rx_buffer,
+                batch_size=args.batch,
+                max_queue=args.queue,
+            )
+        )
+        results.append(result)
+        if not args.json:
+            print(
+                f"{result['decoder']:<10} drops {result['drop_rate']:6.1%} "
+                f"(rx {result['rx_dropped']}, queue {result['queue_dropped']} of {result['offered']})  "
+                f"lag p50/p99/max {result['lag_p50_ms']}/{result['lag_p99_ms']}/{result['lag_max_ms']} ms  "
+                f"latency p50/p99 {result['latency_p50_ms']}/{result['latency_p99_ms']} ms  "
+                f"cpu {result['cpu_percent']}% over {result['seconds']}s",
+                flush=True,
+            )
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
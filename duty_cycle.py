@@ -0,0 +1,474 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from metrics import REGISTRY
+from sensor_registry import Allowlist
+
+_SCAN_SECONDS = REGISTRY.counter("switchbot_scan_seconds_total", "Seconds the BLE scanner was running")
+_CYCLES = {
+    mode: REGISTRY.counter("switchbot_scan_cycles_total", "Write cycles by how the sensors were heard", mode=mode)
+    for mode in ("window", "extended", "continuous")
+}
+_MISSED = REGISTRY.counter("switchbot_scan_missed_total", "Needed sensors not heard before a write")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class Cadence:
+    """Learned advertising period and phase (time of the last advertisement) of one sensor.
+
+    The first gap is taken as the period; a shorter gap replaces it (the
+    longer one spanned lost packets). Later gaps are matched to a whole
+    number of periods and refine the estimate, so gaps spanning scan-off
+    time are as useful as consecutive ones.
+    """
+
+    __slots__ = ("period", "last_seen", "stable", "mismatches", "misses")
+
+    def __init__(self) -> None:
+        self.period: Optional[float] = None
+        self.last_seen: Optional[float] = None
+        self.stable = 0
+        self.mismatches = 0
+        self.misses = 0
+
+    def observe(self, t: float, min_gap: float = 0.05, tolerance: float = 0.25, alpha: float = 0.2) -> None:
+        last = self.last_seen
+        if last is not None:
+            gap = t - last
+            if gap < min_gap:
+                return  # the same advertisement reported twice
+            if self.period is None or gap < self.period * (1 - tolerance):
+                self.period, self.stable = gap, 0
+            else:
+                n = round(gap / self.period)
+                if abs(gap - n * self.period) <= tolerance * self.period:
+                    self.period += alpha * (gap / n - self.period)
+                    self.stable += 1
+                    self.mismatches = 0
+                else:
+                    self.stable = 0
+                    self.mismatches += 1
+                    if self.mismatches >= 3:
+                        # The sensor changed its interval; start over from this gap.
+                        self.period, self.mismatches = gap, 0
+        self.last_seen = t
+
+    def learned(self, gaps: int) -> bool:
+        return self.period is not None and self.stable >= gaps
+
+    def predict(self, after: float) -> float:
+        """Expected time of the first advertisement at or after `after`."""
+        k = max(0, math.ceil((after - self.last_seen) / self.period))
+        return self.last_seen + k * self.period
+
+
+class DutyCycle:
+    """Plan scan windows so every needed sensor is heard once per write cycle.
+
+    Pure bookkeeping on caller-supplied timestamps, shared by
+    `DutyCycledScanner` and `simulate`. While any needed sensor's cadence is
+    not learned, or one was missed `max_misses` writes in a row, the cycle
+    is `learning` and the scanner should run continuously. Otherwise `plan`
+    returns the shortest window (the earliest among equals, leaving the most
+    room for retries) expected to contain one advertisement of each sensor
+    not heard yet this cycle; after a window, plan again for the sensors
+    still missing. Windows end at least `retries` periods before the write,
+    so a sensor whose advertisement was lost still has that many chances;
+    when none fits, `plan` returns None and the scanner should listen until
+    the write.
+    """
+
+    def __init__(
+        self,
+        needed: Iterable[str],
+        *,
+        guard: float = 0.3,
+        drift: float = 0.002,
+        learn: int = 3,
+        max_misses: int = 2,
+        retries: int = 3,
+        min_gap: float = 0.05,
+    ) -> None:
+        self.cadences: Dict[str, Cadence] = {mac: Cadence() for mac in needed}
+        self.guard = guard
+        self.retries = retries
+        self.drift = drift
+        self.learn = learn
+        self.max_misses = max_misses
+        self.min_gap = min_gap
+        self.heard: Set[str] = set()
+
+    @property
+    def complete(self) -> bool:
+        return len(self.heard) == len(self.cadences)
+
+    def observe(self, mac: str, t: float) -> bool:
+        """Record an advertisement of `mac`; True when it completes this cycle."""
+        cadence = self.cadences.get(mac)
+        if cadence is None:
+            return False
+        cadence.observe(t, self.min_gap)
+        cadence.misses = 0
+        if mac in self.heard:
+            return False
+        self.heard.add(mac)
+        return self.complete
+
+    def _pad(self, cadence: Cadence, t: float) -> float:
+        # Prediction error grows with the time since the sensor was last heard.
+        return self.guard + self.drift * (t - cadence.last_seen)
+
+    def learning(self) -> bool:
+        return any(not c.learned(self.learn) or c.misses >= self.max_misses for c in self.cadences.values())
+
+    def plan(self, now: float, deadline: float) -> Optional[Tuple[float, float]]:
+        pending = [c for mac, c in self.cadences.items() if mac not in self.heard]
+        if not pending:
+            return now, now
+        if self.learning():
+            return None
+        latest_end = deadline - self.retries * max(c.period for c in pending) - self.guard
+        best: Optional[Tuple[float, float]] = None
+        for anchor in pending:
+            # Try each expected advertisement of each sensor as the first one in the window.
+            at = anchor.predict(now)
+            while at <= latest_end:
+                start = end = at
+                for cadence in pending:
+                    t = cadence.predict(at)
+                    pad = self._pad(cadence, t)
+                    start = min(start, t - pad)
+                    end = max(end, t + pad)
+                start = max(start, now)
+                if end <= latest_end and (
+                    best is None
+                    or end - start < best[1] - best[0] - 1e-3
+                    or (end - start <= best[1] - best[0] + 1e-3 and start < best[0])
+                ):
+                    best = (start, end)
+                at += anchor.period
+        return best
+
+    def end_cycle(self) -> List[str]:
+        """Close the cycle at a write; returns the needed sensors that were not heard."""
+        missed = [mac for mac in self.cadences if mac not in self.heard]
+        for mac in missed:
+            self.cadences[mac].misses += 1
+        self.heard.clear()
+        return missed
+
+
+class DutyCycledScanner:
+    """Scanner factory that only runs the real scanner when `DutyCycle` expects the needed sensors.
+
+    Pass it as `scanner_factory`. The logger calls `wrote(now)` after each
+    write pass, which closes the cycle; without those calls cycles end every
+    `interval` seconds. If a window ends before every needed sensor was
+    heard, scanning is extended until they are or the write comes. Other
+    devices are still forwarded whenever the scanner happens to be running.
+    """
+
+    def __init__(
+        self,
+        needed: Iterable[str],
+        interval: float,
+        scanner_factory: Optional[Callable] = None,
+        **cycle_opts,
+    ) -> None:
+        needed = [mac.upper() for mac in needed]
+        self.cycle = DutyCycle(needed, **cycle_opts)
+        self.allowlist = Allowlist(needed)
+        self.interval = interval
+        self._factory = scanner_factory
+        self._cb: Optional[Callable] = None
+        self._scanner = None
+        self._scanning_since: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self._complete: Optional[asyncio.Event] = None
+        self._wrote: Optional[asyncio.Event] = None
+        self._deadline = 0.0
+        self._started = 0.0
+        self._cpu_started = 0.0
+        self.scan_seconds = 0.0
+        self.cycles = {mode: 0 for mode in _CYCLES}
+        self.missed = 0
+
+    def __call__(self, cb: Callable) -> "DutyCycledScanner":
+        self._cb = cb
+        return self
+
+    def _on_advertisement(self, device, adv) -> None:
+        mac = self.allowlist.match(device, adv)
+        if mac is not None and self.cycle.observe(mac, time.time()):
+            self._complete.set()
+        self._cb(device, adv)
+
+    def wrote(self, now: float) -> None:
+        self._deadline = now + self.interval
+        if self._wrote is not None:
+            self._wrote.set()
+
+    async def _radio(self, on: bool) -> None:
+        if on and self._scanning_since is None:
+            await self._scanner.start()
+            self._scanning_since = time.monotonic()
+        elif not on and self._scanning_since is not None:
+            await self._scanner.stop()
+            elapsed = time.monotonic() - self._scanning_since
+            self._scanning_since = None
+            self.scan_seconds += elapsed
+            _SCAN_SECONDS.inc(elapsed)
+
+    async def _listen(self, until: float) -> None:
+        """Scan until every needed sensor was heard this cycle or `until` passes."""
+        await self._radio(True)
+        if not self.cycle.complete:
+            try:
+                await asyncio.wait_for(self._complete.wait(), max(0.0, until - time.time()))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            started = time.time()
+            scanned = self._scanned()
+            if self.cycle.learning():
+                mode = "continuous"
+                await self._radio(True)
+            else:
+                mode = "window"
+                while not self.cycle.complete:
+                    window = self.cycle.plan(time.time(), self._deadline)
+                    if window is None:
+                        mode = "extended"
+                        await self._listen(self._deadline)
+                        break
+                    await self._radio(False)
+                    await asyncio.sleep(max(0.0, window[0] - time.time()))
+                    await self._listen(window[1])
+                    if not self.cycle.complete:
+                        mode = "extended"
+                await self._radio(False)
+            try:
+                await asyncio.wait_for(self._wrote.wait(), max(0.0, self._deadline - time.time()) + self.interval)
+            except asyncio.TimeoutError:
+                self._deadline = time.time() + self.interval
+            self._wrote.clear()
+            self._complete.clear()
+            missed = self.cycle.end_cycle()
+            self.cycles[mode] += 1
+            _CYCLES[mode].inc()
+            if mode == "continuous":
+                missed = []  # still learning (or the first, empty cycle at startup): nothing was scheduled
+            self.missed += len(missed)
+            _MISSED.inc(len(missed))
+            report = self.report()
+            print(
+                f"[{_now().isoformat()}] scan {mode}: {self._scanned() - scanned:.1f}s of "
+                f"{time.time() - started:.1f}s, duty {report['duty']:.0%}, cpu {report['cpu_percent']:.1f}%"
+                + (f", missed {', '.join(missed)}" if missed else ""),
+                flush=True,
+            )
+
+    def _scanned(self) -> float:
+        if self._scanning_since is None:
+            return self.scan_seconds
+        return self.scan_seconds + time.monotonic() - self._scanning_since
+
+    def report(self) -> dict:
+        """Scanning time and process CPU since start."""
+        elapsed = time.time() - self._started
+        scanned = self._scanned()
+        cpu = time.process_time() - self._cpu_started
+        return {
+            "elapsed": round(elapsed, 1),
+            "scan_seconds": round(scanned, 1),
+            "duty": scanned / elapsed if elapsed > 0 else 1.0,
+            "cpu_seconds": round(cpu, 2),
+            "cpu_percent": 100 * cpu / elapsed if elapsed > 0 else 0.0,
+            "cycles": dict(self.cycles),
+            "missed": self.missed,
+        }
+
+    async def start(self) -> None:
+        factory = self._factory
+        if factory is None:
+            from bleak import BleakScanner
+
+            factory = BleakScanner
+        self._scanner = factory(self._on_advertisement)
+        self._complete = asyncio.Event()
+        self._wrote = asyncio.Event()
+        self._started = time.time()
+        self._cpu_started = time.process_time()
+        self._deadline = self._started + self.interval
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self._radio(False)
+        report = self.report()
+        print(
+            f"[{_now().isoformat()}] scanned {report['scan_seconds']}s of {report['elapsed']}s "
+            f"(duty {report['duty']:.0%}), cpu {report['cpu_percent']:.1f}%, cycles {report['cycles']}, "
+            f"missed {report['missed']}",
+            flush=True,
+        )
+
+
+def _advertisements(
+    period: float, duration: float, loss: float, jitter: float, rng: random.Random
+) -> List[float]:
+    out = []
+    t = rng.uniform(0, period)
+    while t < duration:
+        if rng.random() >= loss:
+            out.append(t + rng.uniform(0, jitter))
+        t += period
+    return out
+
+
+def simulate(
+    sensors: int = 12,
+    interval: float = 30.0,
+    hours: float = 6.0,
+    period_min: float = 1.0,
+    period_max: float = 5.0,
+    loss: float = 0.05,
+    jitter: float = 0.01,
+    seed: int = 1,
+    **cycle_opts,
+) -> dict:
+    """Run DutyCycle against synthetic advertisement timing and report freshness and scan time.
+
+    Each sensor advertises at its own fixed period with a random phase, a
+    random delay of up to `jitter` seconds per advertisement (BLE's advDelay
+    is up to 10 ms) and independent `loss`. A write is fresh for a sensor if
+    the sensor was heard since the previous write; the same figure for a
+    scanner that never stops is reported for comparison.
+    """
+    rng = random.Random(seed)
+    duration = hours * 3600
+    macs = [f"00:00:00:00:00:{i:02X}" for i in range(sensors)]
+    periods = {mac: rng.uniform(period_min, period_max) for mac in macs}
+    times = {mac: _advertisements(periods[mac], duration, loss, jitter, rng) for mac in macs}
+    cycle = DutyCycle(macs, **cycle_opts)
+    last_heard: Dict[str, float] = {}
+
+    def listen(start: float, end: float, stop_when_complete: bool) -> float:
+        """Feed the advertisements in [start, end) in time order; returns when scanning stopped."""
+        events = []
+        for mac in macs:
+            ts = times[mac]
+            i = bisect_left(ts, start)
+            while i < len(ts) and ts[i] < end:
+                events.append((ts[i], mac))
+                i += 1
+        for t, mac in sorted(events):
+            last_heard[mac] = t
+            if cycle.observe(mac, t) and stop_when_complete:
+                return t
+        return end
+
+    now, deadline = 0.0, interval
+    scanned = 0.0
+    fresh = fresh_continuous = writes = 0
+    ages: List[float] = []
+    modes = {mode: 0 for mode in _CYCLES}
+    while deadline <= duration:
+        if cycle.learning():
+            mode = "continuous"
+            scanned += listen(now, deadline, False) - now
+        else:
+            mode = "window"
+            t = now
+            while not cycle.complete:
+                window = cycle.plan(t, deadline)
+                if window is None:
+                    mode = "extended"
+                    scanned += listen(t, deadline, True) - t
+                    break
+                t = listen(window[0], window[1], True)
+                scanned += t - window[0]
+                if not cycle.complete:
+                    mode = "extended"
+        modes[mode] += 1
+        for mac in macs:
+            writes += 1
+            heard = mac in cycle.heard
+            fresh += heard
+            if heard:
+                ages.append(deadline - last_heard[mac])
+            i = bisect_left(times[mac], deadline - interval)
+            fresh_continuous += i < len(times[mac]) and times[mac][i] < deadline
+        cycle.end_cycle()
+        now, deadline = deadline, deadline + interval
+    ages.sort()
+    elapsed = now
+    return {
+        "sensors": sensors,
+        "interval": interval,
+        "hours": hours,
+        "writes": writes,
+        "duty": round(scanned / elapsed, 4) if elapsed else 1.0,
+        "scan_seconds_per_hour": round(3600 * scanned / elapsed, 1) if elapsed else 3600.0,
+        "fresh": round(fresh / writes, 5) if writes else 1.0,
+        "fresh_continuous": round(fresh_continuous / writes, 5) if writes else 1.0,
+        "age_p50": round(ages[len(ages) // 2], 2) if ages else None,
+        "age_max": round(ages[-1], 2) if ages else None,
+        "cycles": modes,
+    }
+
+
+def add_duty_cycle_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--duty-cycle",
+        action="store_true",
+        help="Scan only when the sensors in --names are expected to advertise (learns their periods)",
+    )
+    parser.add_argument(
+        "--duty-guard", type=float, default=0.3, help="Seconds scanned either side of an expected advertisement"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simulate adaptive scan duty-cycling on synthetic advertisements.")
+    parser.add_argument("--sensors", type=int, default=12)
+    parser.add_argument("--interval", type=float, default=30.0, help="Seconds between writes")
+    parser.add_argument("--hours", type=float, default=6.0, help="Simulated time")
+    parser.add_argument("--period-min", type=float, default=1.0, help="Shortest advertising period in seconds")
+    parser.add_argument("--period-max", type=float, default=5.0, help="Longest advertising period in seconds")
+    parser.add_argument("--loss", type=float, default=0.05, help="Probability that one advertisement is missed")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Random delay added to each advertisement")
+    parser.add_argument("--guard", type=float, default=0.3, help="Seconds scanned either side of a prediction")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    result = simulate(
+        args.sensors,
+        args.interval,
+        args.hours,
+        args.period_min,
+        args.period_max,
+        args.loss,
+        args.jitter,
+        args.seed,
+        guard=args.guard,
+    )
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
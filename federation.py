@@ -0,0 +1,417 @@
+import argparse
+import asyncio
+import functools
+import random
+import socket
+import struct
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from adv_capture import (
+    Frame,
+    decode_frame,
+    encode_frame,
+    frame_from_callback,
+    iter_records,
+    record_key,
+    record_rssi,
+    to_callback_args,
+)
+from switchbot_decoder import _looks_like_switchbot
+
+_MAGIC = b"SBF1"
+# Datagram header: magic, sequence number, node id length; then the node id
+# and advertisement records in the capture-file encoding, back to back.
+_DATAGRAM = struct.Struct("<4sIB")
+# Skipped sequence numbers remembered for late arrival (larger gaps are only counted as loss).
+_REORDER_WINDOW = 1024
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _host_port(value: str, default_host: str) -> Tuple[str, int]:
+    host, _, port = value.rpartition(":")
+    return host or default_host, int(port)
+
+
+class NodeSender:
+    """Forward a scanner's advertisements to a collector as batched UDP datagrams.
+
+    Frames are packed until a datagram would exceed `max_datagram` bytes or
+    `flush_interval` passes, so a busy node sends a few dozen datagrams per
+    second rather than one per advertisement.
+    """
+
+    def __init__(
+        self,
+        collector: Tuple[str, int],
+        node_id: str,
+        *,
+        max_datagram: int = 1400,
+        flush_interval: float = 0.05,
+        switchbot_only: bool = True,
+    ) -> None:
+        self.collector = collector
+        self.node_id = node_id.encode()[:255]
+        self.max_datagram = max_datagram
+        self.flush_interval = flush_interval
+        self.switchbot_only = switchbot_only
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._records: List[bytes] = []
+        self._size = 0
+        self._seq = 0
+        self._task: Optional[asyncio.Task] = None
+        self.frames = 0
+        self.datagrams = 0
+
+    def on_advertisement(self, device, adv) -> None:
+        if self.switchbot_only and not _looks_like_switchbot(device.name or "", adv):
+            return
+        self.send(frame_from_callback(device, adv))
+
+    def send(self, frame: Frame) -> None:
+        record = encode_frame(frame)
+        overhead = _DATAGRAM.size + len(self.node_id)
+        if self._records and overhead + self._size + len(record) > self.max_datagram:
+            self.flush()
+        self._records.append(record)
+        self._size += len(record)
+        self.frames += 1
+
+    def flush(self) -> None:
+        if not self._records or self._transport is None:
+            return
+        header = _DATAGRAM.pack(_MAGIC, self._seq, len(self.node_id)) + self.node_id
+        self._transport.sendto(header + b"".join(self._records))
+        self._seq = (self._seq + 1) & 0xFFFFFFFF
+        self.datagrams += 1
+        self._records.clear()
+        self._size = 0
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(asyncio.DatagramProtocol, remote_addr=self.collector)
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self.flush()
+        if self._transport is not None:
+            self._transport.close()
+
+
+class _NodeStats:
+    __slots__ = ("address", "next_seq", "datagrams", "frames", "lost", "reordered", "restarts", "_missing")
+
+    def __init__(self, address: tuple) -> None:
+        self.address = address
+        self.next_seq: Optional[int] = None
+        self.datagrams = 0
+        self.frames = 0
+        self.lost = 0
+        self.reordered = 0
+        self.restarts = 0
+        self._missing: Set[int] = set()  # recently skipped sequence numbers that may still arrive late
+
+    def sequence(self, seq: int) -> None:
+        """Count the datagrams skipped before `seq`; late datagrams and node restarts are not loss."""
+        if self.next_seq is not None and seq != self.next_seq:
+            ahead = (seq - self.next_seq) & 0xFFFFFFFF
+            if ahead < 0x80000000:
+                self.lost += ahead
+                if ahead <= _REORDER_WINDOW:
+                    self._missing.update((self.next_seq + i) & 0xFFFFFFFF for i in range(ahead))
+                    if len(self._missing) > _REORDER_WINDOW:
+                        self._missing = {
+                            m for m in self._missing if (seq - m) & 0xFFFFFFFF <= _REORDER_WINDOW
+                        }
+            elif seq in self._missing:
+                # Counted as lost when the datagrams after it arrived first.
+                self._missing.discard(seq)
+                self.reordered += 1
+                self.lost -= 1
+                return
+            else:
+                # Behind and never skipped: the node restarted its sequence.
+                self.restarts += 1
+                self._missing.clear()
+        self.next_seq = (seq + 1) & 0xFFFFFFFF
+
+
+class Collector(asyncio.DatagramProtocol):
+    """Receive frames from many nodes and hand each advertisement to one callback once.
+
+    Copies of the same advertisement (same address and payload) heard by
+    several nodes are held for `hold` seconds and only the best-RSSI copy is
+    delivered; copies that arrive up to `window` seconds later are dropped.
+    Duplicates are recognised from the raw record bytes, so only delivered
+    copies are ever decoded. Use an instance as the `scanner_factory` of the
+    scan/log entry points.
+    """
+
+    def __init__(self, host: str = "0.0.0.0", port: int = 9999, *, hold: float = 0.2, window: float = 0.5) -> None:
+        self.host = host
+        self.port = port
+        self.hold = hold
+        self.window = max(window, hold)
+        self._callback: Optional[Callable] = None
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self._task: Optional[asyncio.Task] = None
+        # Both dicts are in arrival order, so expiry only looks at the front.
+        self._pending: Dict[bytes, List] = {}  # key -> [rssi, header, body, first seen]
+        self._recent: Dict[bytes, float] = {}  # key -> drop copies until
+        self.nodes: Dict[str, _NodeStats] = {}
+        self.received = 0
+        self.delivered = 0
+        self.duplicates = 0
+        self.malformed = 0
+
+    def __call__(self, callback: Callable) -> "Collector":
+        self._callback = callback
+        return self
+
+    def datagram_received(self, data: bytes, addr: tuple) -> None:
+        if len(data) < _DATAGRAM.size:
+            self.malformed += 1
+            return
+        magic, seq, id_len = _DATAGRAM.unpack_from(data)
+        if magic != _MAGIC:
+            self.malformed += 1
+            return
+        pos = _DATAGRAM.size + id_len
+        node_id = data[_DATAGRAM.size : pos].decode(errors="replace")
+        stats = self.nodes.get(node_id)
+        if stats is None:
+            stats = self.nodes[node_id] = _NodeStats(addr)
+        stats.sequence(seq)
+        stats.datagrams += 1
+        now = time.monotonic()
+        recent = self._recent
+        pending = self._pending
+        for header, body in iter_records(data, pos):
+            stats.frames += 1
+            self.received += 1
+            key = record_key(header, body)
+            if key in recent:
+                self.duplicates += 1
+                continue
+            entry = pending.get(key)
+            rssi = record_rssi(header)
+            if entry is None:
+                pending[key] = [rssi, header, body, now]
+                continue
+            self.duplicates += 1
+            if rssi is not None and (entry[0] is None or rssi > entry[0]):
+                entry[0], entry[1], entry[2] = rssi, header, body
+
+    def release(self, now: Optional[float] = None) -> None:
+        """Deliver every held advertisement whose `hold` time is over."""
+        now = time.monotonic() if now is None else now
+        recent = self._recent
+        while recent:
+            key, until = next(iter(recent.items()))
+            if until > now:
+                break
+            del recent[key]
+        pending = self._pending
+        while pending:
+            key, (_, header, body, first) = next(iter(pending.items()))
+            if first + self.hold > now:
+                break
+            del pending[key]
+            recent[key] = first + self.window
+            try:
+                frame = decode_frame(header, body)
+            except (struct.error, ValueError, IndexError):
+                self.malformed += 1
+                continue
+            self.delivered += 1
+            if self._callback is not None:
+                self._callback(*to_callback_args(frame))
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.hold / 2)
+            self.release()
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(lambda: self, local_addr=(self.host, self.port))
+        sock = self._transport.get_extra_info("socket")
+        try:
+            # Absorb bursts from dozens of nodes while the loop is busy decoding.
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except OSError:
+            pass
+        self.port = sock.getsockname()[1]
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._transport is not None:
+            self._transport.close()
+        self.release(float("inf"))
+
+    def report(self) -> str:
+        lost = sum(n.lost for n in self.nodes.values())
+        reordered = sum(n.reordered for n in self.nodes.values())
+        restarts = sum(n.restarts for n in self.nodes.values())
+        return (
+            f"{len(self.nodes)} node(s), {self.received} frame(s) received, {self.delivered} delivered, "
+            f"{self.duplicates} duplicate(s), {lost} datagram(s) lost, {reordered} reordered, "
+            f"{restarts} node restart(s), {self.malformed} malformed"
+        )
+
+
+async def run_node(
+    collector: Tuple[str, int],
+    node_id: str,
+    adapter: Optional[str] = None,
+    switchbot_only: bool = True,
+    scanner_factory: Optional[Callable] = None,
+) -> None:
+    sender = NodeSender(collector, node_id, switchbot_only=switchbot_only)
+    await sender.start()
+    if scanner_factory is None:
+        from bleak import BleakScanner
+
+        scanner_factory = functools.partial(BleakScanner, adapter=adapter) if adapter else BleakScanner
+    scanner = scanner_factory(sender.on_advertisement)
+    await scanner.start()
+    print(f"[{_now().isoformat()}] node {node_id} forwarding to {collector[0]}:{collector[1]}", flush=True)
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"[{_now().isoformat()}] sent {sender.frames} frame(s) in {sender.datagrams} datagram(s)", flush=True)
+    finally:
+        await scanner.stop()
+        await sender.close()
+
+
+async def run_collector(host: str, port: int, hold: float, window: float) -> None:
+    seen: Dict[str, int] = {}
+
+    def cb(device, adv) -> None:
+        seen[device.address] = seen.get(device.address, 0) + 1
+
+    collector = Collector(host, port, hold=hold, window=window)
+    collector(cb)
+    await collector.start()
+    print(f"[{_now().isoformat()}] collector on {host}:{collector.port}", flush=True)
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"[{_now().isoformat()}] {collector.report()}, {len(seen)} device(s)", flush=True)
+    finally:
+        await collector.stop()
+
+
+async def run_fake(path: str, nodes: int, loops: int, speed: float, hold: float) -> None:
+    """Collector plus `nodes` fake nodes replaying one capture with per-node RSSI, all on localhost."""
+    from replay import Replay
+
+    delivered: Dict[str, int] = {}
+
+    def cb(device, adv) -> None:
+        delivered[device.address] = delivered.get(device.address, 0) + 1
+
+    collector = Collector("127.0.0.1", 0, hold=hold, window=hold * 2)
+    collector(cb)
+    await collector.start()
+    senders, replays, scanners = [], [], []
+    for i in range(nodes):
+        sender = NodeSender(("127.0.0.1", collector.port), f"fake-{i}", switchbot_only=False)
+        await sender.start()
+        offset = random.randint(-15, 15)
+
+        def forward(device, adv, sender=sender, offset=offset) -> None:
+            frame = frame_from_callback(device, adv)
+            sender.send(frame._replace(rssi=None if frame.rssi is None else frame.rssi + offset))
+
+        replay = Replay(path, speed=speed, loops=loops)
+        scanner = replay(forward)
+        senders.append(sender)
+        replays.append(replay)
+        scanners.append(scanner)
+    start = time.perf_counter()
+    for scanner in scanners:
+        await scanner.start()
+    for replay in replays:
+        await replay.wait()
+    for sender in senders:
+        await sender.close()
+    sent = sum(s.frames for s in senders)
+    # Wait for in-flight datagrams, until everything arrived or nothing moved for a second.
+    last, idle = -1, 0.0
+    while collector.received < sent and idle < 1.0:
+        await asyncio.sleep(0.05)
+        idle = idle + 0.05 if collector.received == last else 0.0
+        last = collector.received
+    elapsed = time.perf_counter() - start
+    await collector.stop()
+    print(f"{nodes} node(s) sent {sent} frame(s), collector took {collector.received} in {elapsed:.2f}s "
+          f"({collector.received / elapsed:,.0f} frames/s)")
+    print(collector.report())
+    received = sum(n.datagrams for n in collector.nodes.values())
+    sent_datagrams = sum(s.datagrams for s in senders)
+    print(f"{received}/{sent_datagrams} datagram(s) arrived")
+    print(f"{sum(delivered.values())} advertisement(s) delivered for {len(delivered)} device(s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Federate several BLE scanners into one collector over UDP.")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    node = sub.add_parser("node", help="Scan locally and forward advertisements to a collector")
+    node.add_argument("--collector", required=True, metavar="HOST:PORT", help="Collector address")
+    node.add_argument("--adapter", default=None, help="Bluetooth adapter to scan with, e.g. hci1")
+    node.add_argument("--node-id", default=socket.gethostname(), help="Name reported to the collector")
+    node.add_argument("--all", action="store_true", help="Forward every advertisement, not only SwitchBot ones")
+    node.add_argument("--replay", default=None, metavar="CAPTURE", help="Forward a capture instead of scanning")
+    node.add_argument("--speed", type=float, default=1.0, help="Replay speed with --replay")
+
+    collector = sub.add_parser("collector", help="Receive and deduplicate frames, printing statistics")
+    collector.add_argument("--listen", default="0.0.0.0:9999", metavar="HOST:PORT")
+    collector.add_argument("--hold", type=float, default=0.2, help="Seconds to wait for better-RSSI copies")
+    collector.add_argument("--window", type=float, default=0.5, help="Seconds during which late copies are dropped")
+
+    fake = sub.add_parser("fake", help="Benchmark: collector plus fake nodes replaying a capture on localhost")
+    fake.add_argument("capture")
+    fake.add_argument("--nodes", type=int, default=24)
+    fake.add_argument("--loops", type=int, default=1)
+    fake.add_argument("--speed", type=float, default=1.0, help="Replay speed per node (0 = as fast as possible)")
+    fake.add_argument("--hold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.mode == "node":
+        factory = None
+        if args.replay:
+            from replay import Replay
+
+            factory = Replay(args.replay, speed=args.speed)
+        node_id = f"{args.node_id}-{args.adapter}" if args.adapter else args.node_id
+        coro = run_node(_host_port(args.collector, "127.0.0.1"), node_id, args.adapter, not args.all, factory)
+    elif args.mode == "collector":
+        coro = run_collector(*_host_port(args.listen, "0.0.0.0"), args.hold, args.window)
+    else:
+        coro = run_fake(args.capture, args.nodes, args.loops, args.speed, args.hold)
+    try:
+        asyncio.run(coro)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
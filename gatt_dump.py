@@ -1,11 +1,27 @@
 import argparse
 import asyncio
+from datetime import datetime
 from typing import Optional
 
-from bleak import BleakClient
+
+def print_cached(address: str, cache_path: str) -> bool:
+    """Print the table gatt_inventory.py cached for `address`; False if there is none."""
+    from gatt_inventory import GattCache
+
+    entry = GattCache(cache_path).get(address)
+    if entry is None:
+        return False
+    print(f"Cached: {datetime.fromtimestamp(entry['discovered']).isoformat(timespec='seconds')}")
+    for service in entry["services"]:
+        print(f"\n[Service] {service['uuid']} ({service['description']})")
+        for char in service["characteristics"]:
+            print(f"  [Char] {char['uuid']} ({char['description']}) props={','.join(char['properties'])}")
+    return True
 
 
 async def dump_gatt(address: str, *, read: bool) -> None:
+    from bleak import BleakClient
+
     async with BleakClient(address) as client:
         print(f"Connected: {client.is_connected}")
         if hasattr(client, "get_services"):
@@ -30,8 +46,21 @@ def main() -> None:
     parser = argparse.ArgumentParser(description="Dump GATT services/characteristics.")
     parser.add_argument("address", help="BLE address/UUID shown by scan")
     parser.add_argument("--read", action="store_true", help="Attempt to read readable chars/descriptors")
+    parser.add_argument(
+        "--cached",
+        nargs="?",
+        const="",
+        default=None,
+        metavar="CACHE",
+        help="Print the table cached by gatt_inventory.py instead of connecting (falls back to connecting)",
+    )
     args = parser.parse_args()
 
+    if args.cached is not None and not args.read:
+        from gatt_inventory import DEFAULT_CACHE
+
+        if print_cached(args.address, args.cached or DEFAULT_CACHE):
+            return
     asyncio.run(dump_gatt(args.address, read=args.read))
 
 
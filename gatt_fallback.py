@@ -0,0 +1,82 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Set
+
+from gatt_pool import GattPool
+from sensor_registry import SensorRegistry, mac_to_int
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class GattFallback:
+    """Actively read known sensors over GATT only when their advertisements go quiet.
+
+    `check` is called once per logger tick with the passive sensor registry. Any
+    known sensor whose last reading is older than `after` seconds gets one GATT
+    read, limited to `max_connections` at a time and at most once per
+    `cooldown` seconds per sensor. Successful reads are stored in the
+    registry like an advertisement.
+    """
+
+    def __init__(
+        self,
+        macs: Iterable[str],
+        *,
+        after: float,
+        cooldown: float = 300.0,
+        max_connections: int = 1,
+        timeout: float = 5.0,
+        idle_timeout: float = 30.0,
+    ) -> None:
+        self.macs = [m.upper() for m in macs if len(m) == 17]
+        self.after = after
+        self.cooldown = cooldown
+        self.timeout = timeout
+        self._pool = GattPool(idle_timeout=idle_timeout)
+        self._limiter = asyncio.Semaphore(max(1, max_connections))
+        self._next_allowed: Dict[str, float] = {}
+        self._in_flight: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.reads = 0
+        self.failures = 0
+
+    def check(self, registry: SensorRegistry, now: float) -> None:
+        for mac in self.macs:
+            if mac in self._in_flight or now < self._next_allowed.get(mac, 0.0):
+                continue
+            record = registry.get(mac_to_int(mac))
+            if record is not None and (now - record.seen) <= self.after:
+                continue
+            self._in_flight.add(mac)
+            self._next_allowed[mac] = now + self.cooldown
+            task = asyncio.create_task(self._read(mac, registry))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _read(self, mac: str, registry: SensorRegistry) -> None:
+        try:
+            async with self._limiter:
+                data = await self._pool.read_value(mac, timeout=self.timeout)
+        except Exception as exc:
+            data = None
+            print(f"[{_now().isoformat()}] gatt fallback {mac} failed: {exc}", flush=True)
+        finally:
+            self._in_flight.discard(mac)
+        if not data:
+            self.failures += 1
+            print(f"[{_now().isoformat()}] gatt fallback {mac}: no response", flush=True)
+            return
+        self.reads += 1
+        data["mac"] = mac
+        data["source"] = "gatt"
+        registry.update(mac_to_int(mac), data, time.time())
+        print(f"[{_now().isoformat()}] gatt fallback {mac} tempc={data['tempc']} hum={data['hum']}", flush=True)
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._pool.close()
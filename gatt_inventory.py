@@ -0,0 +1,211 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from gatt_pool import GattConnection
+from read_meter_gatt import (
+    _build_basic_info_req,
+    _build_hw_version_req,
+    _build_read_value_req,
+    _parse_basic_info_resp,
+    _parse_hw_version_resp,
+    _parse_value_resp,
+)
+
+SERVICE_UUID = "cba20d00-224d-11e6-9fb8-0002a5d5c51b"
+DEFAULT_CACHE = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "switchbot", "gatt.json")
+
+# (name, request, parser): what the inventory asks every meter, in one write burst.
+COMMANDS = (
+    ("basic_info", _build_basic_info_req(), _parse_basic_info_resp),
+    ("hw_version", _build_hw_version_req(), _parse_hw_version_resp),
+    ("value", _build_read_value_req(), _parse_value_resp),
+)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def gatt_table(services) -> List[dict]:
+    """Bleak's service collection as plain data: services, their characteristics and properties."""
+    return [
+        {
+            "uuid": service.uuid,
+            "description": service.description,
+            "characteristics": [
+                {"uuid": char.uuid, "description": char.description, "properties": list(char.properties)}
+                for char in service.characteristics
+            ],
+        }
+        for service in services
+    ]
+
+
+class GattCache:
+    """Discovered GATT tables per address in one JSON file.
+
+    With a cached table, the inventory connects asking Bleak to resolve only
+    the SwitchBot communication service instead of the whole table.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE) -> None:
+        self.path = Path(path)
+        self._tables: Dict[str, dict] = {}
+        if self.path.exists():
+            self._tables = json.loads(self.path.read_text())
+        self._dirty = False
+
+    def get(self, address: str) -> Optional[dict]:
+        return self._tables.get(address.upper())
+
+    def put(self, address: str, services: List[dict]) -> None:
+        self._tables[address.upper()] = {"discovered": time.time(), "services": services}
+        self._dirty = True
+
+    def has_service(self, address: str, uuid: str = SERVICE_UUID) -> bool:
+        entry = self.get(address)
+        return entry is not None and any(s["uuid"] == uuid for s in entry["services"])
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(self._tables, indent=1, sort_keys=True))
+        tmp.replace(self.path)
+        self._dirty = False
+
+
+def _match(responses: List[bytes]) -> Dict[str, dict]:
+    """Assign pipelined responses to commands: in order where they parse, else to the first command they fit."""
+    results: Dict[str, dict] = {}
+    unused = list(responses)
+    for name, _, parse in COMMANDS:
+        for i, raw in enumerate(unused):
+            parsed = parse(raw)
+            if parsed is not None:
+                results[name] = parsed
+                del unused[i]
+                break
+    return results
+
+
+async def inventory_device(
+    device: dict,
+    cache: GattCache,
+    limiter: asyncio.Semaphore,
+    timeout: float,
+    refresh: bool = False,
+    client_factory: Optional[Callable] = None,
+) -> dict:
+    """Connect once, send every command in one burst, retry the unanswered ones singly; one JSON-able dict."""
+    address = device["address"]
+    out = {"address": address.upper(), "name": device.get("name", "")}
+    cached = not refresh and cache.has_service(address)
+    if client_factory is None:
+        from bleak import BleakClient
+
+        client_factory = BleakClient
+    if cached:
+        client_factory = functools.partial(client_factory, services=[SERVICE_UUID])
+    conn = GattConnection(address, idle_timeout=timeout * 4, backoff_base=0.0, client_factory=client_factory)
+    async with limiter:
+        started = time.perf_counter()
+        try:
+            responses = await conn.pipeline([request for _, request, _ in COMMANDS], timeout)
+            results = _match(responses)
+            for name, request, parse in COMMANDS:
+                if name in results or not conn.is_connected:
+                    continue
+                raw = await conn.request(request, timeout, accept=lambda data, parse=parse: parse(data) is not None)
+                if raw is not None:
+                    results[name] = parse(raw)
+            if conn.client is not None and not cached:
+                cache.put(address, gatt_table(conn.client.services))
+        finally:
+            await conn.close()
+        out["seconds"] = round(time.perf_counter() - started, 3)
+    out["gatt_cached"] = cached
+    for name, _, _ in COMMANDS:
+        out.update(results.get(name, {}))
+    missing = [name for name, _, _ in COMMANDS if name not in results]
+    out["ok"] = not missing
+    if missing:
+        out["missing"] = missing
+    return out
+
+
+async def inventory(
+    devices: List[dict],
+    cache: GattCache,
+    concurrency: int = 2,
+    timeout: float = 5.0,
+    refresh: bool = False,
+    client_factory: Optional[Callable] = None,
+) -> List[dict]:
+    limiter = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(device: dict) -> dict:
+        try:
+            result = await inventory_device(device, cache, limiter, timeout, refresh, client_factory)
+        except Exception as exc:
+            # One unreachable meter must not hide the others.
+            result = {"address": device["address"].upper(), "name": device.get("name", ""), "ok": False}
+            result["error"] = str(exc) or type(exc).__name__
+        status = "ok" if result["ok"] else f"incomplete ({', '.join(result.get('missing', [])) or result.get('error')})"
+        print(f"[{_now().isoformat()}] {result['address']} {status}", flush=True)
+        return result
+
+    try:
+        return list(await asyncio.gather(*(one(device) for device in devices)))
+    finally:
+        cache.save()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Read battery, firmware, hardware version and current value of every meter over GATT as JSON."
+    )
+    parser.add_argument("address", nargs="*", help="BLE addresses (default: every sensor in --names)")
+    parser.add_argument("--names", default="sensors.json", help="MAC->name JSON map file")
+    parser.add_argument("--concurrency", type=int, default=2, help="Max devices connected at once")
+    parser.add_argument("--timeout", type=float, default=5.0, help="Seconds to wait for the responses of one device")
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help="GATT table cache file")
+    parser.add_argument("--refresh", action="store_true", help="Rediscover every GATT table instead of using the cache")
+    parser.add_argument("-o", "--output", default="", help="Write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    from sensors_config import load_sensors
+
+    sensors = load_sensors(args.names)
+    addresses = args.address or list(sensors)
+    if not addresses:
+        parser.error("no addresses given and no sensors in --names")
+    devices = [{"address": a, "name": sensors.get(a.lower(), {}).get("name", "")} for a in addresses]
+    started = time.perf_counter()
+    results = asyncio.run(
+        inventory(devices, GattCache(args.cache), args.concurrency, args.timeout, args.refresh)
+    )
+    report = {
+        "generated": _now().isoformat(),
+        "seconds": round(time.perf_counter() - started, 3),
+        "devices": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        ok = sum(result["ok"] for result in results)
+        print(f"[{_now().isoformat()}] {ok}/{len(results)} device(s) complete, written to {args.output}", flush=True)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import asyncio
+import random
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Set
+
+
+from read_meter_gatt import NOTIFY_UUID, WRITE_UUID, _build_read_value_req, _parse_value_resp
+
+
+class GattConnection:
+    """One persistent BLE connection with the notify characteristic subscribed.
+
+    Requests are serialized: each write waits for the next notification that
+    `accept` recognizes as its response. After a failed connect or an
+    unexpected disconnect, reconnects are retried with jittered exponential
+    backoff; requests made while backing off fail fast with None. The link is
+    dropped after `idle_timeout` seconds without requests.
+    """
+
+    def __init__(
+        self,
+        address: str,
+        *,
+        idle_timeout: float = 300.0,
+        backoff_base: float = 1.0,
+        backoff_max: float = 120.0,
+        client_factory: Optional[Callable] = None,
+    ) -> None:
+        self.address = address
+        self.idle_timeout = idle_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._client_factory = client_factory
+        self._client = None
+        self._lock = asyncio.Lock()
+        self._pending: Optional[asyncio.Future] = None
+        self._accept: Optional[Callable[[bytes], bool]] = None
+        self._failures = 0
+        self._next_attempt = 0.0
+        self._idle_handle: Optional[asyncio.TimerHandle] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def client(self):
+        """The connected BleakClient, or None."""
+        return self._client if self.is_connected else None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._client is not None and self._client.is_connected
+
+    def _backoff(self) -> float:
+        delay = min(self.backoff_max, self.backoff_base * (2 ** min(self._failures, 16)))
+        return delay * random.uniform(0.5, 1.5)
+
+    def _on_notify(self, _: int, data: bytearray) -> None:
+        fut = self._pending
+        if fut is None or fut.done():
+            return
+        raw = bytes(data)
+        if self._accept is None or self._accept(raw):
+            fut.set_result(raw)
+
+    def _on_disconnect(self, client) -> None:
+        if client is not self._client:
+            return
+        self._client = None
+        if self._pending is not None and not self._pending.done():
+            self._pending.set_exception(ConnectionError(f"{self.address} disconnected"))
+        if not self._closing and self._idle_handle is not None:
+            self._failures += 1
+            self._reconnect_task = asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._next_attempt = max(self._next_attempt, loop.time() + self._backoff())
+        while not self._closing and not self.is_connected and self._idle_handle is not None:
+            await asyncio.sleep(max(0.0, self._next_attempt - loop.time()))
+            async with self._lock:
+                await self._connect()
+
+    async def _connect(self):
+        if self.is_connected:
+            return self._client
+        loop = asyncio.get_running_loop()
+        if loop.time() < self._next_attempt:
+            return None
+        if self._client_factory is None:
+            from bleak import BleakClient
+
+            self._client_factory = BleakClient
+        client = self._client_factory(self.address, disconnected_callback=self._on_disconnect)
+        try:
+            await client.connect()
+            await client.start_notify(NOTIFY_UUID, self._on_notify)
+        except Exception as exc:
+            self._failures += 1
+            self._next_attempt = loop.time() + self._backoff()
+            print(f"{self.address}: connect failed ({exc}), retry in {self._next_attempt - loop.time():.1f}s")
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+            return None
+        self._client = client
+        self._failures = 0
+        self._next_attempt = 0.0
+        return client
+
+    def _touch(self) -> None:
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._idle_handle = loop.call_later(self.idle_timeout, lambda: loop.create_task(self._idle_disconnect()))
+
+    async def _idle_disconnect(self) -> None:
+        self._idle_handle = None
+        async with self._lock:
+            await self._disconnect()
+
+    async def _disconnect(self) -> None:
+        client, self._client = self._client, None
+        if client is None:
+            return
+        try:
+            await client.stop_notify(NOTIFY_UUID)
+        except Exception:
+            pass
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+
+    async def _exchange(
+        self, payloads: List[bytes], timeout: float, accept: Optional[Callable[[bytes], bool]]
+    ) -> Optional[bytes]:
+        async with self._lock:
+            self._touch()
+            client = await self._connect()
+            if client is None:
+                return None
+            fut = asyncio.get_running_loop().create_future()
+            self._pending, self._accept = fut, accept
+            try:
+                for payload in payloads:
+                    await client.write_gatt_char(WRITE_UUID, payload, response=False)
+                return await asyncio.wait_for(fut, timeout=timeout)
+            except (asyncio.TimeoutError, ConnectionError):
+                return None
+            except Exception as exc:
+                print(f"{self.address}: request failed ({exc})")
+                await self._disconnect()
+                return None
+            finally:
+                self._pending, self._accept = None, None
+
+    async def request(
+        self, payload: bytes, timeout: float, accept: Optional[Callable[[bytes], bool]] = None
+    ) -> Optional[bytes]:
+        """Write `payload` and return the matching notification, or None on timeout/no link."""
+        return await self._exchange([payload], timeout, accept)
+
+    async def pipeline(self, payloads: List[bytes], timeout: float) -> List[bytes]:
+        """Write all `payloads` back to back, then collect up to one notification per payload.
+
+        Responses carry no request id: they come back in the order the device
+        answered, and the list is shorter if some never came within `timeout`.
+        """
+        responses: List[bytes] = []
+
+        def collect(raw: bytes) -> bool:
+            responses.append(raw)
+            return len(responses) >= len(payloads)
+
+        await self._exchange(payloads, timeout, collect)
+        return responses
+
+    async def release(self) -> None:
+        """Drop the link now; the next request reconnects."""
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            self._reconnect_task = None
+        async with self._lock:
+            await self._disconnect()
+
+    async def close(self) -> None:
+        self._closing = True
+        if self._idle_handle is not None:
+            self._idle_handle.cancel()
+            self._idle_handle = None
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+        async with self._lock:
+            await self._disconnect()
+
+
+class GattPool:
+    """Persistent GATT connections keyed by address.
+
+    With `max_links` set, at most that many links stay open: before a
+    request needs a new link the least recently used open ones are
+    released, since BlueZ adapters only have a few connection slots.
+    """
+
+    def __init__(self, max_links: Optional[int] = None, **connection_options) -> None:
+        self.max_links = max_links
+        self._options = connection_options
+        self._connections: Dict[str, GattConnection] = OrderedDict()
+        self._busy: Set[GattConnection] = set()
+        self.evicted = 0
+
+    def connection(self, address: str) -> GattConnection:
+        conn = self._connections.get(address)
+        if conn is None:
+            conn = self._connections[address] = GattConnection(address, **self._options)
+        else:
+            self._connections.move_to_end(address)
+        return conn
+
+    async def _make_room(self, conn: GattConnection) -> None:
+        if self.max_links is None or conn.is_connected:
+            return
+        # Links in use by another request count too: they may be connecting right now.
+        idle = [c for c in self._connections.values() if c is not conn and c.is_connected and c not in self._busy]
+        in_use = sum(1 for c in self._busy if c is not conn)
+        for victim in idle[: max(0, len(idle) + in_use - self.max_links + 1)]:
+            self.evicted += 1
+            await victim.release()
+
+    async def read_value(self, address: str, timeout: float) -> Optional[dict]:
+        conn = self.connection(address)
+        self._busy.add(conn)
+        try:
+            await self._make_room(conn)
+            raw = await conn.request(
+                _build_read_value_req(), timeout, accept=lambda data: _parse_value_resp(data) is not None
+            )
+        finally:
+            self._busy.discard(conn)
+        return _parse_value_resp(raw) if raw else None
+
+    async def close(self) -> None:
+        await asyncio.gather(*(conn.close() for conn in self._connections.values()))
+        self._connections.clear()
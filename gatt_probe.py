@@ -1,8 +1,6 @@
 import argparse
 import asyncio
-from typing import Optional
-
-from bleak import BleakClient
+from typing import List, Optional, Union
 
 DEFAULT_WRITE = "cba20002-224d-11e6-9fb8-0002a5d5c51b"
 DEFAULT_NOTIFY = "cba20003-224d-11e6-9fb8-0002a5d5c51b"
@@ -17,21 +15,25 @@ def _hex_to_bytes(s: str) -> bytes:
 
 async def probe(
     address: str,
-    payload_hex: str,
+    payload_hex: Union[str, List[str]],
     *,
     write_uuid: str,
     notify_uuid: str,
     timeout: float,
 ) -> None:
-    payload = _hex_to_bytes(payload_hex)
+    payloads = [_hex_to_bytes(p) for p in ([payload_hex] if isinstance(payload_hex, str) else payload_hex)]
 
     def on_notify(_: int, data: bytearray) -> None:
         print(f"notify: {data.hex()} (len={len(data)})")
 
+    from bleak import BleakClient
+
     async with BleakClient(address) as client:
         print(f"Connected: {client.is_connected}")
         await client.start_notify(notify_uuid, on_notify)
-        await client.write_gatt_char(write_uuid, payload, response=False)
+        # Several payloads are written back to back; notifications arrive in whatever order the device answers.
+        for payload in payloads:
+            await client.write_gatt_char(write_uuid, payload, response=False)
         try:
             await asyncio.sleep(timeout)
         finally:
@@ -41,7 +43,7 @@ async def probe(
 def main() -> None:
     parser = argparse.ArgumentParser(description="Send a write and listen for notifications.")
     parser.add_argument("address", help="BLE address/UUID shown by scan")
-    parser.add_argument("payload", help="Hex payload to write, e.g. A1B203")
+    parser.add_argument("payload", nargs="+", help="Hex payload(s) to write in one connection, e.g. 5702 570F14")
     parser.add_argument("--write", default=DEFAULT_WRITE, help="Write characteristic UUID")
     parser.add_argument("--notify", default=DEFAULT_NOTIFY, help="Notify characteristic UUID")
     parser.add_argument("--timeout", type=float, default=5.0, help="Seconds to listen for notifications")
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+from metrics import LATENCY_BUCKETS, REGISTRY
+from samples import Sample, to_line_protocol
+
+_PUSHES = REGISTRY.counter("switchbot_grafana_live_pushes_total", "Push requests to Grafana Live", result="ok")
+_PUSH_ERRORS = REGISTRY.counter("switchbot_grafana_live_pushes_total", "Push requests to Grafana Live", result="error")
+_POINTS = REGISTRY.counter("switchbot_grafana_live_points_total", "Readings pushed to Grafana Live")
+_COALESCED = REGISTRY.counter(
+    "switchbot_grafana_live_coalesced_total", "Readings replaced by a newer one of the same sensor before a push"
+)
+_EXPIRED = REGISTRY.counter(
+    "switchbot_grafana_live_expired_total", "Pending readings dropped as stale while pushes were failing"
+)
+_PUSH_SECONDS = REGISTRY.histogram("switchbot_grafana_live_push_seconds", "Duration of one push", LATENCY_BUCKETS)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class GrafanaLive:
+    """Push the latest reading of each sensor to a Grafana Live channel as it is decoded.
+
+    `update` runs for every decoded advertisement and only replaces the
+    sensor's pending reading; a task sends all pending readings as one line
+    protocol body to `POST /api/live/push/<stream>` every `interval` seconds,
+    so a sensor costs at most one point per push however often it
+    advertises. Grafana publishes them on `stream/<stream>/switchbot_meter`
+    to every open dashboard without querying InfluxDB. When a push fails
+    the readings are kept (newer ones still replace them) and sent with the
+    next push, except those older than `stale_after` seconds: a sensor the
+    logger no longer considers active is not worth showing, and dropping
+    them keeps MAC churn during a Grafana outage from growing the backlog.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        stream: str = "switchbot",
+        interval: float = 1.0,
+        timeout: float = 5.0,
+        stale_after: float = 120.0,
+    ) -> None:
+        parts = urlsplit(url)
+        self.url = url
+        self.token = token
+        self.stream = stream
+        self.interval = max(0.05, interval)
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self._https = parts.scheme == "https"
+        self._host = parts.hostname or "localhost"
+        self._port = parts.port
+        self._path = f"{parts.path.rstrip('/')}/api/live/push/{stream}"
+        self._pending: Dict[str, Sample] = {}
+        self._conn = None
+        self._task: Optional[asyncio.Task] = None
+        self._failing = False
+        self.pushed = 0
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def update(self, mac: str, name: str, decoded: dict, seen: float) -> None:
+        """Remember one decoded reading (call on the event loop, from the decode path)."""
+        fields = {"tempc": float(decoded["tempc"]), "hum": int(decoded["hum"])}
+        if "batt" in decoded:
+            fields["batt"] = int(decoded["batt"])
+        if decoded.get("rssi") is not None:
+            fields["rssi"] = int(decoded["rssi"])
+        if mac in self._pending:
+            _COALESCED.inc()
+        self._pending[mac] = Sample("switchbot_meter", {"mac": mac, "name": name}, fields, seen)
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.stale_after
+        stale = [mac for mac, sample in self._pending.items() if sample.ts < cutoff]
+        for mac in stale:
+            del self._pending[mac]
+        self.expired += len(stale)
+        _EXPIRED.inc(len(stale))
+
+    def _post(self, body: bytes) -> None:
+        import http.client
+
+        if self._conn is None:
+            conn_class = http.client.HTTPSConnection if self._https else http.client.HTTPConnection
+            self._conn = conn_class(self._host, self._port, timeout=self.timeout)
+        try:
+            self._conn.request(
+                "POST",
+                self._path,
+                body=body,
+                headers={"Authorization": f"Bearer {self.token}", "Content-Type": "text/plain"},
+            )
+            response = self._conn.getresponse()
+            detail = response.read()
+        except (OSError, http.client.HTTPException):
+            self._conn.close()
+            self._conn = None
+            raise
+        if response.status >= 300:
+            raise RuntimeError(f"HTTP {response.status}: {detail[:200].decode(errors='replace').strip()}")
+
+    async def push(self) -> None:
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._post, "\n".join(to_line_protocol(s) for s in batch.values()).encode())
+        except Exception as exc:
+            _PUSH_ERRORS.inc()
+            for mac, sample in batch.items():
+                self._pending.setdefault(mac, sample)  # a newer reading arrived meanwhile: keep that one
+            self._expire(time.time())
+            if not self._failing:
+                print(f"[{_now().isoformat()}] Grafana Live push to {self.url} failed: {exc}", flush=True)
+            self._failing = True
+            return
+        finally:
+            _PUSH_SECONDS.observe(time.perf_counter() - started)
+        if self._failing:
+            print(f"[{_now().isoformat()}] Grafana Live push to {self.url} recovered", flush=True)
+        self._failing = False
+        _PUSHES.inc()
+        _POINTS.inc(len(batch))
+        self.pushed += len(batch)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval * (5 if self._failing else 1))
+            await self.push()
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        print(f"[{_now().isoformat()}] pushing readings to {self.url} stream/{self.stream}/switchbot_meter", flush=True)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        await self.push()
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def add_grafana_live_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--grafana-live",
+        default="",
+        metavar="URL",
+        help="Push every decoded reading to Grafana Live at this URL, e.g. http://localhost:3000 (off by default)",
+    )
+    parser.add_argument(
+        "--grafana-token",
+        default=os.environ.get("GRAFANA_TOKEN", ""),
+        help="Grafana service account token with the Editor role (env GRAFANA_TOKEN)",
+    )
+    parser.add_argument("--grafana-stream", default="switchbot", help="Grafana Live stream id")
+    parser.add_argument(
+        "--grafana-push-interval",
+        type=float,
+        default=1.0,
+        help="Seconds between pushes (readings coalesced per sensor)",
+    )
+
+
+def grafana_live_from_args(args: argparse.Namespace) -> Optional[GrafanaLive]:
+    if not args.grafana_live:
+        return None
+    return GrafanaLive(
+        args.grafana_live,
+        args.grafana_token,
+        args.grafana_stream,
+        args.grafana_push_interval,
+        stale_after=args.stale,
+    )
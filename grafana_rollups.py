@@ -0,0 +1,186 @@
+import argparse
+import copy
+import json
+import re
+from pathlib import Path
+from typing import List, NamedTuple
+
+FIELDS = ("tempc", "hum", "batt")
+AGGREGATES = ("mean", "min", "max")
+MEASUREMENT = "switchbot_meter"
+_MARKER = "// rollup tier"
+
+
+class Rollup(NamedTuple):
+    every: str  # Flux duration, also the bucket suffix
+    retention_days: int  # 0 = keep forever
+    offset: str  # run this long after each window closes, once the finer tier is written
+
+
+ROLLUPS = (
+    Rollup("5m", 90, "1m"),
+    Rollup("1h", 730, "5m"),
+    Rollup("1d", 0, "15m"),
+)
+
+
+def rollup_bucket(bucket: str, rollup: Rollup) -> str:
+    return f"{bucket}_{rollup.every}"
+
+
+def task_name(bucket: str, rollup: Rollup) -> str:
+    return f"{bucket}_rollup_{rollup.every}"
+
+
+def task_flux(bucket: str, org: str, level: int) -> str:
+    """Flux task writing ROLLUPS[level] with an `agg` tag per aggregate.
+
+    The first tier reads raw points; each coarser tier reads the tier below
+    it (min of mins, max of maxes, mean of means), so no task ever scans raw
+    history longer than 5 minutes. Rows are stamped with their window start,
+    so `range(start: -task.every)` of a coarser task holds exactly the finer
+    rows of its own window (with the default `_stop` stamps it would take
+    the previous window's last row and miss its own).
+    """
+    rollup = ROLLUPS[level]
+    target = rollup_bucket(bucket, rollup)
+    fields = " or ".join(f'r._field == "{f}"' for f in FIELDS)
+    lines = [
+        f'option task = {{name: "{task_name(bucket, rollup)}", every: {rollup.every}, offset: {rollup.offset}}}',
+        "",
+    ]
+    if level == 0:
+        # hum and batt are integers; mean would turn them into floats and clash with min/max in the target.
+        lines += [
+            f'data = from(bucket: "{bucket}")',
+            "  |> range(start: -task.every)",
+            f'  |> filter(fn: (r) => r._measurement == "{MEASUREMENT}")',
+            f"  |> filter(fn: (r) => {fields})",
+            "  |> toFloat()",
+            "",
+        ]
+    for agg in AGGREGATES:
+        if level == 0:
+            lines.append("data")
+        else:
+            lines += [
+                f'from(bucket: "{rollup_bucket(bucket, ROLLUPS[level - 1])}")',
+                "  |> range(start: -task.every)",
+                f'  |> filter(fn: (r) => r._measurement == "{MEASUREMENT}")',
+                f'  |> filter(fn: (r) => r.agg == "{agg}")',
+            ]
+        lines += [
+            f'  |> aggregateWindow(every: task.every, fn: {agg}, timeSrc: "_start", createEmpty: false)',
+            f'  |> set(key: "agg", value: "{agg}")',
+            f'  |> to(bucket: "{target}", org: "{org}")',
+            "",
+        ]
+    return "\n".join(lines)
+
+
+def tier_preamble(bucket: str) -> str:
+    """Flux that picks the coarsest tier no coarser than v.windowPeriod and still retained for the range."""
+    branches = []
+    for level in reversed(range(len(ROLLUPS))):
+        rollup = ROLLUPS[level]
+        cond = f"wp >= int(v: {rollup.every})"
+        if level and ROLLUPS[level - 1].retention_days:
+            # The finer tier no longer holds the start of the range.
+            cond += f" or age > int(v: {ROLLUPS[level - 1].retention_days}d)"
+        branches.append(f'if {cond} then "_{rollup.every}"')
+    return (
+        f"{_MARKER}\n"
+        "wp = int(v: v.windowPeriod)\n"
+        "age = int(v: now()) - int(v: v.timeRangeStart)\n"
+        "tier =\n  " + "\n  else ".join(branches) + '\n  else ""\n'
+        f'src = "{bucket}" + tier\n'
+    )
+
+
+def rewrite_query(query: str, bucket: str) -> str:
+    """Point a panel query at the tier chosen by tier_preamble, over the dashboard time range."""
+    if _MARKER in query:
+        return query
+    query = re.sub(r'from\(bucket:\s*"[^"]*"\)', "from(bucket: src)", query, count=1)
+    query = re.sub(r"range\(start:[^)]*\)", "range(start: v.timeRangeStart, stop: v.timeRangeStop)", query, count=1)
+    # Rollup tiers hold one row per aggregate; raw points have no agg tag.
+    query = re.sub(
+        r"(\|> filter\(fn: \(r\) => r\._field == [^\n]*\n)",
+        r'\1  |> filter(fn: (r) => tier == "" or r.agg == "mean")\n',
+        query,
+        count=1,
+    )
+    query = re.sub(r"aggregateWindow\(every:\s*[^,]+,", "aggregateWindow(every: v.windowPeriod,", query)
+    return tier_preamble(bucket) + query
+
+
+def rewrite_dashboard(dashboard: dict, bucket: str) -> dict:
+    out = copy.deepcopy(dashboard)
+    for panel in out.get("panels", []):
+        for target in panel.get("targets", []):
+            if "query" in target:
+                target["query"] = rewrite_query(target["query"], bucket)
+    return out
+
+
+def generate(dashboard_path: Path, out_dir: Path, bucket: str, org: str, in_place: bool) -> List[Path]:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    for level, rollup in enumerate(ROLLUPS):
+        path = out_dir / f"{task_name(bucket, rollup)}.flux"
+        path.write_text(task_flux(bucket, org, level))
+        written.append(path)
+    dashboard = rewrite_dashboard(json.loads(dashboard_path.read_text()), bucket)
+    target = dashboard_path if in_place else out_dir / dashboard_path.name
+    target.write_text(json.dumps(dashboard, indent=2) + "\n")
+    written.append(target)
+    return written
+
+
+def apply(url: str, token: str, org: str, bucket: str) -> None:
+    """Create the rollup buckets and tasks on a live InfluxDB, updating tasks that already exist."""
+    from influxdb_client import BucketRetentionRules, InfluxDBClient, TaskCreateRequest, TaskUpdateRequest
+
+    with InfluxDBClient(url=url, token=token, org=org) as client:
+        buckets = client.buckets_api()
+        tasks = client.tasks_api()
+        for level, rollup in enumerate(ROLLUPS):
+            name = rollup_bucket(bucket, rollup)
+            if buckets.find_bucket_by_name(name) is None:
+                rules = []
+                if rollup.retention_days:
+                    rules.append(BucketRetentionRules(type="expire", every_seconds=rollup.retention_days * 86400))
+                buckets.create_bucket(bucket_name=name, retention_rules=rules, org=org)
+                print(f"created bucket {name}")
+            flux = task_flux(bucket, org, level)
+            existing = tasks.find_tasks(name=task_name(bucket, rollup))
+            if existing:
+                tasks.update_task_request(existing[0].id, TaskUpdateRequest(flux=flux))
+                print(f"updated task {task_name(bucket, rollup)}")
+            else:
+                tasks.create_task(task_create_request=TaskCreateRequest(flux=flux, org=org, status="active"))
+                print(f"created task {task_name(bucket, rollup)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate (and optionally apply) InfluxDB rollup tasks for Grafana.")
+    parser.add_argument("--dashboard", default="grafana/dashboards/switchbot.json", help="Dashboard to rewrite")
+    parser.add_argument("--out", default="grafana/rollups", help="Directory for the .flux tasks and dashboard")
+    parser.add_argument("--in-place", action="store_true", help="Rewrite --dashboard itself instead of a copy")
+    parser.add_argument("--bucket", default="switchbot", help="Raw bucket the loggers write to")
+    parser.add_argument("--org", default="temperature", help="InfluxDB org")
+    parser.add_argument("--apply", action="store_true", help="Also create the buckets and tasks on --url")
+    parser.add_argument("--url", default="http://localhost:8086", help="InfluxDB URL")
+    parser.add_argument("--token", default="", help="InfluxDB token (required with --apply)")
+    args = parser.parse_args()
+
+    for path in generate(Path(args.dashboard), Path(args.out), args.bucket, args.org, args.in_place):
+        print(f"wrote {path}")
+    if args.apply:
+        if not args.token:
+            parser.error("--token is required with --apply")
+        apply(args.url, args.token, args.org, args.bucket)
+
+
+if __name__ == "__main__":
+    main()
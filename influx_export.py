@@ -0,0 +1,404 @@
+import argparse
+import csv
+import gzip
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+MANIFEST = "_export.json"
+FORMATS = ("csv", "parquet")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_RFC3339 = re.compile(r"(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?:\.(\d+))?(Z|[+-]\d\d:\d\d)?")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _rfc3339(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def parse_time(value: str) -> datetime:
+    """'now', '-7d'/'-12h' relative to now, or an ISO date/time (UTC unless it has an offset)."""
+    if value == "now":
+        return _now()
+    match = re.fullmatch(r"-(\d+(?:\.\d+)?)([dhm])", value)
+    if match:
+        unit = {"d": "days", "h": "hours", "m": "minutes"}[match.group(2)]
+        return _now() - timedelta(**{unit: float(match.group(1))})
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def parse_rfc3339(value: str) -> datetime:
+    """An RFC 3339 time as InfluxDB writes it; fractions of any length (`…:00.5Z`, nanoseconds) on Python 3.9+."""
+    match = _RFC3339.fullmatch(value)
+    if not match:
+        raise ValueError(f"not an RFC 3339 time: {value!r}")
+    base, fraction, zone = match.groups()
+    offset = "+00:00" if zone in (None, "Z") else zone
+    return datetime.fromisoformat(f"{base}.{(fraction or '')[:6].ljust(6, '0')}{offset}")
+
+
+def _align(value: datetime, size: timedelta) -> datetime:
+    return _EPOCH + ((value - _EPOCH) // size) * size
+
+
+def _stem(value: datetime) -> str:
+    return value.strftime("%Y%m%dT%H%M%SZ")
+
+
+def chunks(start: datetime, stop: datetime, size: timedelta) -> List[Tuple[datetime, datetime]]:
+    """[start, stop) cut into `size` pieces aligned to whole multiples of `size` since the epoch."""
+    first = _align(start, size)
+    out = []
+    while first < stop:
+        out.append((max(first, start), min(first + size, stop)))
+        first += size
+    return out
+
+
+def flux_query(bucket: str, measurement: str, fields: List[str], start: datetime, stop: datetime) -> str:
+    field_filter = " or ".join(f'r._field == "{field}"' for field in fields)
+    return (
+        f'from(bucket: "{bucket}")\n'
+        f"  |> range(start: {_rfc3339(start)}, stop: {_rfc3339(stop)})\n"
+        f'  |> filter(fn: (r) => r._measurement == "{measurement}" and ({field_filter}))\n'
+        '  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")\n'
+        # GATT readings (logger_influx.py) are tagged with the address instead of the mac.
+        f'  |> keep(columns: ["_time", "mac", "address", "name", {", ".join(json.dumps(f) for f in fields)}])'
+    )
+
+
+class QueryError(Exception):
+    pass
+
+
+def stream_query(url: str, token: str, org: str, query: str, timeout: float = 300.0) -> Iterator[Dict[str, str]]:
+    """POST a Flux query and yield result rows as dicts while the CSV response is still arriving.
+
+    Only one line of the response is held at a time, whatever the size of
+    the result.
+    """
+    import http.client
+
+    parts = urlsplit(url)
+    conn_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+    conn = conn_class(parts.hostname, parts.port, timeout=timeout)
+    body = json.dumps({"query": query, "type": "flux", "dialect": {"header": True, "annotations": []}})
+    try:
+        conn.request(
+            "POST",
+            f"{parts.path.rstrip('/')}/api/v2/query?{urlencode({'org': org})}",
+            body=body,
+            headers={
+                "Authorization": f"Token {token}",
+                "Content-Type": "application/json",
+                "Accept": "application/csv",
+                "Accept-Encoding": "identity",
+            },
+        )
+        response = conn.getresponse()
+        if response.status != 200:
+            raise QueryError(f"HTTP {response.status}: {response.read(500).decode(errors='replace').strip()}")
+        header: Optional[List[str]] = None
+        for raw in response:
+            line = raw.decode().rstrip("\r\n")
+            if not line:
+                header = None  # a new table with its own header follows
+                continue
+            row = next(csv.reader([line]))
+            if header is None:
+                header = row
+                continue
+            yield dict(zip(header, row))
+    finally:
+        conn.close()
+
+
+class _CsvPart:
+    def __init__(self, path: Path, fields: List[str]) -> None:
+        self.path = path
+        self._fh = gzip.open(path, "wt", newline="", compresslevel=6)
+        self._writer = csv.writer(self._fh)
+        self._writer.writerow(["time", "mac", "name", *fields])
+        self._fields = fields
+
+    def add(self, row: Dict[str, str]) -> None:
+        values = [row.get(field, "") for field in self._fields]
+        self._writer.writerow([row["_time"], row.get("mac", ""), row.get("name", ""), *values])
+
+    def close(self) -> None:
+        self._fh.close()
+
+
+class _ParquetPart:
+    """Rows buffered up to one row group, so memory stays bounded by `row_group`."""
+
+    def __init__(self, path: Path, fields: List[str], row_group: int = 65536) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self._pa = pa
+        self._fields = fields
+        self._schema = pa.schema(
+            [("time", pa.timestamp("us", tz="UTC")), ("mac", pa.string()), ("name", pa.string())]
+            + [(f, pa.float64()) for f in fields]
+        )
+        self._writer = pq.ParquetWriter(str(path), self._schema, compression="zstd")
+        self._row_group = row_group
+        self._columns: Dict[str, list] = {name: [] for name in self._schema.names}
+
+    def add(self, row: Dict[str, str]) -> None:
+        columns = self._columns
+        columns["time"].append(parse_rfc3339(row["_time"]))
+        columns["mac"].append(row.get("mac", ""))
+        columns["name"].append(row.get("name", ""))
+        for field in self._fields:
+            value = row.get(field, "")
+            columns[field].append(float(value) if value else None)
+        if len(columns["time"]) >= self._row_group:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._columns["time"]:
+            self._writer.write_table(self._pa.Table.from_pydict(self._columns, schema=self._schema))
+            self._columns = {name: [] for name in self._schema.names}
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+def _safe(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name).strip("_") or "unknown"
+
+
+def export_chunk(
+    url: str,
+    token: str,
+    org: str,
+    query: str,
+    out_dir: Path,
+    stem: str,
+    fmt: str,
+    fields: List[str],
+) -> Dict[str, int]:
+    """Write one chunk as one file per sensor (`<out>/<mac>/<stem>.<ext>`); rows per sensor.
+
+    Files are written under a temporary name and only renamed once the whole
+    chunk has streamed in (replacing an earlier, shorter export of the
+    chunk), so an interrupted chunk leaves nothing behind that looks complete.
+    """
+    ext = "csv.gz" if fmt == "csv" else "parquet"
+    parts: Dict[str, object] = {}
+    counts: Dict[str, int] = {}
+    try:
+        for row in stream_query(url, token, org, query):
+            if not row.get("mac") and row.get("address"):
+                row["mac"] = row["address"].upper()
+            mac = row.get("mac", "")
+            part = parts.get(mac)
+            if part is None:
+                directory = out_dir / _safe(mac)
+                directory.mkdir(parents=True, exist_ok=True)
+                path = directory / f".{stem}.{ext}.tmp"
+                part = parts[mac] = _CsvPart(path, fields) if fmt == "csv" else _ParquetPart(path, fields)
+                counts[mac] = 0
+            part.add(row)
+            counts[mac] += 1
+    except BaseException:
+        for part in parts.values():
+            part.close()
+            part.path.unlink(missing_ok=True)
+        raise
+    for part in parts.values():
+        part.close()
+        part.path.replace(part.path.with_name(f"{stem}.{ext}"))
+    return counts
+
+
+class Manifest:
+    """Exported chunks of one export, saved after each chunk so a rerun resumes where it stopped.
+
+    Chunks are keyed by their aligned start and record the `[start, stop)`
+    actually exported, so one cut short by `--stop now` (or a later
+    `--start`) is exported again when a rerun asks for more of it.
+    """
+
+    def __init__(self, out_dir: Path, params: dict) -> None:
+        self.path = out_dir / MANIFEST
+        self.params = params
+        self.done: Dict[str, dict] = {}
+        if self.path.exists():
+            saved = json.loads(self.path.read_text())
+            if saved.get("params") != params:
+                raise SystemExit(
+                    f"{out_dir} holds an export with other settings ({saved.get('params')}); use another --out"
+                )
+            # Entries without a recorded range predate it and may be partial: export those again.
+            self.done = {stem: entry for stem, entry in saved.get("done", {}).items() if "stop" in entry}
+
+    def span(self, stem: str) -> Optional[Tuple[datetime, datetime]]:
+        entry = self.done.get(stem)
+        return (parse_rfc3339(entry["start"]), parse_rfc3339(entry["stop"])) if entry else None
+
+    def covers(self, stem: str, start: datetime, stop: datetime) -> bool:
+        span = self.span(stem)
+        return span is not None and span[0] <= start and stop <= span[1]
+
+    def complete(self, stem: str, start: datetime, stop: datetime, counts: Dict[str, int]) -> None:
+        self.done[stem] = {"start": _rfc3339(start), "stop": _rfc3339(stop), "rows": counts}
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"params": self.params, "done": self.done}, indent=1, sort_keys=True))
+        tmp.replace(self.path)
+
+
+def export(
+    url: str,
+    token: str,
+    org: str,
+    bucket: str,
+    start: datetime,
+    stop: datetime,
+    out_dir: Path,
+    *,
+    chunk: timedelta = timedelta(days=1),
+    fmt: str = "csv",
+    measurement: str = "switchbot_meter",
+    fields: Optional[List[str]] = None,
+    concurrency: int = 2,
+    retries: int = 3,
+) -> dict:
+    """Export [start, stop) chunk by chunk with at most `concurrency` queries in flight; returns a summary."""
+    import http.client
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    fields = fields or ["tempc", "hum", "batt"]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    params = {
+        "bucket": bucket,
+        "measurement": measurement,
+        "fields": fields,
+        "format": fmt,
+        "chunk_seconds": chunk.total_seconds(),
+    }
+    manifest = Manifest(out_dir, params)
+    # Whole seconds: that is what the manifest and the Flux range() keep.
+    start, stop = start.replace(microsecond=0), stop.replace(microsecond=0)
+    spans = chunks(start, stop, chunk)
+    todo = []
+    for s, e in spans:
+        stem = _stem(_align(s, chunk))
+        if manifest.covers(stem, s, e):
+            continue
+        done = manifest.span(stem)
+        # Re-exporting replaces the chunk's files: query what they held before too.
+        todo.append((min(s, done[0]), max(e, done[1])) if done else (s, e))
+    skipped = len(spans) - len(todo)
+    if skipped:
+        print(f"[{_now().isoformat()}] resuming: {skipped} chunk(s) already exported", flush=True)
+    rows = failed = 0
+    started = time.perf_counter()
+    attempts: Dict[str, int] = {}
+
+    def submit(pool, span: Tuple[datetime, datetime]):
+        stem = _stem(_align(span[0], chunk))
+        query = flux_query(bucket, measurement, fields, *span)
+        return pool.submit(export_chunk, url, token, org, query, out_dir, stem, fmt, fields), stem, span
+
+    with ThreadPoolExecutor(max(1, concurrency), thread_name_prefix="export") as pool:
+        queue = list(reversed(todo))
+        running = {}
+        while queue or running:
+            while queue and len(running) < max(1, concurrency):
+                future, stem, span = submit(pool, queue.pop())
+                running[future] = (stem, span)
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stem, span = running.pop(future)
+                try:
+                    counts = future.result()
+                except (OSError, QueryError, http.client.HTTPException) as exc:
+                    attempts[stem] = attempts.get(stem, 0) + 1
+                    if attempts[stem] <= retries:
+                        print(f"[{_now().isoformat()}] chunk {stem} failed ({exc}), retrying", flush=True)
+                        time.sleep(min(30.0, 2.0 ** attempts[stem]))
+                        queue.append(span)
+                    else:
+                        failed += 1
+                        print(f"[{_now().isoformat()}] chunk {stem} failed ({exc}), giving up", flush=True)
+                    continue
+                manifest.complete(stem, *span, counts)
+                rows += sum(counts.values())
+                print(
+                    f"[{_now().isoformat()}] chunk {stem}: {sum(counts.values())} row(s) from {len(counts)} sensor(s)",
+                    flush=True,
+                )
+    return {
+        "chunks": len(todo) - failed,
+        "skipped": skipped,
+        "failed": failed,
+        "rows": rows,
+        "seconds": round(time.perf_counter() - started, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Export the switchbot bucket to per-sensor gzip CSV or Parquet files, chunk by chunk."
+    )
+    parser.add_argument("--start", default="-7d", help="ISO time, or relative like --start=-30d / --start=-12h")
+    parser.add_argument("--stop", default="now", help="ISO time, relative, or now")
+    parser.add_argument("--chunk-hours", type=float, default=24.0, help="Time range per query")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="csv = gzip CSV, parquet needs pyarrow")
+    parser.add_argument("--out", default="export", help="Output directory (rerun with the same one to resume)")
+    parser.add_argument("--concurrency", type=int, default=2, help="Max queries running at once")
+    parser.add_argument("--retries", type=int, default=3, help="Attempts per chunk after the first failure")
+    parser.add_argument("--measurement", default="switchbot_meter")
+    parser.add_argument("--fields", default="tempc,hum,batt", help="Comma-separated fields to export")
+    parser.add_argument("--url", default="http://localhost:8086", help="InfluxDB URL")
+    parser.add_argument("--token", default=os.environ.get("INFLUX_TOKEN", ""), help="InfluxDB token (env INFLUX_TOKEN)")
+    parser.add_argument("--org", default="temperature", help="InfluxDB org")
+    parser.add_argument("--bucket", default="switchbot", help="InfluxDB bucket")
+    args = parser.parse_args()
+
+    if not args.token:
+        parser.error("--token (or INFLUX_TOKEN) is required")
+    if args.format == "parquet":
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: python -m pip install pyarrow") from None
+    start, stop = parse_time(args.start), parse_time(args.stop)
+    if start >= stop:
+        parser.error("--start must be before --stop")
+    summary = export(
+        args.url,
+        args.token,
+        args.org,
+        args.bucket,
+        start,
+        stop,
+        Path(args.out),
+        chunk=timedelta(hours=args.chunk_hours),
+        fmt=args.format,
+        measurement=args.measurement,
+        fields=[f.strip() for f in args.fields.split(",") if f.strip()],
+        concurrency=args.concurrency,
+        retries=args.retries,
+    )
+    print(json.dumps(summary))
+    if summary["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import argparse
+import gzip
+import json
+import math
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Iterator, List
+
+# range(start: 2024-01-01T00:00:00Z, stop: 2024-01-02T00:00:00Z) as written by influx_export.flux_query
+_RANGE = re.compile(r"range\(start:\s*([0-9T:\-\.]+Z),\s*stop:\s*([0-9T:\-\.]+Z)\)")
+_MAC_TAG = re.compile(r",mac=([^, ]+)")
+_TEMPC = re.compile(r"[ ,]tempc=(-?[0-9.]+)")
+_HUM = re.compile(r"[ ,]hum=([0-9]+)i")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class StandIn:
+    """What the stand-in serves: `sensors` meters with a reading every `every` seconds, generated on the fly.
+
+    Readings are a deterministic function of (sensor, time), so an export can
+    be checked against them and the server needs no storage. Writes are
+    counted and thrown away; with `record`, the arrival time, mac, tempc and
+    hum of every written meter point are kept until `take_recorded`.
+    """
+
+    def __init__(
+        self,
+        sensors: int = 4,
+        every: float = 60.0,
+        token: str = "",
+        fail_every: int = 0,
+        write_delay: float = 0.0,
+        record: bool = False,
+    ) -> None:
+        self.sensors = sensors
+        self.every = every
+        self.token = token
+        self.fail_every = fail_every  # answer every Nth request with a 503 (0 = never)
+        self.write_delay = write_delay  # seconds each write takes, like a busy server
+        self.record = record
+        self.requests = 0
+        self.queries = 0
+        self.rows = 0
+        self.writes = 0
+        self.points = 0
+        self.write_bytes = 0
+        self._recorded: List[list] = []
+        self._lock = threading.Lock()
+
+    def _fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            return bool(self.fail_every) and self.requests % self.fail_every == 0
+
+    def accept_write(self, body: bytes, arrival: float) -> None:
+        lines = [line for line in body.decode(errors="replace").split("\n") if line and not line.startswith("#")]
+        recorded = []
+        if self.record:
+            for line in lines:
+                mac, tempc, hum = _MAC_TAG.search(line), _TEMPC.search(line), _HUM.search(line)
+                if mac and tempc and hum:
+                    recorded.append([arrival, mac.group(1), float(tempc.group(1)), int(hum.group(1))])
+        with self._lock:
+            self.writes += 1
+            self.points += len(lines)
+            self.write_bytes += len(body)
+            self._recorded.extend(recorded)
+
+    def take_recorded(self) -> List[list]:
+        """[arrival, mac, tempc, hum] of the meter points written since the last call."""
+        with self._lock:
+            recorded, self._recorded = self._recorded, []
+        return recorded
+
+    def macs(self) -> List[str]:
+        return [f"EA:06:06:3B:00:{i:02X}" for i in range(self.sensors)]
+
+    def rows_between(self, start: datetime, stop: datetime) -> Iterator[List[str]]:
+        """(time, mac, name, tempc, hum, batt) per sensor, each sensor as one table like InfluxDB's pivot output."""
+        first = math.ceil(start.timestamp() / self.every)
+        last = math.ceil(stop.timestamp() / self.every)
+        for i, mac in enumerate(self.macs()):
+            for step in range(first, last):
+                ts = step * self.every
+                tempc = round(20 + 5 * math.sin(ts / 3600 + i), 1)
+                hum = 40 + (step + i) % 20
+                stamp = datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                yield [stamp, mac, f"sensor{i}", str(tempc), str(hum), str(90 - i)]
+
+
+def _handler(standin: StandIn):
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def _reply(self, status: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _chunk(self, data: bytes) -> None:
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        def do_GET(self) -> None:
+            path = self.path.split("?")[0]
+            if path == "/health":
+                self._reply(200, {"status": "pass"})
+            elif path == "/debug/writes":
+                # Not an InfluxDB endpoint: hands the recorded writes to a harness in another process.
+                self._reply(200, standin.take_recorded())
+            else:
+                self._reply(404, {"message": "not found"})
+
+        def do_POST(self) -> None:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            arrival = time.time()
+            if standin.token and self.headers.get("Authorization") != f"Token {standin.token}":
+                self._reply(401, {"code": "unauthorized", "message": "unauthorized access"})
+                return
+            path = self.path.split("?")[0]
+            if path not in ("/api/v2/query", "/api/v2/write"):
+                self._reply(404, {"message": "not found"})
+                return
+            if standin._fail():
+                self._reply(503, {"code": "unavailable", "message": "stand-in failure"})
+                return
+            if path == "/api/v2/write":
+                if self.headers.get("Content-Encoding") == "gzip":
+                    body = gzip.decompress(body)
+                if standin.write_delay:
+                    time.sleep(standin.write_delay)
+                standin.accept_write(body, arrival)
+                self.send_response(204)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            with standin._lock:
+                standin.queries += 1
+            match = _RANGE.search(json.loads(body).get("query", ""))
+            if match is None:
+                self._reply(400, {"code": "invalid", "message": "query needs an absolute range(start:, stop:)"})
+                return
+            start, stop = _parse_time(match.group(1)), _parse_time(match.group(2))
+            # Stream like InfluxDB: chunked, one header row per table, a blank line between tables.
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            header = ",result,table,_time,mac,name,tempc,hum,batt\r\n"
+            lines: List[str] = []
+            table = -1
+            mac = None
+            count = 0
+            for row in standin.rows_between(start, stop):
+                if row[1] != mac:
+                    if mac is not None:
+                        lines.append("\r\n")
+                    mac, table = row[1], table + 1
+                    lines.append(header)
+                lines.append(f",_result,{table}," + ",".join(row) + "\r\n")
+                count += 1
+                if len(lines) >= 500:
+                    self._chunk("".join(lines).encode())
+                    lines = []
+            if lines:
+                self._chunk("".join(lines).encode())
+            self.wfile.write(b"0\r\n\r\n")
+            with standin._lock:
+                standin.rows += count
+
+    return Handler
+
+
+def serve(standin: StandIn, host: str = "127.0.0.1", port: int = 8086):
+    """Start the stand-in on a background thread; `server.server_address` has the bound port."""
+    from http.server import ThreadingHTTPServer
+
+    server = ThreadingHTTPServer((host, port), _handler(standin))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="influx-standin", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the InfluxDB v2 query and write API, with synthetic data."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8086)
+    parser.add_argument("--sensors", type=int, default=4, help="Synthetic meters served by queries")
+    parser.add_argument("--every", type=float, default=60.0, help="Seconds between synthetic readings")
+    parser.add_argument("--token", default="", help="Require this token (default: accept any)")
+    parser.add_argument("--fail-every", type=int, default=0, help="Answer every Nth request with a 503 (0 = never)")
+    parser.add_argument("--write-delay", type=float, default=0.0, help="Seconds each write request takes")
+    args = parser.parse_args()
+
+    from http.server import ThreadingHTTPServer
+
+    standin = StandIn(args.sensors, args.every, args.token, args.fail_every, args.write_delay)
+    server = ThreadingHTTPServer((args.host, args.port), _handler(standin))
+    print(f"[{_now().isoformat()}] InfluxDB stand-in on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(
+            f"[{_now().isoformat()}] {standin.queries} quer(ies), {standin.rows} row(s) served; "
+            f"{standin.writes} write(s), {standin.points} point(s), {standin.write_bytes} bytes received",
+            flush=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+import argparse
+import asyncio
+import re
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Hashable, List, Optional, Union
+
+from metrics import LATENCY_BUCKETS, REGISTRY, SIZE_BUCKETS
+from samples import Sample, to_line_protocol
+from spool import Spool, open_spool
+
+if TYPE_CHECKING:
+    from influxdb_client import Point
+
+# Line protocol separates the series key from the fields at the first unescaped space.
+_SERIES_END = re.compile(r"(?<!\\) ")
+
+OVERFLOW_POLICIES = ("coalesce", "drop")
+
+
+_BATCH_SIZE = REGISTRY.histogram("switchbot_write_batch_size", "Points per write", SIZE_BUCKETS, sink="influx")
+_WRITE_SECONDS = REGISTRY.histogram(
+    "switchbot_write_latency_seconds", "Duration of one write", LATENCY_BUCKETS, sink="influx"
+)
+_WRITE_ERRORS = REGISTRY.counter("switchbot_write_errors_total", "Failed writes", sink="influx")
+_REJECTED = REGISTRY.counter(
+    "switchbot_write_rejected_points_total", "Points InfluxDB refused as invalid (not retried)", sink="influx"
+)
+
+# Outcomes of one write; points InfluxDB refused as invalid count as written off, not as a retry.
+_OK, _RETRY = "ok", "retry"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _series_key(line: str) -> str:
+    return _SERIES_END.split(line, 1)[0]
+
+
+def _http_status(exc: Exception) -> Optional[int]:
+    """HTTP status of an influxdb_client error (ApiException or InfluxDBError), None for network errors."""
+    status = getattr(exc, "status", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status", None)
+    return status if isinstance(status, int) else None
+
+
+# Refusals of the data itself: the same batch fails again however often it is retried. Anything else
+# (network errors, 5xx, 408/429, and 401/403/404 from a bad token, org or bucket) is retried.
+_INVALID_DATA = (400, 422)
+_TOO_LARGE = 413
+_CONFIG_ERRORS = (401, 403, 404)
+
+
+class OverflowQueue:
+    """Bounded FIFO that sheds by an overflow policy in constant time per add.
+
+    Once `max_len` items are queued, "coalesce" overwrites the newest queued
+    item of the same series (found through an index by `key`) in place, and
+    otherwise, as with "drop", the oldest item is discarded.
+    """
+
+    def __init__(self, max_len: int, overflow: str = "coalesce", key: Callable[[Any], Hashable] = _series_key) -> None:
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow must be one of {OVERFLOW_POLICIES}")
+        self.max_len = max_len
+        self.overflow = overflow
+        self._key = key
+        self._entries: Deque[list] = deque()  # [key, item]
+        self._newest: Dict[Hashable, list] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def append(self, item: Any) -> int:
+        """Queue `item`; returns the number of items shed to make room (0 or 1)."""
+        coalesce = self.overflow == "coalesce"
+        key = self._key(item) if coalesce else None
+        shed = 0
+        if len(self._entries) >= self.max_len:
+            entry = self._newest.get(key) if coalesce else None
+            if entry is not None:
+                entry[1] = item
+                return 1
+            self._forget(self._entries.popleft())
+            shed = 1
+        entry = [key, item]
+        self._entries.append(entry)
+        if coalesce:
+            self._newest[key] = entry
+        return shed
+
+    def requeue(self, items: List[Any]) -> int:
+        """Put `items`, older than everything queued, back at the head; returns how many did not fit."""
+        coalesce = self.overflow == "coalesce"
+        room = max(0, self.max_len - len(self._entries))
+        kept = items[len(items) - room :] if room < len(items) else items
+        for item in reversed(kept):
+            key = self._key(item) if coalesce else None
+            entry = [key, item]
+            self._entries.appendleft(entry)
+            if coalesce:
+                self._newest.setdefault(key, entry)
+        return len(items) - len(kept)
+
+    def popleft(self) -> Any:
+        entry = self._entries.popleft()
+        self._forget(entry)
+        return entry[1]
+
+    def _forget(self, entry: list) -> None:
+        if self._newest.get(entry[0]) is entry:
+            del self._newest[entry[0]]
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._newest.clear()
+
+
+class BatchWriter:
+    """Queue points in memory and write them to InfluxDB as multi-line batches.
+
+    `add` never blocks: when the queue is full, a new point replaces the
+    queued one of its series ("coalesce") or the oldest point is dropped
+    ("drop"), see `OverflowQueue`. Writes run in a worker thread so the
+    event loop keeps scanning while InfluxDB is slow. A batch that failed
+    goes back to the head of the queue (as far as it has room) and is
+    retried with exponential backoff, up to `backoff_max` seconds apart.
+
+    With a `spool`, points are appended to disk instead of the memory queue
+    and are only acknowledged once InfluxDB accepted them; a failed write is
+    retried on the next flush, replaying the backlog `spool_batch` lines at
+    a time. Batches InfluxDB refuses as invalid (400/422, such as a field
+    type conflict) are not retried: they are moved to the spool's `rejected`
+    file (or dropped without a spool) so the points behind them keep
+    flowing. A batch too large for the server (413) is split in halves. An
+    authentication or missing bucket/org error (401/403/404) is a
+    configuration problem, not bad data: it is logged and retried.
+    """
+
+    def __init__(
+        self,
+        write_api,
+        bucket: str,
+        org: str,
+        *,
+        batch_size: int = 500,
+        flush_interval: float = 10.0,
+        max_queue: int = 10_000,
+        overflow: str = "coalesce",
+        spool: Optional[Spool] = None,
+        spool_batch: int = 5000,
+        backoff_max: float = 60.0,
+    ) -> None:
+        self._write_api = write_api
+        self._bucket = bucket
+        self._org = org
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue = max(self.batch_size, max_queue)
+        self.overflow = overflow
+        self.spool = spool
+        self.spool_batch = max(self.batch_size, spool_batch)
+        self.backoff_max = backoff_max
+        self._queue = OverflowQueue(self.max_queue, overflow)
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._failures = 0
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def add(self, record: Union[Sample, "Point", str]) -> None:
+        if isinstance(record, Sample):
+            line = to_line_protocol(record)
+        else:
+            line = record if isinstance(record, str) else record.to_line_protocol()
+        if self.spool is not None:
+            self.spool.append(line)
+            return
+        self.dropped += self._queue.append(line)
+        # While backing off after a failure, wait out the delay instead of retrying on every full batch.
+        if len(self._queue) >= self.batch_size and not self._failures:
+            self._wake.set()
+
+    def _reject(self, batch: List[str], exc: Exception) -> None:
+        self.rejected += len(batch)
+        _REJECTED.inc(len(batch))
+        if self.spool is not None:
+            self.spool.reject(batch)
+        print(f"[{_now().isoformat()}] InfluxDB rejected {len(batch)} point(s), not retrying: {exc}", flush=True)
+
+    async def _write(self, batch: List[str]) -> str:
+        _BATCH_SIZE.observe(len(batch))
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._write_api.write, bucket=self._bucket, org=self._org, record="\n".join(batch))
+        except Exception as exc:
+            _WRITE_ERRORS.inc()
+            status = _http_status(exc)
+            if status == _TOO_LARGE and len(batch) > 1:
+                half = len(batch) // 2
+                print(f"[{_now().isoformat()}] batch of {len(batch)} point(s) too large, splitting", flush=True)
+                if await self._write(batch[:half]) == _RETRY:
+                    return _RETRY
+                return await self._write(batch[half:])
+            if status in _INVALID_DATA or status == _TOO_LARGE:
+                self._reject(batch, exc)
+                return _OK
+            if status in _CONFIG_ERRORS:
+                print(
+                    f"[{_now().isoformat()}] ERROR: InfluxDB refused the write with HTTP {status}; check --token, "
+                    f"--org and --bucket. Keeping {len(batch)} point(s) to retry: {exc}",
+                    flush=True,
+                )
+                return _RETRY
+            print(f"[{_now().isoformat()}] write of {len(batch)} point(s) failed: {exc}", flush=True)
+            return _RETRY
+        finally:
+            _WRITE_SECONDS.observe(time.perf_counter() - started)
+        self.written += len(batch)
+        return _OK
+
+    async def _flush_spool(self) -> None:
+        spool = self.spool
+        spool.sync()
+        while True:
+            batch, position = spool.read_batch(self.spool_batch)
+            if not batch:
+                return
+            result = await self._write(batch)
+            if result == _RETRY:
+                self._failures += 1
+                return
+            self._failures = 0
+            spool.ack(position)
+            print(
+                f"[{_now().isoformat()}] flushed {len(batch)} point(s), spool backlog {spool.pending_bytes} bytes",
+                flush=True,
+            )
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if self.spool is not None:
+                await self._flush_spool()
+                return
+            while self._queue:
+                count = min(self.batch_size, len(self._queue))
+                batch = [self._queue.popleft() for _ in range(count)]
+                result = await self._write(batch)
+                if result == _RETRY:
+                    self._failures += 1
+                    self.dropped += self._queue.requeue(batch)
+                    return
+                self._failures = 0
+                print(f"[{_now().isoformat()}] flushed {len(batch)} point(s), {len(self._queue)} queued", flush=True)
+
+    async def run(self) -> None:
+        while not self._closed:
+            delay = self.flush_interval
+            if self._failures:
+                delay = min(self.backoff_max, self.flush_interval * 2 ** min(self._failures, 6))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        self._closed = True
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+        await self.flush()
+        if self._queue:
+            self.dropped += len(self._queue)
+            print(f"[{_now().isoformat()}] gave up on {len(self._queue)} queued point(s) at close", flush=True)
+            self._queue.clear()
+        if self.spool is not None:
+            self.spool.close()
+
+
+def add_writer_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--batch-size", type=int, default=500, help="Max points per InfluxDB write")
+    parser.add_argument("--flush-interval", type=float, default=10.0, help="Seconds between batch flushes")
+    parser.add_argument("--max-queue", type=int, default=10_000, help="Max points buffered before shedding")
+    parser.add_argument(
+        "--overflow",
+        choices=OVERFLOW_POLICIES,
+        default="coalesce",
+        help="When the queue is full: replace the queued point of the same series, or drop oldest points",
+    )
+    parser.add_argument("--gzip", action="store_true", help="Gzip-compress write requests")
+    parser.add_argument("--spool", default="", help="Directory for an on-disk spool that survives InfluxDB outages")
+    parser.add_argument("--spool-segment-mb", type=float, default=4.0, help="Spool segment size in MiB")
+    parser.add_argument("--spool-max-mb", type=float, default=256.0, help="Spool size cap in MiB (oldest evicted)")
+    parser.add_argument("--spool-batch", type=int, default=5000, help="Max points per write when replaying the spool")
+
+
+def writer_options(args: argparse.Namespace) -> dict:
+    return {
+        "batch_size": args.batch_size,
+        "flush_interval": args.flush_interval,
+        "max_queue": args.max_queue,
+        "overflow": args.overflow,
+        "spool": open_spool(args.spool, args.spool_segment_mb, args.spool_max_mb),
+        "spool_batch": args.spool_batch,
+    }
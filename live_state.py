@@ -0,0 +1,350 @@
+import argparse
+import asyncio
+import json
+import os
+import socket
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from adv_capture import _RECORD, MAGIC, decode_frame, encode_frame, frame_from_callback, to_callback_args
+from metrics import REGISTRY
+
+# Where the logger serves (--live-socket) and where the CLI tools look for it.
+DEFAULT_SOCKET = os.environ.get("SWITCHBOT_LIVE_SOCKET", "/tmp/switchbot-live.sock")
+
+_DROPPED = REGISTRY.counter("switchbot_live_dropped_frames_total", "Stream frames not sent to a slow subscriber")
+
+# Protocol, one request per line:
+#   GET [MAC ...]  -> one JSON line {"MAC": [decoded, seen], ...} of the latest reading per sensor
+#   STREAM         -> MAGIC, then every advertisement the daemon hears as capture-file records, until EOF
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class LiveStateServer:
+    """Share the logger's scan with other processes over a Unix domain socket.
+
+    `GET` answers from the sensor registry the logger already keeps, so a
+    reader costs one round trip and no radio time. `STREAM` subscribers get
+    the raw advertisements in the capture-file encoding; frames are only
+    encoded while someone is subscribed, and a subscriber more than
+    `max_backlog` bytes behind misses frames instead of growing the
+    daemon's memory.
+    """
+
+    def __init__(self, path: str = DEFAULT_SOCKET, max_backlog: int = 1 << 20) -> None:
+        self.path = path
+        self.max_backlog = max_backlog
+        self.snapshot: Callable[[Optional[List[str]]], Dict[str, Tuple[dict, float]]] = lambda macs: {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._subscribers: Set[asyncio.StreamWriter] = set()
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self.requests = 0
+        self.dropped = 0
+        REGISTRY.gauge("switchbot_live_subscribers", "Processes streaming advertisements", fn=lambda: len(self))
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def attach(self, registry) -> None:
+        """Answer GET from a SensorRegistry."""
+        from sensor_registry import mac_to_int
+
+        def snapshot(macs: Optional[List[str]]) -> Dict[str, Tuple[dict, float]]:
+            if not macs:
+                return {r.address: (r.decoded, r.seen) for r in registry.active(time.time())}
+            out = {}
+            for mac in macs:
+                try:
+                    record = registry.get(mac_to_int(mac))
+                except ValueError:
+                    continue
+                if record is not None:
+                    out[record.address] = (record.decoded, record.seen)
+            return out
+
+        self.snapshot = snapshot
+
+    def publish(self, device, adv) -> None:
+        """Send one advertisement to every stream subscriber (call from the scanner callback)."""
+        if not self._subscribers:
+            return
+        data = encode_frame(frame_from_callback(device, adv))
+        for writer in self._subscribers:
+            if writer.transport.get_write_buffer_size() > self.max_backlog:
+                self.dropped += 1
+                _DROPPED.inc()
+                continue
+            writer.write(data)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                parts = line.decode(errors="replace").split()
+                command = parts[0].upper() if parts else ""
+                self.requests += 1
+                if command == "GET":
+                    macs = [mac.upper() for mac in parts[1:]]
+                    writer.write(json.dumps(self.snapshot(macs)).encode() + b"\n")
+                elif command == "STREAM":
+                    writer.write(MAGIC)
+                    self._subscribers.add(writer)
+                    try:
+                        while await reader.read(4096):
+                            pass
+                    finally:
+                        self._subscribers.discard(writer)
+                    return
+                else:
+                    writer.write(json.dumps({"error": f"unknown request {command!r}"}).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            if _listening(self.path):
+                raise RuntimeError(f"{self.path} is already served by another process")
+            os.unlink(self.path)  # left behind by a crash
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+        print(f"[{_now().isoformat()}] live state on {self.path}", flush=True)
+
+    async def close(self, timeout: float = 2.0) -> None:
+        if self._server is not None:
+            self._server.close()
+        # Persistent GET clients (read_live) stay connected; since Python 3.12 wait_closed() waits for them.
+        for writer in list(self._clients):
+            writer.close()
+        if self._server is not None:
+            try:
+                await asyncio.wait_for(self._server.wait_closed(), timeout)
+            except asyncio.TimeoutError:
+                print(f"[{_now().isoformat()}] live state clients did not disconnect in {timeout:.0f}s", flush=True)
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+
+def _listening(path: str) -> bool:
+    if not hasattr(socket, "AF_UNIX"):
+        return False
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+class LiveClient:
+    """Blocking GET client; keeps its connection for repeated reads."""
+
+    def __init__(self, path: str = DEFAULT_SOCKET, timeout: float = 2.0) -> None:
+        self.path = path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+
+    def _connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self._sock, self._file = sock, sock.makefile("rb")
+
+    def get(self, macs: Iterable[str] = ()) -> Dict[str, Tuple[dict, float]]:
+        """Latest (decoded, seen) per sensor, all of them or only `macs`; raises OSError without a daemon."""
+        request = " ".join(["GET", *macs]).encode() + b"\n"
+        for attempt in (0, 1):
+            if self._sock is None:
+                self._connect()
+            try:
+                self._sock.sendall(request)
+                line = self._file.readline()
+                if line:
+                    return {mac: (decoded, seen) for mac, (decoded, seen) in json.loads(line).items()}
+            except OSError:
+                if attempt:
+                    raise
+            self.close()  # the daemon restarted: reconnect once
+        raise ConnectionError(f"{self.path} closed the connection")
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+
+_client: Optional[LiveClient] = None
+
+
+def read_live(macs: Iterable[str], max_age: float = 60.0, path: Optional[str] = None) -> Optional[Dict[str, dict]]:
+    """Readings no older than `max_age` from a running daemon, or None when there is none."""
+    global _client
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = path or DEFAULT_SOCKET
+    if _client is None or _client.path != path:
+        _client = LiveClient(path)
+    try:
+        latest = _client.get([mac.upper() for mac in macs])
+    except (OSError, ValueError):
+        _client.close()
+        return None
+    now = time.time()
+    return {mac: decoded for mac, (decoded, seen) in latest.items() if now - seen <= max_age}
+
+
+class DaemonScanner:
+    """BleakScanner stand-in fed by the logger's advertisement stream.
+
+    `start` attaches to the daemon on `path`; when none is running, or it
+    goes away later, it starts a local BleakScanner with the same callback
+    instead. Use the class itself as a `scanner_factory`.
+    """
+
+    def __init__(self, callback: Callable, path: Optional[str] = None, fallback: Optional[Callable] = None) -> None:
+        self._callback = callback
+        self.path = path or DEFAULT_SOCKET
+        self._fallback = fallback
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._local = None
+        self.source = ""
+        self.count = 0
+
+    async def _attach(self) -> Optional[asyncio.StreamReader]:
+        if not hasattr(socket, "AF_UNIX") or not os.path.exists(self.path):
+            return None
+        try:
+            reader, self._writer = await asyncio.open_unix_connection(self.path)
+            self._writer.write(b"STREAM\n")
+            if await asyncio.wait_for(reader.readexactly(len(MAGIC)), 2.0) == MAGIC:
+                return reader
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        return None
+
+    async def _scan_locally(self) -> None:
+        factory = self._fallback
+        if factory is None:
+            from bleak import BleakScanner
+
+            factory = BleakScanner
+        self.source = "local"
+        self._local = factory(self._callback)
+        await self._local.start()
+
+    async def _run(self, reader: asyncio.StreamReader) -> None:
+        callback = self._callback
+        try:
+            while True:
+                header = _RECORD.unpack(await reader.readexactly(_RECORD.size))
+                frame = decode_frame(header, await reader.readexactly(header[0]))
+                self.count += 1
+                callback(*to_callback_args(frame))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        print(f"[{_now().isoformat()}] live state daemon on {self.path} went away; scanning locally", flush=True)
+        self._writer.close()
+        self._writer = None
+        await self._scan_locally()
+
+    async def start(self) -> None:
+        reader = await self._attach()
+        if reader is None:
+            await self._scan_locally()
+            return
+        self.source = "daemon"
+        self._task = asyncio.create_task(self._run(reader))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._writer is not None:
+            self._writer.close()
+        if self._local is not None:
+            await self._local.stop()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Query the logger's live state (logger_influx_scan.py --live-socket).")
+    parser.add_argument(
+        "command", choices=("get", "stream", "bench"), help="Print readings, capture the stream, or time GETs"
+    )
+    parser.add_argument("mac", nargs="*", help="Only these sensors (get/bench)")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Daemon socket (env SWITCHBOT_LIVE_SOCKET)")
+    parser.add_argument("--max-age", type=float, default=0.0, help="Skip readings older than this many seconds")
+    parser.add_argument("-o", "--output", default="", help="stream: capture file to write (default: count only)")
+    parser.add_argument("--seconds", type=float, default=10.0, help="stream: how long to record")
+    parser.add_argument("--count", type=int, default=1000, help="bench: number of GET requests")
+    args = parser.parse_args()
+
+    if not _listening(args.socket):
+        raise SystemExit(f"no live state daemon on {args.socket}; start the logger with --live-socket")
+    if args.command == "get":
+        now = time.time()
+        for mac, (decoded, seen) in sorted(LiveClient(args.socket).get(args.mac).items()):
+            if not args.max_age or now - seen <= args.max_age:
+                print(json.dumps({**decoded, "mac": mac, "age": round(now - seen, 1)}))
+    elif args.command == "stream":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(args.socket)
+        sock.sendall(b"STREAM\n")
+        sock.settimeout(0.5)
+        received = 0
+        end = time.monotonic() + args.seconds
+        with open(args.output or os.devnull, "wb") as out:
+            while time.monotonic() < end:
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break
+                out.write(data)
+                received += len(data)
+        sock.close()
+        print(f"{received} bytes in {args.seconds:.0f}s" + (f" to {args.output}" if args.output else ""))
+    else:
+        client = LiveClient(args.socket)
+        client.get(args.mac)
+        times = []
+        for _ in range(max(1, args.count)):
+            started = time.perf_counter()
+            client.get(args.mac)
+            times.append(time.perf_counter() - started)
+        print(
+            f"{len(times)} GET(s): p50 {_percentile(times, 0.5) * 1e6:.0f} us, "
+            f"p99 {_percentile(times, 0.99) * 1e6:.0f} us, max {max(times) * 1e6:.0f} us"
+        )
+
+
+if __name__ == "__main__":
+    main()
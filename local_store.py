@@ -0,0 +1,516 @@
+import argparse
+import asyncio
+import functools
+import json
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from metrics import LATENCY_BUCKETS, REGISTRY, SIZE_BUCKETS
+from samples import Sample
+
+MEASUREMENT = "switchbot_meter"
+_FORMAT = 1
+_NO_BATT = -1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS sensors (id INTEGER PRIMARY KEY, mac TEXT NOT NULL UNIQUE, name TEXT NOT NULL DEFAULT '');
+CREATE TABLE IF NOT EXISTS chunks (
+    sensor_id INTEGER NOT NULL,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (sensor_id, start_ms)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chunks_start ON chunks (start_ms);
+CREATE TABLE IF NOT EXISTS latest (
+    sensor_id INTEGER PRIMARY KEY,
+    ts_ms INTEGER NOT NULL,
+    tempc REAL NOT NULL,
+    hum INTEGER NOT NULL,
+    batt INTEGER
+);
+"""
+
+# (ts seconds, tempc, hum, batt or None)
+Row = Tuple[float, float, int, Optional[int]]
+
+
+_BATCH_SIZE = REGISTRY.histogram("switchbot_write_batch_size", "Points per write", SIZE_BUCKETS, sink="local")
+_WRITE_SECONDS = REGISTRY.histogram(
+    "switchbot_write_latency_seconds", "Duration of one write", LATENCY_BUCKETS, sink="local"
+)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _put_column(out: bytearray, values: List[int], base: int = 0) -> None:
+    """Append values as zigzag varints of their deltas (the first one relative to `base`)."""
+    prev = base
+    for value in values:
+        delta = value - prev
+        prev = value
+        z = (delta << 1) ^ (delta >> 63)
+        while z >= 0x80:
+            out.append((z & 0x7F) | 0x80)
+            z >>= 7
+        out.append(z)
+
+
+def _get_column(data: bytes, pos: int, count: int, base: int = 0) -> Tuple[List[int], int]:
+    values = []
+    prev = base
+    for _ in range(count):
+        z = shift = 0
+        while True:
+            b = data[pos]
+            pos += 1
+            z |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        prev += (z >> 1) ^ -(z & 1)
+        values.append(prev)
+    return values, pos
+
+
+class _Chunk:
+    """One sensor's samples inside one time partition, as integer columns."""
+
+    __slots__ = ("start", "ts", "temp", "hum", "batt", "dirty", "merged")
+
+    def __init__(self, start: int) -> None:
+        self.start = start
+        self.ts: List[int] = []
+        self.temp: List[int] = []  # tenths of a degree
+        self.hum: List[int] = []
+        self.batt: List[int] = []
+        self.dirty = False
+        # False until samples an earlier run stored in this partition were put in front of ours.
+        self.merged = False
+
+    def append(self, ts_ms: int, tempc: float, hum: int, batt: Optional[int]) -> None:
+        self.ts.append(ts_ms)
+        self.temp.append(round(tempc * 10))
+        self.hum.append(hum)
+        self.batt.append(_NO_BATT if batt is None else batt)
+        self.dirty = True
+
+    def copy(self) -> "_Chunk":
+        chunk = _Chunk(self.start)
+        chunk.ts, chunk.temp, chunk.hum, chunk.batt = self.ts[:], self.temp[:], self.hum[:], self.batt[:]
+        chunk.merged = self.merged
+        return chunk
+
+    def prepend(self, older: "_Chunk") -> None:
+        self.ts[:0] = older.ts
+        self.temp[:0] = older.temp
+        self.hum[:0] = older.hum
+        self.batt[:0] = older.batt
+
+    def encode(self) -> bytes:
+        out = bytearray([_FORMAT])
+        _put_column(out, self.ts, self.start)
+        _put_column(out, self.temp)
+        _put_column(out, self.hum)
+        _put_column(out, self.batt)
+        return bytes(out)
+
+    @classmethod
+    def decode(cls, start: int, count: int, data: bytes) -> "_Chunk":
+        if data[0] != _FORMAT:
+            raise ValueError(f"unknown chunk format {data[0]}")
+        chunk = cls(start)
+        chunk.ts, pos = _get_column(data, 1, count, start)
+        chunk.temp, pos = _get_column(data, pos, count)
+        chunk.hum, pos = _get_column(data, pos, count)
+        chunk.batt, pos = _get_column(data, pos, count)
+        return chunk
+
+    def rows(self, start_ms: int, end_ms: int) -> List[Row]:
+        return [
+            (ts / 1000, temp / 10, hum, None if batt == _NO_BATT else batt)
+            for ts, temp, hum, batt in zip(self.ts, self.temp, self.hum, self.batt)
+            if start_ms <= ts < end_ms
+        ]
+
+
+class LocalStore:
+    """Embedded time-series store for meter readings, in one SQLite file.
+
+    Samples are grouped per sensor into fixed time partitions (`chunk_seconds`)
+    and each partition is stored as one row of delta/varint-encoded columns, a
+    few bytes per sample. The current partition of every sensor is kept in
+    memory and rewritten on each flush; the `latest` table answers "current
+    value of every sensor" without touching the history. WAL mode lets queries
+    run from another process while the logger writes.
+
+    `add` only touches memory. Flushes run in a worker thread on a connection
+    of their own, so a slow disk or a WAL checkpoint never blocks the event
+    loop; a partition an earlier run already stored is merged in then.
+
+    Has the same add/start/close interface as `BatchWriter`, so the scan logger
+    can use either as its writer.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        chunk_seconds: int = 3600,
+        retention_days: float = 365.0,
+        flush_interval: float = 10.0,
+    ) -> None:
+        self.path = path
+        self.retention_days = retention_days
+        self.flush_interval = flush_interval
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._db.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('chunk_seconds', ?)", (str(int(chunk_seconds)),)
+        )
+        # An existing store keeps the partition size it was created with.
+        (stored,) = self._db.execute("SELECT value FROM meta WHERE key = 'chunk_seconds'").fetchone()
+        self.chunk_ms = int(stored) * 1000
+        self._ids: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+        for sensor_id, mac, name in self._db.execute("SELECT id, mac, name FROM sensors"):
+            self._ids[mac] = sensor_id
+            self._names[sensor_id] = name
+        # This process is the only writer, so sensor ids are handed out here and inserted on flush.
+        self._next_id = max(self._names, default=0) + 1
+        self._new_sensors: Dict[int, Tuple[str, str]] = {}
+        self._writer: Optional[sqlite3.Connection] = None
+        self._open: Dict[int, _Chunk] = {}
+        self._sealed: List[Tuple[int, _Chunk]] = []
+        self._latest: Dict[int, Tuple[int, float, int, Optional[int]]] = {}
+        self._unflushed = 0
+        self._next_retention = 0.0
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._inflight: Optional[asyncio.Future] = None
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return self._unflushed
+
+    def _sensor_id(self, mac: str, name: str) -> int:
+        sensor_id = self._ids.get(mac)
+        if sensor_id is None:
+            sensor_id = self._ids[mac] = self._next_id
+            self._next_id += 1
+            self._names[sensor_id] = name
+            self._new_sensors[sensor_id] = (mac, name)
+        elif name and self._names.get(sensor_id) != name:
+            self._names[sensor_id] = name
+            self._new_sensors[sensor_id] = (mac, name)
+        return sensor_id
+
+    def _load_chunk(self, db: sqlite3.Connection, sensor_id: int, start: int) -> Optional[_Chunk]:
+        row = db.execute(
+            "SELECT count, data FROM chunks WHERE sensor_id = ? AND start_ms = ?", (sensor_id, start)
+        ).fetchone()
+        return _Chunk.decode(start, row[0], row[1]) if row else None
+
+    def add(self, record: Sample) -> None:
+        if not isinstance(record, Sample):
+            self.dropped += 1
+            return
+        if record.measurement != MEASUREMENT:
+            # The store only holds meter readings; link statistics and the like go to the other sinks.
+            return
+        mac = record.tags.get("mac", "")
+        fields = record.fields
+        if not mac or "tempc" not in fields or "hum" not in fields:
+            self.dropped += 1
+            return
+        sensor_id = self._sensor_id(mac, record.tags.get("name", ""))
+        ts_ms = int(record.ts * 1000)
+        start = ts_ms - ts_ms % self.chunk_ms
+        chunk = self._open.get(sensor_id)
+        if chunk is not None and start < chunk.start:
+            # Partitions are append-only once a sensor moved past them.
+            self.dropped += 1
+            return
+        if chunk is None or chunk.start != start:
+            if chunk is not None and chunk.dirty:
+                self._sealed.append((sensor_id, chunk))
+            chunk = self._open[sensor_id] = _Chunk(start)
+        batt = fields.get("batt")
+        chunk.append(ts_ms, float(fields["tempc"]), int(fields["hum"]), None if batt is None else int(batt))
+        self._latest[sensor_id] = (ts_ms, float(fields["tempc"]), int(fields["hum"]), batt)
+        self._unflushed += 1
+
+    def _write(
+        self, sensors: Dict[int, Tuple[str, str]], chunks: List[Tuple[int, _Chunk]], latest: list
+    ) -> Dict[Tuple[int, int], _Chunk]:
+        """Store one flush (runs in a worker thread); returns the stored partitions merged in."""
+        if self._writer is None:
+            self._writer = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._writer.execute("PRAGMA synchronous=NORMAL")
+        db = self._writer
+        merged: Dict[Tuple[int, int], _Chunk] = {}
+        with db:
+            db.execute("BEGIN")
+            db.executemany(
+                "INSERT OR REPLACE INTO sensors (id, mac, name) VALUES (?, ?, ?)",
+                [(sid, mac, name) for sid, (mac, name) in sensors.items()],
+            )
+            rows = []
+            for sid, chunk in chunks:
+                if not chunk.merged:
+                    stored = self._load_chunk(db, sid, chunk.start)
+                    if stored is not None:
+                        merged[sid, chunk.start] = stored
+                        chunk.prepend(stored)
+                rows.append((sid, chunk.start, max(chunk.ts), len(chunk.ts), chunk.encode()))
+            db.executemany("INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)", rows)
+            db.executemany("INSERT OR REPLACE INTO latest VALUES (?, ?, ?, ?, ?)", latest)
+        # Committed: a retention failure must not make the flush look undone (it would be merged again).
+        try:
+            self.apply_retention()
+        except sqlite3.Error as exc:
+            print(f"[{_now().isoformat()}] retention failed: {exc}", flush=True)
+        return merged
+
+    def _finish_write(
+        self,
+        chunks: List[Tuple[int, _Chunk]],
+        sealed: List[Tuple[int, _Chunk]],
+        latest: Dict[int, Tuple[int, float, int, Optional[int]]],
+        sensors: Dict[int, Tuple[str, str]],
+        count: int,
+        started: float,
+        write: asyncio.Future,
+    ) -> None:
+        """Account for a finished write (on the loop, even if the flush awaiting it was cancelled)."""
+        _WRITE_SECONDS.observe(time.perf_counter() - started)
+        if write.cancelled() or write.exception() is not None:
+            # Nothing was committed: put everything back for the next flush.
+            for _, chunk in chunks:
+                chunk.dirty = True
+            self._sealed[:0] = sealed
+            for sid, values in latest.items():
+                self._latest.setdefault(sid, values)
+            for sid, entry in sensors.items():
+                self._new_sensors.setdefault(sid, entry)
+            self._unflushed += count
+            return
+        merged = write.result()
+        for sid, chunk in chunks:
+            stored = merged.get((sid, chunk.start))
+            if stored is not None and not chunk.merged:
+                chunk.prepend(stored)
+            chunk.merged = True
+        self.written += count
+
+    async def flush(self) -> None:
+        async with self._lock:
+            if self._inflight is not None and not self._inflight.done():
+                # Left running by a cancelled flush: one write at a time on the writer connection.
+                await asyncio.wait([self._inflight])
+            sealed = self._sealed
+            chunks = sealed + [(sid, c) for sid, c in self._open.items() if c.dirty]
+            if not chunks and not self._latest and not self._new_sensors:
+                return
+            count = self._unflushed
+            latest, sensors = self._latest, self._new_sensors
+            self._sealed, self._latest, self._new_sensors = [], {}, {}
+            self._unflushed = 0
+            for _, chunk in chunks:
+                chunk.dirty = False
+            _BATCH_SIZE.observe(count)
+            # The worker gets copies: add() keeps appending to the open partitions meanwhile.
+            copies = [(sid, c.copy()) for sid, c in chunks]
+            write = self._inflight = asyncio.ensure_future(
+                asyncio.to_thread(self._write, sensors, copies, [(sid, *values) for sid, values in latest.items()])
+            )
+            write.add_done_callback(
+                functools.partial(self._finish_write, chunks, sealed, latest, sensors, count, time.perf_counter())
+            )
+            # A cancelled flush leaves the thread to finish; _finish_write still accounts for it.
+            await asyncio.shield(write)
+
+    def apply_retention(self, now: Optional[float] = None) -> int:
+        """Delete partitions entirely older than the retention period (checked at most hourly)."""
+        now = time.time() if now is None else now
+        if self.retention_days <= 0 or now < self._next_retention:
+            return 0
+        self._next_retention = now + 3600
+        db = self._writer if self._writer is not None else self._db
+        cutoff = int((now - self.retention_days * 86400) * 1000) - self.chunk_ms
+        with db:
+            db.execute("BEGIN")
+            deleted = db.execute("DELETE FROM chunks WHERE start_ms < ?", (cutoff,)).rowcount
+        if deleted:
+            print(f"[{_now().isoformat()}] retention removed {deleted} chunk(s)", flush=True)
+        return deleted
+
+    async def run(self) -> None:
+        while not self._closed:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as exc:
+                print(f"[{_now().isoformat()}] local store flush failed, retrying: {exc}", flush=True)
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        # Wake the flush loop instead of cancelling it, so a write in progress completes first.
+        self._closed = True
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+        await self.flush()
+        if self._writer is not None:
+            self._writer.close()
+        self._db.close()
+
+    def sensors(self) -> Dict[str, str]:
+        return {mac: self._names.get(sensor_id, "") for mac, sensor_id in self._ids.items()}
+
+    def read_range(self, mac: str, start: float, end: float) -> List[Row]:
+        """Samples of one sensor with start <= ts < end (seconds), oldest first."""
+        sensor_id = self._ids.get(mac.upper())
+        if sensor_id is None:
+            return []
+        start_ms, end_ms = int(start * 1000), int(end * 1000)
+        # Partitions are aligned, so the primary key bounds the search to the overlapping ones.
+        chunks = {
+            chunk_start: (count, data)
+            for chunk_start, count, data in self._db.execute(
+                "SELECT start_ms, count, data FROM chunks WHERE sensor_id = ? AND start_ms > ? AND start_ms < ? "
+                "ORDER BY start_ms",
+                (sensor_id, start_ms - self.chunk_ms, end_ms),
+            )
+        }
+        pending = {c.start: c for sid, c in self._sealed if sid == sensor_id}
+        current = self._open.get(sensor_id)
+        if current is not None:
+            pending[current.start] = current
+        rows: List[Row] = []
+        for chunk_start in sorted(set(chunks) | set(pending)):
+            chunk = pending.get(chunk_start)
+            if chunk is None or (not chunk.merged and chunk_start in chunks):
+                rows.extend(_Chunk.decode(chunk_start, *chunks[chunk_start]).rows(start_ms, end_ms))
+            if chunk is not None:
+                rows.extend(chunk.rows(start_ms, end_ms))
+        return rows
+
+    def downsample(self, mac: str, start: float, end: float, every: float) -> List[dict]:
+        """Per-bucket mean/min/max of tempc and mean humidity, buckets aligned to `every` seconds."""
+        buckets: Dict[float, List[Row]] = {}
+        for row in self.read_range(mac, start, end):
+            buckets.setdefault(row[0] - row[0] % every, []).append(row)
+        out = []
+        for bucket, rows in sorted(buckets.items()):
+            temps = [r[1] for r in rows]
+            out.append(
+                {
+                    "ts": bucket,
+                    "tempc_mean": round(sum(temps) / len(temps), 2),
+                    "tempc_min": min(temps),
+                    "tempc_max": max(temps),
+                    "hum_mean": round(sum(r[2] for r in rows) / len(rows), 1),
+                    "samples": len(rows),
+                }
+            )
+        return out
+
+    def latest(self) -> Dict[str, dict]:
+        """Most recent reading of every sensor, from the latest table plus unflushed samples."""
+        macs = {sensor_id: mac for mac, sensor_id in self._ids.items()}
+        values = {
+            sensor_id: (ts_ms, tempc, hum, batt)
+            for sensor_id, ts_ms, tempc, hum, batt in self._db.execute("SELECT * FROM latest")
+        }
+        values.update(self._latest)
+        return {
+            macs[sensor_id]: {
+                "name": self._names.get(sensor_id, ""),
+                "ts": ts_ms / 1000,
+                "tempc": tempc,
+                "hum": hum,
+                "batt": batt,
+            }
+            for sensor_id, (ts_ms, tempc, hum, batt) in values.items()
+            if sensor_id in macs
+        }
+
+    def stats(self) -> dict:
+        chunks, samples, size = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(count), 0), COALESCE(SUM(LENGTH(data)), 0) FROM chunks"
+        ).fetchone()
+        return {
+            "sensors": len(self._ids),
+            "chunks": chunks,
+            "samples": samples,
+            "data_bytes": size,
+            "bytes_per_sample": round(size / samples, 2) if samples else None,
+            "chunk_seconds": self.chunk_ms // 1000,
+        }
+
+
+def add_store_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--store", default="switchbot.db", help="SQLite file for --sink local")
+    parser.add_argument("--chunk-seconds", type=int, default=3600, help="Time partition size of a new local store")
+    parser.add_argument("--retention-days", type=float, default=365.0, help="Local store retention (0 = keep all)")
+
+
+def store_options(args: argparse.Namespace) -> dict:
+    return {
+        "path": args.store,
+        "chunk_seconds": args.chunk_seconds,
+        "retention_days": args.retention_days,
+        "flush_interval": args.flush_interval,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Query a local SwitchBot store.")
+    parser.add_argument("store", help="SQLite file written by logger_influx_scan.py --sink local")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("latest", help="Current value of every sensor")
+    sub.add_parser("stats", help="Storage statistics")
+    query = sub.add_parser("range", help="Samples of one sensor")
+    query.add_argument("mac")
+    query.add_argument("--hours", type=float, default=24.0, help="How far back to read")
+    query.add_argument("--every", type=float, default=0.0, help="Downsample to buckets of this many seconds")
+    args = parser.parse_args()
+
+    store = LocalStore(args.store)
+    try:
+        if args.command == "latest":
+            print(json.dumps(store.latest(), indent=2))
+        elif args.command == "stats":
+            print(json.dumps(store.stats(), indent=2))
+        else:
+            end = time.time()
+            start = end - args.hours * 3600
+            if args.every > 0:
+                for row in store.downsample(args.mac, start, end, args.every):
+                    print(json.dumps(row))
+            else:
+                for ts, tempc, hum, batt in store.read_range(args.mac, start, end):
+                    print(json.dumps({"ts": ts, "tempc": tempc, "hum": hum, "batt": batt}))
+    finally:
+        asyncio.run(store.close())
+
+
+if __name__ == "__main__":
+    main()
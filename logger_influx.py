@@ -1,49 +1,176 @@
 import argparse
 import asyncio
+import time
 from datetime import datetime, timezone
+from typing import Dict, List, Optional
 
-from influxdb_client import InfluxDBClient, Point, WriteOptions
+from gatt_pool import GattPool
+from influx_writer import BatchWriter, add_writer_arguments, writer_options
+from sensors_config import load_sensors
+from metrics import (
+    LATENCY_BUCKETS,
+    REGISTRY,
+    MetricsExporter,
+    add_metrics_arguments,
+    exporter_from_args,
+    watch_writer,
+)
+from samples import Sample
 
-from read_meter_gatt import read_value
+_READ_OK = REGISTRY.counter("switchbot_gatt_reads_total", "GATT reads", result="ok")
+_READ_EMPTY = REGISTRY.counter("switchbot_gatt_reads_total", "GATT reads", result="no_response")
+_READ_ERROR = REGISTRY.counter("switchbot_gatt_reads_total", "GATT reads", result="error")
+_READ_SECONDS = REGISTRY.histogram("switchbot_gatt_read_seconds", "Duration of one GATT read", LATENCY_BUCKETS)
 
 
 def _now() -> datetime:
     return datetime.now(timezone.utc)
 
 
-async def run(address: str, interval: float, timeout: float, url: str, token: str, org: str, bucket: str) -> None:
-    with InfluxDBClient(url=url, token=token, org=org) as client:
-        write_api = client.write_api(write_options=WriteOptions(batch_size=1))
-        while True:
-            data = await read_value(address, timeout=timeout)
+def _device_list(
+    addresses: List[str], sensors: Dict[str, dict], interval: float, timeout: float
+) -> List[dict]:
+    """Merge CLI addresses and the names file into per-device settings."""
+    if not addresses:
+        addresses = list(sensors)
+    devices = []
+    for address in addresses:
+        cfg = sensors.get(address.lower(), {})
+        devices.append(
+            {
+                "address": address,
+                "name": cfg.get("name", ""),
+                "interval": float(cfg.get("interval", interval)),
+                "timeout": float(cfg.get("timeout", timeout)),
+            }
+        )
+    return devices
+
+
+async def _poll_device(
+    device: dict, pool: GattPool, limiter: asyncio.Semaphore, writer: BatchWriter, start_delay: float
+) -> None:
+    address = device["address"]
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(start_delay)
+    next_due = loop.time()
+    while True:
+        try:
+            async with limiter:
+                started = time.perf_counter()
+                try:
+                    data = await pool.read_value(address, timeout=device["timeout"])
+                finally:
+                    _READ_SECONDS.observe(time.perf_counter() - started)
             if data:
-                print(f"[{_now().isoformat()}] read: tempc={data['tempc']} hum={data['hum']}")
-                point = (
-                    Point("switchbot_meter")
-                    .tag("address", address)
-                    .field("tempc", float(data["tempc"]))
-                    .field("hum", int(data["hum"]))
-                    .time(_now())
-                )
-                write_api.write(bucket=bucket, org=org, record=point)
-                print(f"[{_now().isoformat()}] wrote point to {bucket}")
+                _READ_OK.inc()
+                print(f"[{_now().isoformat()}] {address} read: tempc={data['tempc']} hum={data['hum']}")
+                tags = {"address": address, "name": device["name"]}
+                fields = {"tempc": float(data["tempc"]), "hum": int(data["hum"])}
+                writer.add(Sample("switchbot_meter", tags, fields, time.time()))
             else:
-                print(f"[{_now().isoformat()}] no response")
-            await asyncio.sleep(interval)
+                _READ_EMPTY.inc()
+                print(f"[{_now().isoformat()}] {address} no response")
+        except Exception as exc:
+            _READ_ERROR.inc()
+            # One misbehaving device must not take the other pollers down.
+            print(f"[{_now().isoformat()}] {address} poll failed: {exc}")
+        next_due = max(next_due + device["interval"], loop.time())
+        await asyncio.sleep(next_due - loop.time())
+
+
+async def run(
+    devices: List[dict],
+    url: str,
+    token: str,
+    org: str,
+    bucket: str,
+    writer_opts: Optional[dict] = None,
+    gzip: bool = False,
+    idle_disconnect: float = 300.0,
+    concurrency: int = 2,
+    max_links: Optional[int] = None,
+    exporter: Optional[MetricsExporter] = None,
+) -> None:
+    # Keep every link open only if the adapter has a slot for each device.
+    if max_links is None:
+        max_links = max(1, concurrency)
+    pool = GattPool(max_links=max_links if len(devices) > max_links else None, idle_timeout=idle_disconnect)
+    limiter = asyncio.Semaphore(max(1, concurrency))
+    # Spread first reads over the shortest interval so connects don't pile up.
+    stagger = min(d["interval"] for d in devices) / len(devices)
+    from influxdb_client import InfluxDBClient
+    from influxdb_client.client.write_api import SYNCHRONOUS
+
+    with InfluxDBClient(url=url, token=token, org=org, enable_gzip=gzip) as client:
+        writer = BatchWriter(client.write_api(write_options=SYNCHRONOUS), bucket, org, **(writer_opts or {}))
+        writer.start()
+        if exporter is not None:
+            watch_writer(writer)
+            await exporter.start()
+        pollers = [
+            asyncio.create_task(_poll_device(device, pool, limiter, writer, i * stagger))
+            for i, device in enumerate(devices)
+        ]
+        try:
+            await asyncio.gather(*pollers)
+        finally:
+            for task in pollers:
+                task.cancel()
+            await asyncio.gather(*pollers, return_exceptions=True)
+            await pool.close()
+            if exporter is not None:
+                await exporter.close()
+            await writer.close()
 
 
 def main() -> None:
     parser = argparse.ArgumentParser(description="Log SwitchBot meter readings to InfluxDB.")
-    parser.add_argument("address", help="BLE address/UUID shown by scan")
+    parser.add_argument(
+        "address", nargs="*", help="BLE addresses/UUIDs shown by scan (default: every sensor in --names)"
+    )
+    parser.add_argument("--names", default="sensors.json", help="MAC->name (or settings object) JSON map file")
     parser.add_argument("--interval", type=float, default=60.0, help="Seconds between reads")
     parser.add_argument("--timeout", type=float, default=5.0, help="Seconds to wait for response")
+    parser.add_argument(
+        "--idle-disconnect", type=float, default=300.0, help="Seconds without reads before dropping the connection"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=2, help="Max simultaneous GATT reads (BlueZ adapters handle only a few)"
+    )
+    parser.add_argument(
+        "--max-links",
+        type=int,
+        default=None,
+        help="Max open GATT connections; least recently read devices are disconnected (default: --concurrency)",
+    )
     parser.add_argument("--url", default="http://localhost:8086", help="InfluxDB URL")
     parser.add_argument("--token", required=True, help="InfluxDB token")
     parser.add_argument("--org", default="temperature", help="InfluxDB org")
     parser.add_argument("--bucket", default="switchbot", help="InfluxDB bucket")
+    add_writer_arguments(parser)
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    asyncio.run(run(args.address, args.interval, args.timeout, args.url, args.token, args.org, args.bucket))
+    devices = _device_list(args.address, load_sensors(args.names), args.interval, args.timeout)
+    if not devices:
+        parser.error("no addresses given and no sensors in --names")
+
+    asyncio.run(
+        run(
+            devices,
+            args.url,
+            args.token,
+            args.org,
+            args.bucket,
+            writer_opts=writer_options(args),
+            gzip=args.gzip,
+            idle_disconnect=args.idle_disconnect,
+            concurrency=args.concurrency,
+            max_links=args.max_links,
+            exporter=exporter_from_args(args),
+        )
+    )
 
 
 if __name__ == "__main__":
@@ -1,29 +1,51 @@
 import argparse
 import asyncio
-import json
+import functools
 import time
+from contextlib import ExitStack
 from datetime import datetime, timezone
-from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Callable, Dict, Optional, Sequence, Tuple, Union
 
-from influxdb_client import InfluxDBClient, Point, WriteOptions
-from bleak import BleakScanner
+from aggregate import Deadband, SampleWindow
+from decode_pool import DecodePool, add_decode_arguments, decode_options
+from duty_cycle import DutyCycledScanner, add_duty_cycle_arguments
+from federation import Collector, _host_port
+from gatt_fallback import GattFallback
+from grafana_live import GrafanaLive, add_grafana_live_arguments, grafana_live_from_args
+from influx_writer import BatchWriter, add_writer_arguments, writer_options
+from live_state import DEFAULT_SOCKET, LiveStateServer
+from local_store import LocalStore, add_store_arguments, store_options
+from metrics import (
+    DECODE_BUCKETS,
+    REGISTRY,
+    MetricsExporter,
+    add_metrics_arguments,
+    exporter_from_args,
+    watch_writer,
+)
+from rssi_monitor import LinkMonitor, link_intervals, link_targets
+from samples import Sample
+from sinks import FanOut, SinkRunner, add_sink_arguments, make_sink
+from sensor_registry import Allowlist, SensorRegistry, mac_to_int
+from sensors_config import load_sensors
+from switchbot_decoder import _looks_like_switchbot, _make_manufacturer_hex, decode_advertisement
 
-from scan_switchbot import _decode_with_theengs, _looks_like_switchbot, _make_manufacturer_hex, _make_service_data
+
+_ADS = REGISTRY.counter("switchbot_advertisements_total", "Advertisements received")
+_REJECTED = REGISTRY.counter("switchbot_advertisements_filtered_total", "Dropped before decoding", reason="allowlist")
+_NOT_SWITCHBOT = REGISTRY.counter(
+    "switchbot_advertisements_filtered_total", "Dropped before decoding", reason="not_switchbot"
+)
+_DECODE_OK = REGISTRY.counter("switchbot_decode_total", "Decode attempts", result="ok")
+_DECODE_FAIL = REGISTRY.counter("switchbot_decode_total", "Decode attempts", result="fail")
+_DECODE_SECONDS = REGISTRY.histogram("switchbot_decode_seconds", "Time to decode one advertisement", DECODE_BUCKETS)
+_SENSORS = REGISTRY.gauge("switchbot_active_sensors", "Sensors with a recent reading")
 
 
 def _now() -> datetime:
     return datetime.now(timezone.utc)
 
 
-def _load_name_map(path: str) -> Dict[str, str]:
-    p = Path(path)
-    if not p.exists():
-        return {}
-    data = json.loads(p.read_text())
-    return {k.lower(): v for k, v in data.items()}
-
-
 def _mac_from_manufacturer_hex(manufacturer_hex: Optional[str]) -> Optional[str]:
     if not manufacturer_hex:
         return None
@@ -34,77 +56,253 @@ def _mac_from_manufacturer_hex(manufacturer_hex: Optional[str]) -> Optional[str]
     return ":".join(mac_hex[i : i + 2].upper() for i in range(0, 12, 2))
 
 
-async def run(
+def _add_window_fields(fields: dict, window: SampleWindow) -> None:
+    stats = window.fields()
+    for key in ("tempc_min", "tempc_max", "tempc_mean", "hum_mean"):
+        fields[key] = float(stats[key])
+    fields["hum_min"] = int(stats["hum_min"])
+    fields["hum_max"] = int(stats["hum_max"])
+    fields["samples"] = int(stats["samples"])
+
+
+async def scan_and_log(
+    writer: Union[BatchWriter, LocalStore, SinkRunner, FanOut],
     interval: float,
     stale_after: float,
-    url: str,
-    token: str,
-    org: str,
-    bucket: str,
     name_map: Dict[str, str],
+    scanner_factory: Optional[Callable] = None,
+    fallback: Optional[GattFallback] = None,
+    window_capacity: int = 0,
+    deadband: Optional[Deadband] = None,
+    max_sensors: int = 256,
+    allowlist: Optional[Allowlist] = None,
+    link: Optional[LinkMonitor] = None,
+    link_interval: float = 300.0,
+    decode_opts: Optional[dict] = None,
+    live: Optional[LiveStateServer] = None,
+    push: Optional[GrafanaLive] = None,
 ) -> None:
-    latest: Dict[str, Tuple[dict, float]] = {}
+    """Scan advertisements and queue the latest reading of each sensor every `interval` seconds.
 
-    def cb(device, adv):
-        name = device.name or ""
-        if not _looks_like_switchbot(name, adv):
+    With `window_capacity`, every advertisement between writes is kept in a
+    per-sensor ring buffer and written as min/max/mean/last fields. With a
+    `deadband`, a sensor is only written when its reading moved enough or its
+    heartbeat expired. With an `allowlist`, unknown devices are rejected
+    before decoding. With a `link` monitor, link statistics of its targets
+    are queued as `switchbot_link` points every `link_interval` seconds.
+    With `decode_opts`, the scanner callback only filters and queues raw
+    advertisements; a `DecodePool` decodes them off the event loop. With
+    `live`, other processes can read the latest readings and the raw
+    advertisements instead of scanning themselves. With `push`, every
+    decoded reading also goes to Grafana Live, coalesced per sensor.
+
+    Runs until cancelled, or, for a scanner with a `finished` event (a
+    replay), returns after one last write once it is set.
+    """
+    registry = SensorRegistry(stale_after, max_sensors)
+    names = {}
+    for mac, name in name_map.items():
+        try:
+            names[mac_to_int(mac)] = name
+        except ValueError:
+            pass
+
+    def merge(decoded: Optional[dict], manufacturer_data: dict, seen: float) -> None:
+        if not decoded or "tempc" not in decoded or "hum" not in decoded:
+            _DECODE_FAIL.inc()
             return
+        mac = decoded.get("mac") or _mac_from_manufacturer_hex(_make_manufacturer_hex(manufacturer_data))
+        try:
+            key = mac_to_int(mac or "")
+        except ValueError:
+            _DECODE_FAIL.inc()
+            return
+        _DECODE_OK.inc()
+        record = registry.update(key, decoded, seen)
+        if push is not None:
+            push.update(record.address, names.get(key, ""), decoded, seen)
+        if window_capacity:
+            if record.window is None:
+                record.window = SampleWindow(window_capacity)
+            record.window.add(decoded["tempc"], decoded["hum"])
 
-        manufacturer_hex = _make_manufacturer_hex(adv.manufacturer_data)
-        service_hex, service_uuid = _make_service_data(adv)
+    pool = None
+    if decode_opts:
+        pool = DecodePool(lambda frame, decoded: merge(decoded, frame.manufacturer_data, frame.ts), **decode_opts)
 
-        payload = {
-            "name": name,
-            "id": device.address,
-        }
-        if adv.rssi is not None:
-            payload["rssi"] = adv.rssi
-        if manufacturer_hex:
-            payload["manufacturerdata"] = manufacturer_hex
-        if service_hex:
-            payload["servicedata"] = service_hex
-        if service_uuid:
-            payload["servicedatauuid"] = service_uuid
-
-        decoded = _decode_with_theengs(payload)
-        if not decoded:
+    def cb(device, adv):
+        _ADS.inc()
+        if live is not None:
+            live.publish(device, adv)
+        if link is not None:
+            link.observe(device, adv)
+        if allowlist is not None and not allowlist.accepts(device, adv):
+            _REJECTED.inc()
             return
-        mac = decoded.get("mac") or _mac_from_manufacturer_hex(manufacturer_hex)
-        if not mac:
+        name = device.name or ""
+        if not _looks_like_switchbot(name, adv):
+            _NOT_SWITCHBOT.inc()
             return
-        if "tempc" not in decoded or "hum" not in decoded:
+        if pool is not None:
+            pool.submit(device, adv)
             return
-        latest[mac] = (decoded, time.time())
 
-    with InfluxDBClient(url=url, token=token, org=org) as client:
-        write_api = client.write_api(write_options=WriteOptions(batch_size=1))
-        scanner = BleakScanner(cb)
-        await scanner.start()
+        started = time.perf_counter()
+        decoded = decode_advertisement(device, adv)
+        _DECODE_SECONDS.observe(time.perf_counter() - started)
+        merge(decoded, adv.manufacturer_data, time.time())
+
+    if scanner_factory is None:
+        from bleak import BleakScanner
+
+        scanner_factory = BleakScanner
+    scanner = scanner_factory(cb)
+    wrote = getattr(scanner, "wrote", None)  # duty-cycled scanners plan around the writes
+    finished = getattr(scanner, "finished", None)  # replays end: queue what they fed in, then return
+    if pool is not None:
+        await pool.start()
+    if live is not None:
+        live.attach(registry)
+        await live.start()
+    if push is not None:
+        await push.start()
+    await scanner.start()
+    next_link = time.time() + link_interval
+    try:
         while True:
             now = time.time()
-            active = {m: d for m, (d, ts) in latest.items() if (now - ts) <= stale_after}
+            if link is not None and now >= next_link:
+                next_link = now + link_interval
+                samples = link.samples(now)
+                for sample in samples:
+                    writer.add(sample)
+                print(f"[{_now().isoformat()}] queued link statistics of {len(samples)} sensor(s)", flush=True)
+            if fallback is not None:
+                fallback.check(registry, now)
+            active = registry.active(now)
+            _SENSORS.set(len(active))
+            if deadband is not None:
+                deadband.retain(record.address for record in active)
             if active:
                 print(f"[{_now().isoformat()}] active {len(active)} sensor(s)", flush=True)
             else:
                 print(f"[{_now().isoformat()}] no sensors found", flush=True)
-            for mac, data in active.items():
-                name = name_map.get(mac.lower(), "")
-                point = (
-                    Point("switchbot_meter")
-                    .tag("mac", mac)
-                    .tag("name", name)
-                    .field("tempc", float(data["tempc"]))
-                    .field("hum", int(data["hum"]))
-                    .time(_now())
-                )
+            for record in active:
+                mac, data = record.address, record.decoded
+                if deadband is not None and not deadband.should_write(mac, data["tempc"], data["hum"], now):
+                    continue
+                fields = {"tempc": float(data["tempc"]), "hum": int(data["hum"])}
                 if "batt" in data:
-                    point.field("batt", int(data["batt"]))
-                write_api.write(bucket=bucket, org=org, record=point)
+                    fields["batt"] = int(data["batt"])
+                window = record.window
+                if window is not None and window.count:
+                    _add_window_fields(fields, window)
+                    window.clear()
+                writer.add(Sample("switchbot_meter", {"mac": mac, "name": names.get(record.mac, "")}, fields, now))
                 print(
-                    f"[{_now().isoformat()}] wrote {mac} tempc={data['tempc']} hum={data['hum']}",
+                    f"[{_now().isoformat()}] queued {mac} tempc={data['tempc']} hum={data['hum']}",
                     flush=True,
                 )
-            await asyncio.sleep(interval)
+            if wrote is not None:
+                wrote(now)
+            if finished is None:
+                await asyncio.sleep(interval)
+                continue
+            if finished.is_set():
+                return
+            try:
+                await asyncio.wait_for(finished.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        await scanner.stop()
+        if pool is not None:
+            await pool.close()
+        if live is not None:
+            await live.close()
+        if push is not None:
+            await push.close()
+
+
+async def run(
+    interval: float,
+    stale_after: float,
+    url: str,
+    token: str,
+    org: str,
+    bucket: str,
+    name_map: Dict[str, str],
+    writer_opts: Optional[dict] = None,
+    gzip: bool = False,
+    fallback_opts: Optional[dict] = None,
+    window_capacity: int = 0,
+    deadband: Optional[Deadband] = None,
+    max_sensors: int = 256,
+    allowlist: Optional[Allowlist] = None,
+    store_opts: Optional[dict] = None,
+    exporter: Optional[MetricsExporter] = None,
+    sinks: Sequence[Tuple[str, str]] = (("influx", ""),),
+    mqtt_topic: str = "switchbot",
+    scanner_factory: Optional[Callable] = None,
+    link: Optional[LinkMonitor] = None,
+    link_interval: float = 300.0,
+    decode_opts: Optional[dict] = None,
+    live: Optional[LiveStateServer] = None,
+    push: Optional[GrafanaLive] = None,
+) -> None:
+    """Log to every (kind, target) in `sinks`; each one is fed independently of the others."""
+    fallback = GattFallback(list(name_map), **fallback_opts) if fallback_opts else None
+
+    async def log_to(writer) -> None:
+        writer.start()
+        if exporter is not None:
+            watch_writer(writer)
+            await exporter.start()
+        try:
+            await scan_and_log(
+                writer,
+                interval,
+                stale_after,
+                name_map,
+                scanner_factory=scanner_factory,
+                fallback=fallback,
+                window_capacity=window_capacity,
+                deadband=deadband,
+                max_sensors=max_sensors,
+                allowlist=allowlist,
+                link=link,
+                link_interval=link_interval,
+                decode_opts=decode_opts,
+                live=live,
+                push=push,
+            )
+        finally:
+            if fallback is not None:
+                await fallback.close()
+            if exporter is not None:
+                await exporter.close()
+            await writer.close()
+
+    writer_opts = writer_opts or {}
+    queue_keys = ("batch_size", "flush_interval", "max_queue", "overflow")
+    queue_opts = {k: writer_opts[k] for k in queue_keys if k in writer_opts}
+    writers = []
+    with ExitStack() as stack:
+        for kind, target in sinks:
+            if kind == "influx":
+                from influxdb_client import InfluxDBClient
+                from influxdb_client.client.write_api import SYNCHRONOUS
+
+                client = stack.enter_context(InfluxDBClient(url=url, token=token, org=org, enable_gzip=gzip))
+                writers.append(BatchWriter(client.write_api(write_options=SYNCHRONOUS), bucket, org, **writer_opts))
+            elif kind == "local":
+                opts = {"path": "switchbot.db", **(store_opts or {})}
+                if target:
+                    opts["path"] = target
+                writers.append(LocalStore(**opts))
+            else:
+                writers.append(SinkRunner(make_sink(kind, target, mqtt_topic), **queue_opts))
+        await log_to(writers[0] if len(writers) == 1 else FanOut(writers))
 
 
 def main() -> None:
@@ -113,13 +311,127 @@ def main() -> None:
     parser.add_argument("--stale", type=float, default=120.0, help="Seconds to keep last seen sensor active")
     parser.add_argument("--names", default="sensors.json", help="MAC->name JSON map file")
     parser.add_argument("--url", default="http://localhost:8086", help="InfluxDB URL")
-    parser.add_argument("--token", required=True, help="InfluxDB token")
+    parser.add_argument("--token", default="", help="InfluxDB token (required with the influx sink)")
     parser.add_argument("--org", default="temperature", help="InfluxDB org")
     parser.add_argument("--bucket", default="switchbot", help="InfluxDB bucket")
+    parser.add_argument(
+        "--gatt-fallback",
+        type=float,
+        default=0.0,
+        help="Read known sensors over GATT when no advertisement was seen for this many seconds (0 = off)",
+    )
+    parser.add_argument("--gatt-max-connections", type=int, default=1, help="Max simultaneous GATT fallback reads")
+    parser.add_argument("--gatt-cooldown", type=float, default=300.0, help="Min seconds between GATT reads per sensor")
+    parser.add_argument("--gatt-timeout", type=float, default=5.0, help="Seconds to wait for a GATT response")
+    parser.add_argument(
+        "--aggregate",
+        type=int,
+        default=0,
+        metavar="CAPACITY",
+        help="Buffer up to CAPACITY samples per sensor and write min/max/mean/last per window (0 = off)",
+    )
+    parser.add_argument("--deadband-temp", type=float, default=0.0, help="Only write when tempc moved by this much")
+    parser.add_argument("--deadband-hum", type=float, default=0.0, help="Only write when hum moved by this much")
+    parser.add_argument("--heartbeat", type=float, default=600.0, help="Write at least this often with a deadband")
+    parser.add_argument("--max-sensors", type=int, default=256, help="Max sensors tracked at once (oldest evicted)")
+    parser.add_argument(
+        "--known-only", action="store_true", help="Ignore devices not listed in --names before decoding"
+    )
+    parser.add_argument(
+        "--link-stats",
+        type=float,
+        default=0.0,
+        metavar="SECONDS",
+        help="Write RSSI/jitter/loss statistics of the sensors in --names every SECONDS (0 = off)",
+    )
+    add_writer_arguments(parser)
+    add_store_arguments(parser)
+    parser.add_argument("--adapter", default=None, help="Bluetooth adapter to scan with, e.g. hci1")
+    parser.add_argument(
+        "--listen-nodes",
+        default="",
+        metavar="HOST:PORT",
+        help="Take advertisements from federation.py nodes on this UDP address instead of scanning locally",
+    )
+    parser.add_argument(
+        "--live-socket",
+        nargs="?",
+        const=DEFAULT_SOCKET,
+        default="",
+        metavar="PATH",
+        help=f"Serve the latest readings and raw advertisements to other tools on this Unix socket ({DEFAULT_SOCKET})",
+    )
+    add_grafana_live_arguments(parser)
+    add_duty_cycle_arguments(parser)
+    add_decode_arguments(parser)
+    add_metrics_arguments(parser)
+    add_sink_arguments(parser)
     args = parser.parse_args()
+    sinks = args.sink or [("influx", "")]
+    if any(kind == "influx" for kind, _ in sinks) and not args.token:
+        parser.error("--token is required with the influx sink")
+    if args.grafana_live and not args.grafana_token:
+        parser.error("--grafana-live needs --grafana-token (or GRAFANA_TOKEN)")
+
+    sensors = load_sensors(args.names)
+    name_map = {mac: cfg.get("name", "") for mac, cfg in sensors.items()}
+    link = None
+    if args.link_stats > 0:
+        if not sensors:
+            parser.error("--link-stats needs the sensors to watch in --names")
+        link = LinkMonitor(link_targets(sensors), intervals=link_intervals(sensors))
+    fallback_opts = None
+    if args.gatt_fallback > 0:
+        fallback_opts = {
+            "after": args.gatt_fallback,
+            "cooldown": args.gatt_cooldown,
+            "max_connections": args.gatt_max_connections,
+            "timeout": args.gatt_timeout,
+        }
+    scanner_factory = None
+    if args.listen_nodes:
+        scanner_factory = Collector(*_host_port(args.listen_nodes, "0.0.0.0"))
+    elif args.adapter:
+        from bleak import BleakScanner
 
-    name_map = _load_name_map(args.names)
-    asyncio.run(run(args.interval, args.stale, args.url, args.token, args.org, args.bucket, name_map))
+        scanner_factory = functools.partial(BleakScanner, adapter=args.adapter)
+    if args.duty_cycle:
+        if args.listen_nodes:
+            parser.error("--duty-cycle schedules a local radio; it cannot be used with --listen-nodes")
+        if not name_map:
+            parser.error("--duty-cycle needs the sensors to wait for in --names")
+        scanner_factory = DutyCycledScanner(name_map, args.interval, scanner_factory, guard=args.duty_guard)
+    deadband = None
+    if args.deadband_temp > 0 or args.deadband_hum > 0:
+        deadband = Deadband(args.deadband_temp, args.deadband_hum, args.heartbeat)
+    asyncio.run(
+        run(
+            args.interval,
+            args.stale,
+            args.url,
+            args.token,
+            args.org,
+            args.bucket,
+            name_map,
+            writer_opts=writer_options(args),
+            gzip=args.gzip,
+            fallback_opts=fallback_opts,
+            window_capacity=args.aggregate,
+            deadband=deadband,
+            max_sensors=args.max_sensors,
+            allowlist=Allowlist(name_map) if args.known_only else None,
+            store_opts=store_options(args),
+            exporter=exporter_from_args(args),
+            sinks=sinks,
+            mqtt_topic=args.mqtt_topic,
+            scanner_factory=scanner_factory,
+            link=link,
+            link_interval=args.link_stats,
+            decode_opts=decode_options(args),
+            live=LiveStateServer(args.live_socket) if args.live_socket else None,
+            push=grafana_live_from_args(args),
+        )
+    )
 
 
 if __name__ == "__main__":
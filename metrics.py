@@ -0,0 +1,204 @@
+import argparse
+import asyncio
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter; `inc` is a plain attribute update, cheap enough for BLE callbacks.
+
+    With `fn`, the value is read from an existing counter attribute at scrape time instead.
+    """
+
+    __slots__ = ("labels", "value", "fn")
+
+    def __init__(self, labels: str = "", fn: Optional[Callable[[], float]] = None) -> None:
+        self.labels = labels
+        self.value = 0
+        self.fn = fn
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def samples(self, name: str) -> List[str]:
+        value = self.fn() if self.fn is not None else self.value
+        return [f"{name}{self.labels} {_num(value)}"]
+
+
+class Gauge(Counter):
+    """Current value, either set explicitly or read from `fn` at scrape time."""
+
+    __slots__ = ()
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Histogram:
+    """Fixed-bucket histogram: per-bucket counts are preallocated, `observe` is one bisect."""
+
+    __slots__ = ("labels", "bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float], labels: str = "") -> None:
+        self.labels = labels
+        self.bounds = tuple(sorted(bounds))
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str) -> List[str]:
+        # Bucket counts are stored per bucket and made cumulative only when scraped.
+        inner = self.labels[1:-1] + "," if self.labels else ""
+        out = []
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            out.append(f'{name}_bucket{{{inner}le="{_num(bound)}"}} {total}')
+        out.append(f"{name}_sum{self.labels} {_num(self.sum)}")
+        out.append(f"{name}_count{self.labels} {self.count}")
+        return out
+
+
+class Registry:
+    """Named metric families rendered in the Prometheus text exposition format."""
+
+    def __init__(self) -> None:
+        # name -> (type, help, {label string: metric})
+        self._families: Dict[str, Tuple[str, str, Dict[str, object]]] = {}
+
+    def _get(self, kind: str, name: str, help: str, labels: Dict[str, str], make: Callable[[str], object]):
+        family = self._families.setdefault(name, (kind, help, {}))
+        if family[0] != kind:
+            raise ValueError(f"metric {name} already registered as {family[0]}")
+        key = _labels(labels)
+        metric = family[2].get(key)
+        if metric is None:
+            metric = family[2][key] = make(key)
+        return metric
+
+    def counter(self, name: str, help: str, fn: Optional[Callable[[], float]] = None, **labels: str) -> Counter:
+        counter = self._get("counter", name, help, labels, Counter)
+        if fn is not None:
+            counter.fn = fn
+        return counter
+
+    def gauge(self, name: str, help: str, fn: Optional[Callable[[], float]] = None, **labels: str) -> Gauge:
+        gauge = self._get("gauge", name, help, labels, Gauge)
+        if fn is not None:
+            gauge.fn = fn
+        return gauge
+
+    def histogram(self, name: str, help: str, bounds: Sequence[float], **labels: str) -> Histogram:
+        return self._get("histogram", name, help, labels, lambda key: Histogram(bounds, key))
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help, metrics) in sorted(self._families.items()):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for metric in metrics.values():
+                lines.extend(metric.samples(name))
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DECODE_BUCKETS = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+SIZE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000)
+
+
+class MetricsExporter:
+    """Serve `registry` on http://host:port/metrics and measure event-loop lag.
+
+    Lag is how late a `lag_interval` sleep wakes up: anything running too long
+    on the loop (a slow callback, a blocking call) shows up there.
+    """
+
+    def __init__(self, host: str, port: int, registry: Registry = REGISTRY, lag_interval: float = 0.5) -> None:
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.lag_interval = lag_interval
+        self._lag = registry.histogram("switchbot_loop_lag_seconds", "Event-loop wake-up delay", LAG_BUCKETS)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            while (await asyncio.wait_for(reader.readline(), timeout=5.0)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] in (b"/metrics", b"/"):
+                status, body = "200 OK", self.registry.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _measure_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            self._lag.observe(max(0.0, loop.time() - expected))
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self._task = asyncio.create_task(self._measure_lag())
+        print(f"[{_now().isoformat()}] metrics on http://{self.host}:{self.port}/metrics", flush=True)
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+def watch_writer(writer, registry: Registry = REGISTRY) -> None:
+    """Expose a writer's queue depth and drop count (BatchWriter or LocalStore)."""
+    registry.gauge("switchbot_writer_queue_depth", "Points waiting to be written", fn=lambda: len(writer))
+    registry.counter("switchbot_writer_dropped_points_total", "Points dropped by the writer", fn=lambda: writer.dropped)
+
+
+def add_metrics_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus metrics on this port (0 = off)")
+    parser.add_argument("--metrics-host", default="127.0.0.1", help="Address for the metrics endpoint")
+
+
+def exporter_from_args(args: argparse.Namespace) -> Optional[MetricsExporter]:
+    return MetricsExporter(args.metrics_host, args.metrics_port) if args.metrics_port else None
@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import json
+import os
+import struct
+import sys
+from datetime import datetime, timezone
+from typing import List, Optional, Set, Tuple
+
+_CONNECT = 0x10
+_CONNACK = 0x20
+_PUBLISH = 0x30
+_PINGREQ = 0xC0
+_PINGRESP = 0xD0
+_DISCONNECT = 0xE0
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _remaining_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, n = n & 0x7F, n >> 7
+        out.append(byte | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def _string(value: str) -> bytes:
+    data = value.encode()
+    return struct.pack(">H", len(data)) + data
+
+
+def _packet(kind: int, body: bytes = b"") -> bytes:
+    return bytes([kind]) + _remaining_length(len(body)) + body
+
+
+async def _read_packet(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    header = (await reader.readexactly(1))[0]
+    length = shift = 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return header, await reader.readexactly(length)
+
+
+class MqttClient:
+    """Minimal MQTT 3.1.1 publisher (QoS 0 only), enough to push readings to a broker."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 1883,
+        *,
+        client_id: Optional[str] = None,
+        keepalive: int = 60,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.client_id = client_id or f"switchbot-{os.getpid()}"
+        self.keepalive = keepalive
+        self.username = username
+        self.password = password
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self, timeout: float = 10.0) -> None:
+        flags = 0x02  # clean session
+        payload = _string(self.client_id)
+        if self.username is not None:
+            flags |= 0x80
+            payload += _string(self.username)
+            if self.password is not None:
+                flags |= 0x40
+                payload += _string(self.password)
+        body = _string("MQTT") + bytes([4, flags]) + struct.pack(">H", self.keepalive) + payload
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), timeout=timeout
+        )
+        self._writer.write(_packet(_CONNECT, body))
+        await self._writer.drain()
+        kind, ack = await asyncio.wait_for(_read_packet(self._reader), timeout=timeout)
+        if kind & 0xF0 != _CONNACK or len(ack) != 2 or ack[1] != 0:
+            await self._drop()
+            raise ConnectionError(f"MQTT broker refused connection (code {ack[1] if len(ack) == 2 else '?'})")
+        self._tasks = [asyncio.create_task(self._read_loop()), asyncio.create_task(self._ping_loop())]
+
+    async def _read_loop(self) -> None:
+        # Only PINGRESP is expected; reading also notices a broker that went away.
+        try:
+            while True:
+                await _read_packet(self._reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        if self._writer is not None:
+            self._writer.close()
+
+    async def _ping_loop(self) -> None:
+        while self.connected:
+            await asyncio.sleep(max(1, self.keepalive // 2))
+            if self.connected:
+                self._writer.write(_packet(_PINGREQ))
+
+    async def publish(self, topic: str, payload: bytes, retain: bool = False) -> None:
+        if not self.connected:
+            raise ConnectionError("MQTT client not connected")
+        self._writer.write(_packet(_PUBLISH | (0x01 if retain else 0), _string(topic) + payload))
+        await self._writer.drain()
+
+    async def _drop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def close(self) -> None:
+        if self.connected:
+            try:
+                self._writer.write(_packet(_DISCONNECT))
+                await self._writer.drain()
+            except ConnectionError:
+                pass
+        await self._drop()
+
+
+class StandInBroker:
+    """Tiny local MQTT broker stand-in: acknowledges connects and records every publish.
+
+    Nothing is forwarded to subscribers; it exists to check what a logger
+    publishes without installing a real broker.
+    """
+
+    def __init__(self, verbose: bool = False) -> None:
+        self.verbose = verbose
+        self.messages: List[Tuple[str, bytes]] = []
+        self.connects = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._clients: Set[asyncio.StreamWriter] = set()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        try:
+            while True:
+                kind, body = await _read_packet(reader)
+                packet = kind & 0xF0
+                if packet == _CONNECT:
+                    self.connects += 1
+                    writer.write(_packet(_CONNACK, b"\x00\x00"))
+                elif packet == _PUBLISH:
+                    (size,) = struct.unpack_from(">H", body)
+                    topic = body[2 : 2 + size].decode()
+                    start = 2 + size + (2 if kind & 0x06 else 0)  # skip the packet id for QoS > 0
+                    self.messages.append((topic, body[start:]))
+                    if self.verbose:
+                        print(f"{topic} {body[start:].decode(errors='replace')}", flush=True)
+                elif packet == _PINGREQ:
+                    writer.write(_packet(_PINGRESP))
+                elif packet == _DISCONNECT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    def drop_clients(self) -> None:
+        """Close every client connection, as a broker restart would."""
+        for writer in list(self._clients):
+            writer.close()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self.drop_clients()
+            await self._server.wait_closed()
+
+
+async def _wait_for(condition, timeout: float = 2.0) -> bool:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        if loop.time() > deadline:
+            return False
+        await asyncio.sleep(0.01)
+    return True
+
+
+async def self_check() -> int:
+    """Publish through the mqtt sink to a stand-in broker on a free port; returns the number of failed checks."""
+    from samples import Sample
+    from sinks import MqttSink, SinkRunner
+
+    failures = 0
+
+    def report(name: str, ok: bool, detail: str = "") -> None:
+        nonlocal failures
+        failures += not ok
+        print(f"{'ok' if ok else 'FAIL':4} {name}{': ' + detail if detail and not ok else ''}", flush=True)
+
+    broker = StandInBroker()
+    port = await broker.start()
+    runner = SinkRunner(MqttSink("127.0.0.1", port, topic="check"), flush_interval=0.05)
+    runner.start()
+    try:
+        runner.add(Sample("switchbot_meter", {"mac": "AA:BB:CC:DD:EE:01", "name": "Salon"}, {"tempc": 21.5}, 1e9))
+        runner.add(Sample("switchbot_link", {"mac": "AA:BB:CC:DD:EE:01"}, {"rssi_ewma": -60.0}, 1e9))
+        await _wait_for(lambda: len(broker.messages) >= 2)
+        topics = [topic for topic, _ in broker.messages]
+        payload = json.loads(broker.messages[0][1]) if broker.messages else {}
+        report(
+            "publish",
+            topics == ["check/AA:BB:CC:DD:EE:01", "check/AA:BB:CC:DD:EE:01/switchbot_link"]
+            and payload.get("tempc") == 21.5
+            and payload.get("name") == "Salon",
+            f"got {topics} {payload}",
+        )
+
+        # Remaining lengths of two and three bytes.
+        long_name = "x" * 20_000
+        runner.add(Sample("switchbot_meter", {"mac": "AA:BB:CC:DD:EE:02", "name": long_name}, {"tempc": 1.0}, 1e9))
+        await _wait_for(lambda: len(broker.messages) >= 3)
+        got = json.loads(broker.messages[2][1]).get("name", "") if len(broker.messages) >= 3 else ""
+        report("large payload", got == long_name, f"name of {len(got)} bytes")
+
+        broker.drop_clients()
+        await _wait_for(lambda: not runner.sink._client.connected)
+        runner.add(Sample("switchbot_meter", {"mac": "AA:BB:CC:DD:EE:03"}, {"tempc": 2.0}, 1e9))
+        await _wait_for(lambda: len(broker.messages) >= 4)
+        report(
+            "reconnect",
+            broker.connects == 2 and len(broker.messages) == 4,
+            f"{broker.connects} connect(s), {len(broker.messages)} message(s), {runner.dropped} dropped",
+        )
+    finally:
+        await runner.close(timeout=2.0)
+        await broker.close()
+    return failures
+
+
+async def _serve(host: str, port: int) -> None:
+    broker = StandInBroker(verbose=True)
+    port = await broker.start(host, port)
+    print(f"[{_now().isoformat()}] stand-in MQTT broker on {host}:{port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await broker.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a stand-in MQTT broker that prints every publish.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Instead, publish through the mqtt sink to a broker on a free port and verify what arrives",
+    )
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(1 if asyncio.run(self_check()) else 0)
+    try:
+        asyncio.run(_serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,6 @@ import argparse
 import asyncio
 from typing import Optional
 
-from bleak import BleakClient
-
 WRITE_UUID = "cba20002-224d-11e6-9fb8-0002a5d5c51b"
 NOTIFY_UUID = "cba20003-224d-11e6-9fb8-0002a5d5c51b"
 
@@ -13,6 +11,29 @@ def _build_read_value_req() -> bytes:
     return bytes([0x57, 0x0F, 0x31])
 
 
+def _build_basic_info_req() -> bytes:
+    # 0x57 magic, command 0x02 (get device basic info), no payload
+    return bytes([0x57, 0x02])
+
+
+def _build_hw_version_req() -> bytes:
+    # 0x57 magic, command 0x0F (extend), payload 0x14 (read hardware version)
+    return bytes([0x57, 0x0F, 0x14])
+
+
+def _parse_basic_info_resp(data: bytes) -> Optional[dict]:
+    # meter.md gives the success status as both 0 and 1; accept either.
+    if len(data) != 5 or data[0] not in (0x00, 0x01):
+        return None
+    return {"batt": data[1], "firmware": data[2], "service_data": data[3:5].hex()}
+
+
+def _parse_hw_version_resp(data: bytes) -> Optional[dict]:
+    if len(data) != 2 or data[0] != 0x01:
+        return None
+    return {"hardware": data[1]}
+
+
 def _parse_value_resp(data: bytes) -> Optional[dict]:
     if not data or data[0] != 0x01:
         return None
@@ -37,6 +58,8 @@ async def read_value(address: str, timeout: float) -> Optional[dict]:
             result = parsed
             done.set()
 
+    from bleak import BleakClient
+
     async with BleakClient(address) as client:
         await client.start_notify(NOTIFY_UUID, on_notify)
         await client.write_gatt_char(WRITE_UUID, _build_read_value_req(), response=False)
@@ -1,17 +1,21 @@
 import json
+import sys
 
-from scan_switchbot import read_sensor
+from scan_switchbot import read_sensors
 
 MAC = "EA:06:06:3B:35:B7"
 TIMEOUT = 20
 
 
 def main() -> None:
-    data = read_sensor(MAC, timeout=TIMEOUT)
-    if data is None:
-        print(json.dumps({"error": "timeout", "mac": MAC}))
-        return
-    print(json.dumps(data))
+    macs = sys.argv[1:] or [MAC]
+    found = read_sensors(macs, timeout=TIMEOUT)
+    for mac in macs:
+        data = found.get(mac.upper())
+        if data is None:
+            print(json.dumps({"error": "timeout", "mac": mac}))
+            continue
+        print(json.dumps(data))
 
 
 if __name__ == "__main__":
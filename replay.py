@@ -0,0 +1,164 @@
+import argparse
+import asyncio
+import time
+from typing import Callable, List, Optional
+
+from adv_capture import read_capture, to_callback_args
+
+
+class ReplayScanner:
+    """BleakScanner stand-in that feeds captured advertisements to a detection callback.
+
+    `speed` scales the recorded inter-arrival times (1.0 = real time); 0 replays
+    as fast as possible, yielding to the event loop every `yield_every` frames.
+    """
+
+    def __init__(self, callback: Callable, frames: List[tuple], speed: float = 1.0, loops: int = 1, yield_every: int = 64):
+        self._callback = callback
+        self._frames = frames
+        self.speed = speed
+        self.loops = loops
+        self.yield_every = yield_every
+        self.count = 0
+        self.elapsed = 0.0
+        self.finished = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        offset = 0.0
+        try:
+            for _ in range(self.loops):
+                if not self._frames:
+                    break
+                first_ts = self._frames[0][0]
+                span = self._frames[-1][0] - first_ts
+                for ts, device, adv in self._frames:
+                    if self.speed > 0:
+                        delay = (offset + ts - first_ts) / self.speed - (loop.time() - start)
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    elif self.count % self.yield_every == 0:
+                        await asyncio.sleep(0)
+                    self._callback(device, adv)
+                    self.count += 1
+                offset += span
+        finally:
+            self.elapsed = loop.time() - start
+            self.finished.set()
+
+
+class Replay:
+    """Scanner factory for the `scanner_factory` hooks of the scan/log entry points."""
+
+    def __init__(self, path: str, speed: float = 1.0, loops: int = 1) -> None:
+        self.frames = [(f.ts,) + to_callback_args(f) for f in read_capture(path)]
+        self.speed = speed
+        self.loops = loops
+        self.scanner: Optional[ReplayScanner] = None
+
+    def __call__(self, callback: Callable) -> ReplayScanner:
+        self.scanner = ReplayScanner(callback, self.frames, self.speed, self.loops)
+        return self.scanner
+
+    async def wait(self) -> ReplayScanner:
+        while self.scanner is None:
+            await asyncio.sleep(0)
+        await self.scanner.finished.wait()
+        return self.scanner
+
+
+class CountingWriteApi:
+    """Write API stand-in that only counts what would have been sent to InfluxDB."""
+
+    def __init__(self) -> None:
+        self.points = 0
+        self.bytes = 0
+        self.requests = 0
+
+    def write(self, bucket: str, org: str, record: str) -> None:
+        self.requests += 1
+        self.points += record.count("\n") + 1
+        self.bytes += len(record)
+
+
+async def _until_replayed(replay: Replay, coro) -> ReplayScanner:
+    task = asyncio.create_task(coro)
+    scanner = await replay.wait()
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    return scanner
+
+
+async def _replay_logger(replay: Replay, args: argparse.Namespace) -> None:
+    from influx_writer import BatchWriter
+    from logger_influx_scan import scan_and_log
+    from sensors_config import load_name_map
+
+    api = CountingWriteApi()
+    writer = BatchWriter(api, "replay", "replay", flush_interval=args.interval)
+    writer.start()
+    # Returns once the replay is over, after queueing the readings it fed in.
+    await scan_and_log(writer, args.interval, args.stale, load_name_map(args.names), scanner_factory=replay)
+    await writer.close()
+    _report(replay.scanner)
+    print(f"points written: {api.points} in {api.requests} request(s), {api.bytes} bytes")
+
+
+async def _replay_read(replay: Replay, args: argparse.Namespace) -> None:
+    from scan_switchbot import read_sensor_async
+
+    start = time.perf_counter()
+    found = await read_sensor_async(args.mac, timeout=args.timeout, scanner_factory=replay)
+    print(f"read {args.mac}: {found} after {time.perf_counter() - start:.3f}s")
+
+
+async def _replay_rssi(replay: Replay, args: argparse.Namespace) -> None:
+    from rssi_monitor import monitor
+
+    _report(await _until_replayed(replay, monitor(args.mac, args.interval, scanner_factory=replay)))
+
+
+def _report(scanner: ReplayScanner) -> None:
+    rate = scanner.count / scanner.elapsed if scanner.elapsed else float("inf")
+    print(f"replayed {scanner.count} advertisement(s) in {scanner.elapsed:.3f}s ({rate:,.0f}/s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay an advertisement capture through the scan pipeline.")
+    parser.add_argument("capture", help="Capture file recorded with scan_switchbot.py --capture")
+    parser.add_argument("target", choices=("logger", "read", "rssi"), help="Pipeline to drive")
+    parser.add_argument("--speed", type=float, default=0.0, help="Replay speed multiplier (0 = as fast as possible)")
+    parser.add_argument("--loops", type=int, default=1, help="Replay the capture this many times")
+    parser.add_argument("--mac", default="", help="Target MAC for the read and rssi pipelines")
+    parser.add_argument("--interval", type=float, default=1.0, help="Logger write interval / rssi print interval")
+    parser.add_argument("--stale", type=float, default=120.0, help="Logger stale threshold in seconds")
+    parser.add_argument("--names", default="sensors.json", help="MAC->name JSON map file")
+    parser.add_argument("--timeout", type=float, default=20.0, help="Read timeout in seconds")
+    args = parser.parse_args()
+
+    if args.target != "logger" and not args.mac:
+        parser.error(f"--mac is required for the {args.target} pipeline")
+
+    replay = Replay(args.capture, speed=args.speed, loops=args.loops)
+    runner = {"logger": _replay_logger, "read": _replay_read, "rssi": _replay_rssi}[args.target]
+    asyncio.run(runner(replay, args))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,14 +2,14 @@ import argparse
 import asyncio
 import time
 
-from bleak import BleakClient, BleakScanner
-
 
 def _fmt(ts: float) -> str:
     return time.strftime("%H:%M:%S", time.localtime(ts))
 
 
 async def monitor(address: str, interval: float) -> None:
+    from bleak import BleakClient, BleakScanner
+
     # Try connected RSSI if backend supports it; otherwise fall back to adv RSSI.
     async with BleakClient(address) as client:
         print(f"Connected: {client.is_connected}")
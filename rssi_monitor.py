@@ -1,100 +1,127 @@
 import argparse
 import asyncio
 import time
-
-from bleak import BleakScanner
-
-try:
-    import TheengsDecoder  # type: ignore
-except Exception:
-    TheengsDecoder = None
-
-
-def _uuid16_from_uuid(uuid: str) -> str:
-    u = uuid.lower()
-    if u.startswith("0000") and u.endswith("-0000-1000-8000-00805f9b34fb"):
-        return u[4:8]
-    return u.replace("-", "")
-
-
-def _hex(b: bytes) -> str:
-    return b.hex()
-
-
-def _make_manufacturer_hex(manufacturer_data: dict[int, bytes]):
-    if not manufacturer_data:
-        return None
-    for company_id in (0x0969, 0x0059):
-        if company_id in manufacturer_data:
-            data = manufacturer_data[company_id]
-            return company_id.to_bytes(2, "little").hex() + _hex(data)
-    company_id, data = next(iter(manufacturer_data.items()))
-    return company_id.to_bytes(2, "little").hex() + _hex(data)
-
-
-def _make_service_data(adv):
-    if not adv.service_data:
-        return None, None
-    for uuid, data in adv.service_data.items():
-        if _uuid16_from_uuid(uuid) == "fd3d":
-            return _hex(data), "fd3d"
-    uuid, data = next(iter(adv.service_data.items()))
-    return _hex(data), _uuid16_from_uuid(uuid)
-
-
-def _decode_with_theengs(payload: dict):
-    if TheengsDecoder is None:
-        return None
-    decoded = TheengsDecoder.decodeBLE(__import__("json").dumps(payload))
-    if not decoded:
-        return None
+from typing import Callable, Dict, List, Optional
+
+from aggregate import LinkStats
+from samples import Sample
+from sensor_registry import Allowlist
+from switchbot_decoder import decode_advertisement
+
+LINK_MEASUREMENT = "switchbot_link"
+
+
+class LinkMonitor:
+    """Streaming link statistics for a fixed set of devices.
+
+    `observe` matches an advertisement against the targets by MAC before
+    anything is decoded, so non-targets cost one dict lookup. Memory is
+    constant per target (see `LinkStats`).
+    """
+
+    def __init__(
+        self,
+        targets: Dict[str, str],
+        *,
+        capacity: int = 64,
+        alpha: float = 0.1,
+        intervals: Optional[Dict[str, float]] = None,
+    ) -> None:
+        intervals = {mac.upper(): value for mac, value in (intervals or {}).items()}
+        self.allowlist = Allowlist(targets)
+        self.names = {mac.upper(): name for mac, name in targets.items()}
+        self.stats = {mac: LinkStats(capacity, alpha, intervals.get(mac)) for mac in self.names}
+        self.rejected = 0
+
+    def observe(self, device, adv, now: Optional[float] = None) -> Optional[str]:
+        """Record one advertisement; returns the target MAC it came from, or None for a non-target."""
+        mac = self.allowlist.match(device, adv)
+        if mac is None:
+            self.rejected += 1
+            return None
+        self.stats[mac].add(getattr(adv, "rssi", None), time.time() if now is None else now)
+        return mac
+
+    def reports(self, now: float) -> Dict[str, Dict[str, float]]:
+        """Fields per target seen so far, closing the current loss window."""
+        return {mac: stats.report(now) for mac, stats in self.stats.items() if stats.count}
+
+    def samples(self, now: float) -> List[Sample]:
+        return [
+            Sample(LINK_MEASUREMENT, {"mac": mac, "name": self.names.get(mac, "")}, fields, now)
+            for mac, fields in self.reports(now).items()
+        ]
+
+
+def link_targets(sensors: Dict[str, dict]) -> Dict[str, str]:
+    return {mac: cfg.get("name", "") for mac, cfg in sensors.items()}
+
+
+def link_intervals(sensors: Dict[str, dict]) -> Dict[str, float]:
+    """Per-sensor "adv_interval" overrides from the names file."""
+    return {mac: float(cfg["adv_interval"]) for mac, cfg in sensors.items() if cfg.get("adv_interval")}
+
+
+def _format(value: Optional[float], spec: str) -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def print_reports(monitor: LinkMonitor, now: float) -> None:
+    reports = monitor.reports(now)
+    print(f"{time.strftime('%H:%M:%S')} {len(reports)}/{len(monitor.stats)} device(s), {monitor.rejected} rejected")
+    for mac, f in sorted(reports.items()):
+        print(
+            f"  {mac} {monitor.names.get(mac, ''):<16.16} rx={f['received']:<4} "
+            f"ewma={_format(f.get('rssi_ewma'), '6.1f')} "
+            f"p10/50/90={_format(f.get('rssi_p10'), '.0f')}/{_format(f.get('rssi_p50'), '.0f')}/"
+            f"{_format(f.get('rssi_p90'), '.0f')} interval={_format(f.get('interval'), '.2f')}s "
+            f"jitter={f['jitter_ms']:.0f}ms loss={_format(f.get('loss'), '.0%')} age={_format(f.get('age'), '.0f')}s",
+            flush=True,
+        )
+
+
+async def monitor_links(
+    monitor: LinkMonitor, interval: float = 10.0, scanner_factory: Optional[Callable] = None
+) -> None:
+    """Print link statistics of every target each `interval` seconds."""
+    if scanner_factory is None:
+        from live_state import DaemonScanner  # the logger's scan if it serves one, else BleakScanner
+
+        scanner_factory = DaemonScanner
+    scanner = scanner_factory(monitor.observe)
+    await scanner.start()
     try:
-        return __import__("json").loads(decoded)
-    except Exception:
-        return None
+        while True:
+            await asyncio.sleep(interval)
+            print_reports(monitor, time.time())
+    finally:
+        await scanner.stop()
 
 
-async def main() -> None:
-    parser = argparse.ArgumentParser(description="Monitor RSSI for a SwitchBot device by MAC.")
-    parser.add_argument("mac", help="Target MAC (e.g., E8:77:0C:00:20:7B)")
-    parser.add_argument("--interval", type=float, default=0.0, help="Min seconds between prints")
-    args = parser.parse_args()
-
-    target = args.mac.lower()
+async def monitor(mac: str, interval: float = 0.0, scanner_factory: Optional[Callable] = None) -> None:
+    allowlist = Allowlist([mac])
     last_print = 0.0
 
     def cb(device, adv):
         nonlocal last_print
 
-        manufacturer_hex = _make_manufacturer_hex(adv.manufacturer_data)
-        service_hex, service_uuid = _make_service_data(adv)
-
-        payload = {
-            "name": device.name or "",
-            "id": device.address,
-        }
-        if adv.rssi is not None:
-            payload["rssi"] = adv.rssi
-        if manufacturer_hex:
-            payload["manufacturerdata"] = manufacturer_hex
-        if service_hex:
-            payload["servicedata"] = service_hex
-        if service_uuid:
-            payload["servicedatauuid"] = service_uuid
-
-        decoded = _decode_with_theengs(payload)
-        if not decoded:
+        # Match on the MAC first; only the target's advertisements are decoded.
+        if not allowlist.accepts(device, adv):
             return
-        if decoded.get("mac", "").lower() != target:
-            return
-
         now = time.time()
-        if args.interval and (now - last_print) < args.interval:
+        if interval and (now - last_print) < interval:
+            return
+        decoded = decode_advertisement(device, adv)
+        if not decoded:
             return
         last_print = now
         print(f"{time.strftime('%H:%M:%S')} RSSI={decoded.get('rssi')} dBm tempc={decoded.get('tempc')} hum={decoded.get('hum')}")
 
-    scanner = BleakScanner(cb)
+    if scanner_factory is None:
+        from live_state import DaemonScanner  # the logger's scan if it serves one, else BleakScanner
+
+        scanner_factory = DaemonScanner
+    scanner = scanner_factory(cb)
     await scanner.start()
     try:
         while True:
@@ -103,5 +130,40 @@ async def main() -> None:
         await scanner.stop()
 
 
+async def _main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Monitor RSSI of SwitchBot devices: one MAC per advertisement, or link statistics of several."
+    )
+    parser.add_argument(
+        "mac", nargs="*", help="Target MAC(s) (e.g., E8:77:0C:00:20:7B); none = every sensor in --names"
+    )
+    parser.add_argument("--interval", type=float, default=None, help="Min seconds between prints (stats: 10)")
+    parser.add_argument("--names", default="sensors.json", help="MAC->name JSON map file")
+    parser.add_argument("--stats", action="store_true", help="Link statistics even for a single MAC")
+    parser.add_argument("--ring", type=int, default=64, help="RSSI/gap values kept per device for percentiles")
+    parser.add_argument("--alpha", type=float, default=0.1, help="EWMA smoothing factor")
+    args = parser.parse_args()
+
+    if len(args.mac) == 1 and not args.stats:
+        await monitor(args.mac[0], args.interval or 0.0)
+        return
+
+    from sensors_config import load_sensors
+
+    sensors = load_sensors(args.names)
+    targets = {mac: sensors.get(mac.lower(), {}).get("name", "") for mac in args.mac} or link_targets(sensors)
+    if not targets:
+        parser.error("no MACs given and no sensors in --names")
+    link = LinkMonitor(targets, capacity=max(1, args.ring), alpha=args.alpha, intervals=link_intervals(sensors))
+    await monitor_links(link, args.interval or 10.0)
+
+
+def main() -> None:
+    try:
+        asyncio.run(_main())
+    except KeyboardInterrupt:
+        pass
+
+
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
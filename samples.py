@@ -0,0 +1,38 @@
+from typing import Dict, NamedTuple, Union
+
+FieldValue = Union[float, int, bool, str]
+
+
+class Sample(NamedTuple):
+    """One point: measurement, tags, fields and a Unix timestamp in seconds."""
+
+    measurement: str
+    tags: Dict[str, str]
+    fields: Dict[str, FieldValue]
+    ts: float
+
+
+_MEASUREMENT_ESCAPES = str.maketrans({",": r"\,", " ": r"\ "})
+_KEY_ESCAPES = str.maketrans({",": r"\,", "=": r"\=", " ": r"\ "})
+
+
+def _field_value(value: FieldValue) -> str:
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def to_line_protocol(sample: Sample) -> str:
+    """Encode a sample as InfluxDB line protocol with a nanosecond timestamp."""
+    parts = [sample.measurement.translate(_MEASUREMENT_ESCAPES)]
+    for key in sorted(sample.tags):
+        value = sample.tags[key]
+        if value == "":
+            continue
+        parts.append(f",{key.translate(_KEY_ESCAPES)}={value.translate(_KEY_ESCAPES)}")
+    fields = ",".join(f"{k.translate(_KEY_ESCAPES)}={_field_value(v)}" for k, v in sample.fields.items())
+    return f"{''.join(parts)} {fields} {int(sample.ts * 1_000_000) * 1000}"
@@ -1,74 +1,20 @@
 import argparse
 import asyncio
-import json
-from typing import Optional
-
-from bleak import BleakScanner
-
-try:
-    import TheengsDecoder  # type: ignore
-except Exception:  # pragma: no cover - optional dependency
-    TheengsDecoder = None
-
-
-def _uuid16_from_uuid(uuid: str) -> str:
-    u = uuid.lower()
-    if u.startswith("0000") and u.endswith("-0000-1000-8000-00805f9b34fb"):
-        return u[4:8]
-    return u.replace("-", "")
-
-
-def _hex(b: bytes) -> str:
-    return b.hex()
-
-
-def _make_manufacturer_hex(manufacturer_data: dict[int, bytes]) -> Optional[str]:
-    if not manufacturer_data:
-        return None
-    # Prefer SwitchBot company IDs; fall back to the first entry.
-    for company_id in (0x0969, 0x0059):
-        if company_id in manufacturer_data:
-            data = manufacturer_data[company_id]
-            return company_id.to_bytes(2, "little").hex() + _hex(data)
-    company_id, data = next(iter(manufacturer_data.items()))
-    return company_id.to_bytes(2, "little").hex() + _hex(data)
-
-
-def _make_service_data(adv) -> tuple[Optional[str], Optional[str]]:
-    if not adv.service_data:
-        return None, None
-    # Prefer SwitchBot fd3d service data if present.
-    for uuid, data in adv.service_data.items():
-        if _uuid16_from_uuid(uuid) == "fd3d":
-            return _hex(data), "fd3d"
-    uuid, data = next(iter(adv.service_data.items()))
-    return _hex(data), _uuid16_from_uuid(uuid)
-
-
-def _looks_like_switchbot(name: str, adv) -> bool:
-    if "switchbot" in name.lower():
-        return True
-    if adv.manufacturer_data:
-        if 0x0969 in adv.manufacturer_data or 0x0059 in adv.manufacturer_data:
-            return True
-    if adv.service_data:
-        return any(_uuid16_from_uuid(u) == "fd3d" for u in adv.service_data.keys())
-    return False
-
-
-def _decode_with_theengs(payload: dict) -> Optional[dict]:
-    if TheengsDecoder is None:
-        return None
-    decoded = TheengsDecoder.decodeBLE(json.dumps(payload))
-    if not decoded:
-        return None
-    try:
-        return json.loads(decoded)
-    except json.JSONDecodeError:
-        return None
+from typing import Callable, Dict, Iterable, Optional
+
+from adv_capture import CaptureWriter, to_callback_args
+from scanner_service import shared_service
+from switchbot_decoder import (
+    _looks_like_switchbot,
+    _make_manufacturer_hex,
+    _make_service_data,
+    decode_advertisement,
+)
 
 
-async def read_sensor_async(mac: str, timeout: int = 15) -> Optional[dict]:
+async def read_sensor_async(
+    mac: str, timeout: int = 15, scanner_factory: Optional[Callable] = None
+) -> Optional[dict]:
     """Scan until we see the target MAC in decoded payloads, or timeout."""
     found: Optional[dict] = None
     done = asyncio.Event()
@@ -82,28 +28,18 @@ async def read_sensor_async(mac: str, timeout: int = 15) -> Optional[dict]:
         if not _looks_like_switchbot(name, adv):
             return
 
-        manufacturer_hex = _make_manufacturer_hex(adv.manufacturer_data)
-        service_hex, service_uuid = _make_service_data(adv)
-
-        payload = {
-            "name": name,
-            "id": device.address,
-        }
-        if adv.rssi is not None:
-            payload["rssi"] = adv.rssi
-        if manufacturer_hex:
-            payload["manufacturerdata"] = manufacturer_hex
-        if service_hex:
-            payload["servicedata"] = service_hex
-        if service_uuid:
-            payload["servicedatauuid"] = service_uuid
-
-        decoded = _decode_with_theengs(payload) or payload
+        decoded = decode_advertisement(device, adv)
+        if decoded is None:
+            return
         if decoded.get("mac", "").lower() == mac.lower():
             found = decoded
             done.set()
 
-    scanner = BleakScanner(cb)
+    if scanner_factory is None:
+        from live_state import DaemonScanner  # the logger's scan if it serves one, else BleakScanner
+
+        scanner_factory = DaemonScanner
+    scanner = scanner_factory(cb)
     await scanner.start()
     try:
         await asyncio.wait_for(done.wait(), timeout=timeout)
@@ -113,62 +49,102 @@ async def read_sensor_async(mac: str, timeout: int = 15) -> Optional[dict]:
     return found
 
 
-def read_sensor(mac: str, timeout: int = 15) -> Optional[dict]:
-    """Blocking helper to read a single sensor packet by MAC."""
-    return asyncio.run(read_sensor_async(mac, timeout))
+def read_sensor(mac: str, timeout: int = 15, max_age: float = 60.0) -> Optional[dict]:
+    """Blocking helper to read a single sensor packet by MAC.
+
+    Uses the process-wide scanner service, so repeated calls reuse one running
+    scanner and return a cached packet up to `max_age` seconds old.
+    """
+    return read_sensors([mac], timeout, max_age).get(mac.upper())
+
+
+def read_sensors(macs: Iterable[str], timeout: int = 15, max_age: float = 60.0) -> Dict[str, dict]:
+    """Blocking helper to read several sensors at once; returns the MACs that answered.
+
+    Answered from the logger's live state when it runs with --live-socket and
+    has every MAC; otherwise from the scanner service.
+    """
+    from live_state import read_live
+
+    macs = list(macs)
+    found = read_live(macs, max_age)
+    if found is not None and len(found) == len(macs):
+        return found
+    return shared_service().read_sensors(macs, timeout, max_age)
+
 
+def _print_advertisement(device, adv, decoded: Optional[dict]) -> None:
+    manufacturer_hex = _make_manufacturer_hex(adv.manufacturer_data)
+    service_hex, service_uuid = _make_service_data(adv)
 
-async def main():
+    print("----")
+    print("Name:", device.name or "")
+    print("Address:", device.address)
+    print("RSSI:", getattr(adv, "rssi", None))
+    print("Manufacturer:", manufacturer_hex)
+    print("Service:", service_hex, service_uuid)
+    if decoded:
+        print("Decoded:", decoded)
+    else:
+        print("Decoded: (none) - unsupported device; install TheengsDecoder for more models")
+
+
+async def _main() -> None:
     parser = argparse.ArgumentParser(description="Scan and decode SwitchBot BLE advertisements.")
     parser.add_argument("--timeout", type=int, default=15, help="Scan duration in seconds.")
     parser.add_argument("--address", type=str, default="", help="Filter by BLE MAC address.")
     parser.add_argument("--name", type=str, default="", help="Filter by device name substring.")
+    parser.add_argument("--capture", type=str, default="", help="Record raw advertisements to this capture file.")
+    parser.add_argument(
+        "--decode-workers", type=int, default=0, help="Decode and print on this many threads (0 = in the callback)."
+    )
     args = parser.parse_args()
 
+    capture = CaptureWriter(args.capture) if args.capture else None
+    pool = None
+    if args.decode_workers > 0:
+        from decode_pool import DecodePool
+
+        pool = DecodePool(
+            lambda frame, decoded: _print_advertisement(*to_callback_args(frame), decoded),
+            workers=args.decode_workers,
+        )
+
     def cb(device, adv):
         name = device.name or ""
         if args.address and device.address.lower() != args.address.lower():
             return
         if args.name and args.name.lower() not in name.lower():
             return
+        if capture is not None:
+            capture.write(device, adv)
         if not _looks_like_switchbot(name, adv):
             return
+        if pool is not None:
+            pool.submit(device, adv)
+            return
+        _print_advertisement(device, adv, decode_advertisement(device, adv))
 
-        manufacturer_hex = _make_manufacturer_hex(adv.manufacturer_data)
-        service_hex, service_uuid = _make_service_data(adv)
-
-        rssi = getattr(adv, "rssi", None)
-        payload = {
-            "name": name,
-            "id": device.address,
-        }
-        if rssi is not None:
-            payload["rssi"] = rssi
-        if manufacturer_hex:
-            payload["manufacturerdata"] = manufacturer_hex
-        if service_hex:
-            payload["servicedata"] = service_hex
-        if service_uuid:
-            payload["servicedatauuid"] = service_uuid
-
-        decoded = _decode_with_theengs(payload)
-
-        print("----")
-        print("Name:", name)
-        print("Address:", device.address)
-        print("RSSI:", rssi)
-        print("Manufacturer:", manufacturer_hex)
-        print("Service:", service_hex, service_uuid)
-        if decoded:
-            print("Decoded:", decoded)
-        else:
-            print("Decoded: (none) - install TheengsDecoder to decode")
-
-    scanner = BleakScanner(cb)
+    from live_state import DaemonScanner
+
+    scanner = DaemonScanner(cb)
+    if pool is not None:
+        await pool.start()
     await scanner.start()
-    await asyncio.sleep(args.timeout)
-    await scanner.stop()
+    try:
+        await asyncio.sleep(args.timeout)
+    finally:
+        await scanner.stop()
+        if pool is not None:
+            await pool.close()
+        if capture is not None:
+            capture.close()
+            print(f"Captured {capture.count} advertisement(s) to {args.capture}")
+
+
+def main() -> None:
+    asyncio.run(_main())
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
@@ -0,0 +1,130 @@
+import asyncio
+import atexit
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from switchbot_decoder import _looks_like_switchbot, decode_advertisement
+
+
+class ScannerService:
+    """One long-lived scanner that caches the latest decoded packet per MAC.
+
+    Start it once, then call `read_sensors` as often as needed: it returns as
+    soon as every requested MAC has a packet younger than `max_age`, without
+    restarting the scanner.
+    """
+
+    def __init__(self, scanner_factory: Optional[Callable] = None) -> None:
+        self._scanner_factory = scanner_factory
+        self._scanner = None
+        self._latest: Dict[str, Tuple[dict, float]] = {}
+        # (MACs still missing a fresh packet, future resolved once that set is empty)
+        self._waiters: List[Tuple[Set[str], asyncio.Future]] = []
+
+    @property
+    def running(self) -> bool:
+        return self._scanner is not None
+
+    def _on_advertisement(self, device, adv) -> None:
+        if not _looks_like_switchbot(device.name or "", adv):
+            return
+        decoded = decode_advertisement(device, adv)
+        if not decoded or "mac" not in decoded:
+            return
+        mac = decoded["mac"].upper()
+        self._latest[mac] = (decoded, time.time())
+        for missing, fut in self._waiters:
+            if mac in missing:
+                missing.discard(mac)
+                if not missing and not fut.done():
+                    fut.set_result(None)
+
+    async def start(self) -> None:
+        if self._scanner is not None:
+            return
+        if self._scanner_factory is None:
+            from live_state import DaemonScanner  # the logger's scan if it serves one, else BleakScanner
+
+            self._scanner_factory = DaemonScanner
+        self._scanner = self._scanner_factory(self._on_advertisement)
+        await self._scanner.start()
+
+    async def stop(self) -> None:
+        scanner, self._scanner = self._scanner, None
+        if scanner is not None:
+            await scanner.stop()
+
+    def latest(self, mac: str) -> Optional[Tuple[dict, float]]:
+        return self._latest.get(mac.upper())
+
+    def _fresh(self, macs: Iterable[str], max_age: float) -> Dict[str, dict]:
+        now = time.time()
+        out = {}
+        for mac in macs:
+            entry = self._latest.get(mac)
+            if entry is not None and now - entry[1] <= max_age:
+                out[mac] = entry[0]
+        return out
+
+    async def read_sensors(self, macs: Iterable[str], timeout: float = 15.0, max_age: float = 60.0) -> Dict[str, dict]:
+        """Wait until every MAC has a packet no older than `max_age`, or `timeout`; return what is fresh."""
+        await self.start()
+        wanted = [m.upper() for m in macs]
+        found = self._fresh(wanted, max_age)
+        if len(found) == len(wanted):
+            return found
+
+        waiter = (set(wanted) - set(found), asyncio.get_running_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters.remove(waiter)
+        return self._fresh(wanted, max_age)
+
+
+class SyncScannerService:
+    """Blocking facade: runs a ScannerService on a background event-loop thread."""
+
+    def __init__(self, scanner_factory: Optional[Callable] = None) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="switchbot-scanner", daemon=True)
+        self._thread.start()
+        self.service = ScannerService(scanner_factory)
+
+    def _call(self, coro, timeout: Optional[float] = None):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    def start(self) -> None:
+        self._call(self.service.start())
+
+    def read_sensors(self, macs: Iterable[str], timeout: float = 15.0, max_age: float = 60.0) -> Dict[str, dict]:
+        return self._call(self.service.read_sensors(macs, timeout, max_age))
+
+    def read_sensor(self, mac: str, timeout: float = 15.0, max_age: float = 60.0) -> Optional[dict]:
+        return self.read_sensors([mac], timeout, max_age).get(mac.upper())
+
+    def close(self) -> None:
+        if not self._loop.is_running():
+            return
+        self._call(self.service.stop())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+_shared: Optional[SyncScannerService] = None
+_shared_lock = threading.Lock()
+
+
+def shared_service() -> SyncScannerService:
+    """Process-wide scanner, started on first use and reused by every blocking read."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = SyncScannerService()
+            atexit.register(_shared.close)
+        return _shared
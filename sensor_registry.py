@@ -0,0 +1,118 @@
+import heapq
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+def mac_to_int(mac: str) -> int:
+    """'AA:BB:CC:DD:EE:FF' -> 0xAABBCCDDEEFF (raises ValueError for non-MAC addresses)."""
+    if len(mac) != 17:
+        raise ValueError(f"not a MAC address: {mac!r}")
+    return int(mac.replace(":", ""), 16)
+
+
+def int_to_mac(value: int) -> str:
+    return value.to_bytes(6, "big").hex(":").upper()
+
+
+class SensorRecord:
+    __slots__ = ("mac", "address", "decoded", "seen", "window")
+
+    def __init__(self, mac: int, decoded: dict, seen: float) -> None:
+        self.mac = mac
+        self.address = int_to_mac(mac)
+        self.decoded = decoded
+        self.seen = seen
+        self.window = None
+
+
+class SensorRegistry:
+    """Latest reading per sensor, keyed by integer MAC, with heap-driven expiry.
+
+    The heap holds at most one (expiry, mac) entry per record. Refreshing a
+    record only updates `seen`; when its heap entry comes due, the record is
+    either dropped (really stale) or pushed back with its new expiry, so a
+    tick costs O(k log n) for the k entries that came due instead of a scan
+    of every sensor. Beyond `max_sensors`, the least recently seen record is
+    evicted.
+    """
+
+    def __init__(self, stale_after: float, max_sensors: int = 256) -> None:
+        self.stale_after = stale_after
+        self.max_sensors = max_sensors
+        self._records: Dict[int, SensorRecord] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def get(self, mac: int) -> Optional[SensorRecord]:
+        return self._records.get(mac)
+
+    def update(self, mac: int, decoded: dict, now: float) -> SensorRecord:
+        record = self._records.get(mac)
+        if record is not None:
+            record.decoded = decoded
+            record.seen = now
+            return record
+        if len(self._records) >= self.max_sensors:
+            self._evict_oldest()
+        record = self._records[mac] = SensorRecord(mac, decoded, now)
+        heapq.heappush(self._heap, (now + self.stale_after, mac))
+        return record
+
+    def _pop_due(self, now: Optional[float]) -> Optional[SensorRecord]:
+        """Pop heap entries until one whose record is really expired (or, with now=None, the oldest)."""
+        heap = self._heap
+        while heap and (now is None or heap[0][0] <= now):
+            _, mac = heapq.heappop(heap)
+            record = self._records.get(mac)
+            if record is None:
+                continue
+            expiry = record.seen + self.stale_after
+            if now is not None and expiry > now:
+                heapq.heappush(heap, (expiry, mac))
+                continue
+            if now is None and heap and expiry > heap[0][0]:
+                heapq.heappush(heap, (expiry, mac))
+                continue
+            del self._records[mac]
+            return record
+        return None
+
+    def _evict_oldest(self) -> None:
+        if self._pop_due(None) is not None:
+            self.evicted += 1
+
+    def expire(self, now: float) -> None:
+        while self._pop_due(now) is not None:
+            pass
+
+    def active(self, now: float) -> List[SensorRecord]:
+        self.expire(now)
+        return list(self._records.values())
+
+
+class Allowlist:
+    """Cheap pre-decode filter: accept only advertisements from known MACs."""
+
+    def __init__(self, macs: Iterable[str]) -> None:
+        macs = [m.upper() for m in macs]
+        self._addresses = {m: m for m in macs}
+        self._raw = {bytes.fromhex(m.replace(":", "")): m for m in macs if len(m) == 17}
+
+    def __len__(self) -> int:
+        return len(self._addresses)
+
+    def match(self, device, adv) -> Optional[str]:
+        """The listed MAC (upper case) an advertisement comes from, or None."""
+        manufacturer_data = adv.manufacturer_data
+        if manufacturer_data:
+            data = manufacturer_data.get(0x0969)
+            if data is not None:
+                mac = self._raw.get(data[:6])
+                if mac is not None:
+                    return mac
+        return self._addresses.get(device.address.upper())
+
+    def accepts(self, device, adv) -> bool:
+        return self.match(device, adv) is not None
@@ -0,0 +1,17 @@
+import json
+from pathlib import Path
+from typing import Dict
+
+
+def load_sensors(path: str) -> Dict[str, dict]:
+    """Load the names file: values are a name, or an object with "name" and per-sensor settings."""
+    p = Path(path)
+    if not p.exists():
+        return {}
+    data = json.loads(p.read_text())
+    return {k.lower(): (v if isinstance(v, dict) else {"name": v}) for k, v in data.items()}
+
+
+def load_name_map(path: str) -> Dict[str, str]:
+    """MAC -> name from the names file."""
+    return {mac: cfg.get("name", "") for mac, cfg in load_sensors(path).items()}
@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import List, Optional, Sequence, Tuple
+
+from influx_writer import OverflowQueue
+from metrics import LATENCY_BUCKETS, REGISTRY
+from mqtt_client import MqttClient
+from samples import Sample
+
+SINK_KINDS = ("influx", "local", "ndjson", "csv", "mqtt")
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).isoformat()
+
+
+class Sink(ABC):
+    """A destination for samples. `write` gets batches from the sink's own task, never from the scan loop."""
+
+    name = "sink"
+
+    @abstractmethod
+    async def write(self, batch: List[Sample]) -> None:
+        """Deliver one batch; raising counts the whole batch as dropped."""
+
+    async def close(self) -> None:
+        pass
+
+
+class FileSink(Sink):
+    """Append samples to a newline-delimited JSON or CSV file.
+
+    CSV columns are fixed by the first sample written (or the existing
+    header); fields that appear later are left out.
+    """
+
+    def __init__(self, path: str, fmt: str = "ndjson") -> None:
+        self.name = f"{fmt}:{path}"
+        self.path = path
+        self.fmt = fmt
+        self._columns: Optional[List[str]] = None
+        if fmt == "csv" and os.path.exists(path) and os.path.getsize(path):
+            with open(path, newline="") as f:
+                self._columns = next(csv.reader(f), None)
+
+    def _rows(self, batch: List[Sample]) -> List[dict]:
+        return [{"time": _iso(s.ts), "measurement": s.measurement, **s.tags, **s.fields} for s in batch]
+
+    def _append(self, batch: List[Sample]) -> None:
+        rows = self._rows(batch)
+        with open(self.path, "a", newline="") as f:
+            if self.fmt == "ndjson":
+                f.write("".join(json.dumps(row, separators=(",", ":")) + "\n" for row in rows))
+                return
+            header = self._columns is None
+            if header:
+                self._columns = list(rows[0])
+            out = csv.DictWriter(f, fieldnames=self._columns, extrasaction="ignore")
+            if header:
+                out.writeheader()
+            out.writerows(rows)
+
+    async def write(self, batch: List[Sample]) -> None:
+        await asyncio.to_thread(self._append, batch)
+
+
+class MqttSink(Sink):
+    """Publish each sample as JSON to `<topic>/<mac>` (QoS 0), reconnecting on the next batch after a failure.
+
+    Readings go to `<topic>/<mac>`; other measurements (link statistics) to
+    `<topic>/<mac>/<measurement>`.
+    """
+
+    def __init__(self, host: str, port: int = 1883, topic: str = "switchbot", **client_opts) -> None:
+        self.name = f"mqtt:{host}:{port}"
+        self.topic = topic.rstrip("/")
+        self._client = MqttClient(host, port, **client_opts)
+
+    async def write(self, batch: List[Sample]) -> None:
+        if not self._client.connected:
+            await self._client.close()
+            await self._client.connect()
+        for s in batch:
+            key = s.tags.get("mac") or s.tags.get("address") or s.measurement
+            topic = f"{self.topic}/{key}"
+            if s.measurement != "switchbot_meter":
+                topic += f"/{s.measurement}"
+            payload = {"time": _iso(s.ts), **s.tags, **s.fields}
+            await self._client.publish(topic, json.dumps(payload, separators=(",", ":")).encode())
+
+    async def close(self) -> None:
+        await self._client.close()
+
+
+def _series(sample: Sample) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return sample.measurement, tuple(sorted(sample.tags.items()))
+
+
+class SinkRunner:
+    """Give one sink its own task and bounded queue.
+
+    `add` never waits: when the queue is full it sheds points by the same
+    coalesce/drop policies as `BatchWriter` (an `OverflowQueue`), so a stalled sink only loses
+    its own points. A failed batch is dropped and the sink backs off before
+    trying again.
+    """
+
+    def __init__(
+        self,
+        sink: Sink,
+        *,
+        batch_size: int = 500,
+        flush_interval: float = 10.0,
+        max_queue: int = 10_000,
+        overflow: str = "coalesce",
+        backoff_max: float = 60.0,
+    ) -> None:
+        self.sink = sink
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_queue = max(self.batch_size, max_queue)
+        self.overflow = overflow
+        self.backoff_max = backoff_max
+        self._queue = OverflowQueue(self.max_queue, overflow, key=_series)
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        self._failures = 0
+        self.written = 0
+        self.dropped = 0
+        self._latency = REGISTRY.histogram(
+            "switchbot_write_latency_seconds", "Duration of one write", LATENCY_BUCKETS, sink=sink.name
+        )
+        self._errors = REGISTRY.counter("switchbot_write_errors_total", "Failed writes", sink=sink.name)
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def add(self, sample: Sample) -> None:
+        self.dropped += self._queue.append(sample)
+        # While backing off after a failure, wait out the delay instead of retrying on every full batch.
+        if len(self._queue) >= self.batch_size and not self._failures:
+            self._wake.set()
+
+    async def flush(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self._queue:
+            count = min(self.batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            started = loop.time()
+            try:
+                await self.sink.write(batch)
+            except Exception as exc:
+                self._errors.inc()
+                self.dropped += len(batch)
+                self._failures += 1
+                print(f"[{_now().isoformat()}] sink {self.sink.name}: write of {len(batch)} failed: {exc}", flush=True)
+                return
+            finally:
+                self._latency.observe(loop.time() - started)
+            self._failures = 0
+            self.written += len(batch)
+
+    async def run(self) -> None:
+        while not self._closed:
+            delay = self.flush_interval
+            if self._failures:
+                delay = min(self.backoff_max, self.flush_interval * 2 ** min(self._failures, 6))
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+        if self._queue:
+            await self.flush()
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def close(self, timeout: float = 10.0) -> None:
+        self._closed = True
+        self._wake.set()
+        try:
+            await asyncio.wait_for(self._task if self._task is not None else self.flush(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        if self._queue:
+            self.dropped += len(self._queue)
+            print(
+                f"[{_now().isoformat()}] sink {self.sink.name}: gave up on {len(self._queue)} point(s) at close",
+                flush=True,
+            )
+            self._queue.clear()
+        await self.sink.close()
+
+
+class FanOut:
+    """Hand every sample to several writers (SinkRunner, BatchWriter, LocalStore), each isolated from the others."""
+
+    def __init__(self, writers: Sequence) -> None:
+        self.writers = list(writers)
+
+    def __len__(self) -> int:
+        return sum(len(w) for w in self.writers)
+
+    @property
+    def dropped(self) -> int:
+        return sum(w.dropped for w in self.writers)
+
+    @property
+    def written(self) -> int:
+        return sum(w.written for w in self.writers)
+
+    def add(self, sample: Sample) -> None:
+        for writer in self.writers:
+            try:
+                writer.add(sample)
+            except Exception as exc:
+                print(f"[{_now().isoformat()}] sink add failed: {exc}", flush=True)
+
+    def start(self) -> None:
+        for writer in self.writers:
+            writer.start()
+
+    async def close(self) -> None:
+        results = await asyncio.gather(*(w.close() for w in self.writers), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"[{_now().isoformat()}] sink close failed: {result}", flush=True)
+
+
+def parse_sink(spec: str) -> Tuple[str, str]:
+    """'influx', 'local[:PATH]', 'ndjson:PATH', 'csv:PATH' or 'mqtt:HOST[:PORT]' -> (kind, target)."""
+    kind, _, target = spec.partition(":")
+    if kind not in SINK_KINDS:
+        raise argparse.ArgumentTypeError(f"unknown sink {kind!r} (expected one of {', '.join(SINK_KINDS)})")
+    if kind in ("ndjson", "csv", "mqtt") and not target:
+        raise argparse.ArgumentTypeError(f"sink {kind} needs a target (PATH, or HOST[:PORT] for mqtt)")
+    return kind, target
+
+
+def make_sink(kind: str, target: str, mqtt_topic: str = "switchbot") -> Sink:
+    if kind in ("ndjson", "csv"):
+        return FileSink(target, kind)
+    if kind == "mqtt":
+        host, _, port = target.partition(":")
+        return MqttSink(host, int(port or 1883), topic=mqtt_topic)
+    raise ValueError(f"{kind} is not a queued sink")
+
+
+def add_sink_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--sink",
+        action="append",
+        type=parse_sink,
+        metavar="KIND[:TARGET]",
+        help="Where to write; repeat for several: influx, local[:PATH], ndjson:PATH, csv:PATH, mqtt:HOST[:PORT] "
+        "(default: influx)",
+    )
+    parser.add_argument("--mqtt-topic", default="switchbot", help="Topic prefix for the mqtt sink")
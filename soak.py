@@ -0,0 +1,512 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from adv_capture import CapturedAdvertisement, CapturedDevice
+from switchbot_decoder import FD3D_UUID
+
+# Readings carry a per-sensor sequence number (tempc.d and hum cover 100000 values), so the
+# stand-in's copy of a written point tells which advertisement it came from.
+_SEQ_SPAN = 100_000
+_HISTORY = 20  # emission times kept per sensor; must divide _SEQ_SPAN
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # peak only; KiB on Linux, bytes on macOS
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _reading(seq: int) -> Tuple[int, int, int]:
+    """(fraction byte, integer byte, humidity byte) of a WoSensorTH advertisement encoding `seq`."""
+    value = seq % _SEQ_SPAN
+    return (value // 100) % 10, 0x80 | (value // 1000), value % 100
+
+
+def _seq_of(tempc: float, hum: int) -> int:
+    return round(tempc * 10) * 100 + hum
+
+
+class VirtualFleet:
+    """BleakScanner stand-in emulating `sensors` WoSensorTH meters, each advertising every `period` seconds.
+
+    Advertisements are emitted round-robin at `sensors / period` per second
+    from a task on the event loop, the way bleak delivers them. When the loop
+    falls more than `buffer` advertisements behind, the excess is lost, like
+    a full BlueZ receive buffer. `churn` is the fraction of the fleet
+    replaced by new MACs per minute. Use the instance as a `scanner_factory`.
+    """
+
+    def __init__(self, sensors: int, period: float = 2.0, churn: float = 0.0, buffer: int = 4096, seed: int = 1):
+        self.period = period
+        self.churn = churn
+        self.buffer = buffer
+        self._random = random.Random(seed)
+        self._ids: List[int] = []
+        self._seq = array("l")
+        self._born = array("d")
+        self._times: List[array] = []
+        self._slot: Dict[str, int] = {}
+        self._next_id = 0
+        self.emitted = 0
+        self.lost = 0
+        self.churned = 0
+        self._callback: Optional[Callable] = None
+        self._task: Optional[asyncio.Task] = None
+        self.resize(sensors)
+
+    def __call__(self, callback: Callable) -> "VirtualFleet":
+        self._callback = callback
+        return self
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @staticmethod
+    def _mac(sensor_id: int) -> str:
+        return (b"\xea\x06" + sensor_id.to_bytes(4, "big")).hex(":").upper()
+
+    def _replace(self, slot: int) -> None:
+        if slot < len(self._ids):
+            self._slot.pop(self._mac(self._ids[slot]), None)
+            self._ids[slot] = self._next_id
+            self._seq[slot] = 0
+            self._born[slot] = 0.0
+            self._times[slot] = array("d", bytes(8 * _HISTORY))
+        else:
+            self._ids.append(self._next_id)
+            self._seq.append(0)
+            self._born.append(0.0)
+            self._times.append(array("d", bytes(8 * _HISTORY)))
+        self._slot[self._mac(self._next_id)] = slot
+        self._next_id += 1
+
+    def resize(self, sensors: int) -> None:
+        """Grow or shrink the fleet; sensors that stay keep their MACs."""
+        while len(self._ids) < sensors:
+            self._replace(len(self._ids))
+        for sensor_id in self._ids[sensors:]:
+            self._slot.pop(self._mac(sensor_id), None)
+        del self._ids[sensors:], self._seq[sensors:], self._born[sensors:], self._times[sensors:]
+
+    def emitted_at(self, mac: str, tempc: float, hum: int) -> Optional[float]:
+        """When the advertisement carrying this reading was emitted, or None if it is no longer known."""
+        slot = self._slot.get(mac)
+        if slot is None:
+            return None
+        value = _seq_of(tempc, hum)
+        seq = self._seq[slot] - 1
+        back = (seq - value) % _SEQ_SPAN
+        if back >= _HISTORY or seq - back < 0:
+            return None
+        return self._times[slot][(seq - back) % _HISTORY]
+
+    def macs_since(self, age: float, now: float) -> List[str]:
+        """MACs of sensors that have been advertising for at least `age` seconds."""
+        born = self._born
+        return [mac for mac, slot in self._slot.items() if born[slot] and now - born[slot] >= age]
+
+    def _emit(self, slot: int, now: float) -> None:
+        sensor_id, seq = self._ids[slot], self._seq[slot]
+        self._seq[slot] = seq + 1
+        if not seq:
+            self._born[slot] = now
+        self._times[slot][seq % _HISTORY] = now
+        mac = b"\xea\x06" + sensor_id.to_bytes(4, "big")
+        frac, integer, hum = _reading(seq)
+        adv = CapturedAdvertisement(
+            -60 - slot % 30, {0x0969: mac}, {FD3D_UUID: bytes((0x54, 0x00, 90, frac, integer, hum))}
+        )
+        self._callback(CapturedDevice(mac.hex(":").upper(), None), adv)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        cursor = 0
+        due = 0.0
+        churn_due = 0.0
+        last = loop.time()
+        while True:
+            await asyncio.sleep(0.005)
+            now = loop.time()
+            elapsed, last = now - last, now
+            sensors = len(self._ids)
+            if not sensors:
+                continue
+            churn_due += sensors * self.churn / 60.0 * elapsed
+            while churn_due >= 1.0:
+                churn_due -= 1.0
+                self._replace(self._random.randrange(sensors))
+                self.churned += 1
+            due += sensors / self.period * elapsed
+            if due > self.buffer:
+                self.lost += int(due) - self.buffer
+                cursor += int(due) - self.buffer
+                due -= int(due) - self.buffer
+            wall = time.time()
+            for _ in range(int(due)):
+                self._emit(cursor % sensors, wall)
+                cursor += 1
+            self.emitted += int(due)
+            due -= int(due)
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+def _standin_process(conn, write_delay: float) -> None:
+    from influx_standin import StandIn, serve
+
+    server = serve(StandIn(sensors=0, write_delay=write_delay, record=True), port=0)
+    conn.send(server.server_address[1])
+    conn.recv()  # until the harness is done
+
+
+def _fetch_writes(url: str) -> List[list]:
+    from urllib.request import urlopen
+
+    with urlopen(f"{url}/debug/writes", timeout=30) as response:
+        return json.loads(response.read())
+
+
+class _LagProbe:
+    """How late a 50 ms sleep wakes up: the event-loop lag the scanner callbacks would see."""
+
+    def __init__(self) -> None:
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + 0.05
+            await asyncio.sleep(0.05)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def take(self) -> List[float]:
+        samples, self.samples = self.samples, []
+        return samples
+
+
+async def soak(
+    steps: List[int],
+    step_seconds: float,
+    url: str,
+    *,
+    period: float = 2.0,
+    churn: float = 0.0,
+    interval: float = 5.0,
+    stale: float = 30.0,
+    max_sensors: int = 0,
+    writer_opts: Optional[dict] = None,
+    decode_opts: Optional[dict] = None,
+    rss_every: float = 10.0,
+    log: Callable[[str], None] = print,
+) -> dict:
+    """Run the logger against a growing `VirtualFleet`, one step per fleet size, and measure each step.
+
+    Writes go through the real BatchWriter and influxdb_client to the
+    stand-in at `url`, which records what arrives.
+    """
+    from influxdb_client import InfluxDBClient
+    from influxdb_client.client.write_api import SYNCHRONOUS
+
+    from decode_pool import _DROPPED as decode_dropped
+    from influx_writer import BatchWriter
+    from logger_influx_scan import _ADS as ads, scan_and_log
+
+    fleet = VirtualFleet(steps[0], period, churn)
+    lag = _LagProbe()
+    rss: List[List[float]] = []
+    results = []
+    started = time.time()
+    max_sensors = max_sensors or int(max(steps) * (1.0 + churn * stale / 60.0) * 1.5) + 16
+    with InfluxDBClient(url=url, token="soak", org="soak") as client:
+        writer = BatchWriter(client.write_api(write_options=SYNCHRONOUS), "soak", "soak", **(writer_opts or {}))
+        writer.start()
+        task = asyncio.create_task(
+            scan_and_log(
+                writer, interval, stale, {}, scanner_factory=fleet, max_sensors=max_sensors, decode_opts=decode_opts
+            )
+        )
+        lag.start()
+
+        def drain(latencies: List[float], seen: Dict[str, float]) -> int:
+            count = 0
+            for arrival, mac, tempc, hum in _fetch_writes(url):
+                count += 1
+                seen[mac] = arrival
+                emitted = fleet.emitted_at(mac, tempc, hum)
+                if emitted is not None:
+                    latencies.append(arrival - emitted)
+            return count
+
+        try:
+            for sensors in steps:
+                fleet.resize(sensors)
+                before = {
+                    "ads": ads.value,
+                    "decode_dropped": decode_dropped.value,
+                    "emitted": fleet.emitted,
+                    "lost": fleet.lost,
+                    "written": writer.written,
+                    "writer_dropped": writer.dropped,
+                }
+                latencies: List[float] = []
+                seen: Dict[str, float] = {}
+                received = 0
+                lag.take()
+                step_start = time.time()
+                end = step_start + step_seconds
+                next_rss = step_start
+                while time.time() < end:
+                    if time.time() >= next_rss:
+                        rss.append([round(time.time() - started, 1), round(_rss_mb(), 2)])
+                        next_rss += rss_every
+                    await asyncio.sleep(min(1.0, max(0.0, end - time.time())))
+                    received += await asyncio.to_thread(drain, latencies, seen)
+                    if task.done():
+                        task.result()
+                now = time.time()
+                elapsed = now - step_start
+                received += await asyncio.to_thread(drain, latencies, seen)
+                # Sensors advertising long enough to have been written must have arrived in the last cycles.
+                window = interval + writer.flush_interval + 2.0
+                expected = fleet.macs_since(window + interval, now)
+                missing = sum(1 for mac in expected if now - seen.get(mac, 0.0) > window + 1.0)
+                loop_lag = lag.take()
+                result = {
+                    "sensors": sensors,
+                    "started_s": round(step_start - started, 1),
+                    "seconds": round(elapsed, 1),
+                    "offered_ads_per_s": round(sensors / period, 1),
+                    "emitted_ads_per_s": round((fleet.emitted - before["emitted"]) / elapsed, 1),
+                    "sustained_ads_per_s": round((ads.value - before["ads"]) / elapsed, 1),
+                    "points_written": writer.written - before["written"],
+                    "points_received": received,
+                    "queue_depth": len(writer),
+                    "latency_ms": {
+                        "p50": None if not latencies else round(_percentile(latencies, 0.5) * 1e3, 1),
+                        "p95": None if not latencies else round(_percentile(latencies, 0.95) * 1e3, 1),
+                        "p99": None if not latencies else round(_percentile(latencies, 0.99) * 1e3, 1),
+                        "max": None if not latencies else round(max(latencies) * 1e3, 1),
+                    },
+                    "loop_lag_ms": {
+                        "p99": None if not loop_lag else round(_percentile(loop_lag, 0.99) * 1e3, 1),
+                        "max": None if not loop_lag else round(max(loop_lag) * 1e3, 1),
+                    },
+                    "dropped": {
+                        "radio": fleet.lost - before["lost"],
+                        "decode": decode_dropped.value - before["decode_dropped"],
+                        "writer": writer.dropped - before["writer_dropped"],
+                        "missing_sensors": missing,
+                    },
+                    "rss_mb": round(_rss_mb(), 2),
+                }
+                results.append(result)
+                log(
+                    f"[{_now().isoformat()}] {sensors} sensor(s): {result['sustained_ads_per_s']:.0f} ads/s, "
+                    f"latency p99 {result['latency_ms']['p99']} ms, dropped {result['dropped']}"
+                )
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await writer.close()
+    rss.append([round(time.time() - started, 1), round(_rss_mb(), 2)])
+    return {"steps": results, "rss": rss, "churned": fleet.churned}
+
+
+def rss_growth(samples: List[List[float]], skip: float = 0.0) -> Optional[float]:
+    """Least-squares slope of RSS in MB per hour, ignoring the first `skip` seconds (warm-up)."""
+    points = [(t, mb) for t, mb in samples if t >= skip]
+    if len(points) < 2:
+        return None
+    n = len(points)
+    mean_t = sum(t for t, _ in points) / n
+    mean_mb = sum(mb for _, mb in points) / n
+    var = sum((t - mean_t) ** 2 for t, _ in points)
+    if not var:
+        return None
+    slope = sum((t - mean_t) * (mb - mean_mb) for t, mb in points) / var
+    return round(slope * 3600, 2)
+
+
+def first_drop(steps: List[dict]) -> Optional[dict]:
+    for step in steps:
+        reasons = {k: v for k, v in step["dropped"].items() if v}
+        if reasons:
+            return {"sensors": step["sensors"], "offered_ads_per_s": step["offered_ads_per_s"], "dropped": reasons}
+    return None
+
+
+def _release() -> dict:
+    here = os.path.dirname(os.path.abspath(__file__))
+    out = {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()}
+    try:
+        from importlib.metadata import version
+
+        out["version"] = version("switchbot-temperature")
+    except Exception:
+        pass
+    try:
+        commit = subprocess.run(
+            ["git", "-C", here, "describe", "--always", "--dirty"], capture_output=True, text=True, timeout=5
+        )
+        if commit.returncode == 0:
+            out["commit"] = commit.stdout.strip()
+    except OSError:
+        pass
+    return out
+
+
+def compare(baseline: dict, report: dict) -> List[str]:
+    """One line per fleet size present in both reports."""
+    before = {step["sensors"]: step for step in baseline["steps"]}
+    lines = []
+    for step in report["steps"]:
+        old = before.get(step["sensors"])
+        if old is None:
+            continue
+        lines.append(
+            f"{step['sensors']:>6} sensor(s): "
+            f"{old['sustained_ads_per_s']:.0f} -> {step['sustained_ads_per_s']:.0f} ads/s, "
+            f"latency p99 {old['latency_ms']['p99']} -> {step['latency_ms']['p99']} ms, "
+            f"dropped {sum(old['dropped'].values())} -> {sum(step['dropped'].values())}"
+        )
+    old_growth, new_growth = baseline.get("rss_growth_mb_per_hour"), report.get("rss_growth_mb_per_hour")
+    lines.append(f"RSS growth: {old_growth} -> {new_growth} MB/h")
+    return lines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Load the logger with thousands of virtual meters and a stand-in InfluxDB; report as JSON."
+    )
+    parser.add_argument(
+        "--sensors", default="100,500,1000,2000,5000", help="Comma-separated fleet sizes, one step each"
+    )
+    parser.add_argument("--step-seconds", type=float, default=60.0, help="Duration of each step")
+    parser.add_argument("--hours", type=float, default=0.0, help="Soak: run one fleet size (the last) this long")
+    parser.add_argument("--period", type=float, default=2.0, help="Seconds between advertisements of one meter")
+    parser.add_argument("--churn", type=float, default=0.0, help="Fleet fraction replaced by new MACs per minute")
+    parser.add_argument("--interval", type=float, default=5.0, help="Logger write interval")
+    parser.add_argument("--stale", type=float, default=30.0, help="Logger stale threshold")
+    parser.add_argument("--max-sensors", type=int, default=0, help="Logger sensor limit (0 = enough for the fleet)")
+    parser.add_argument("--write-delay", type=float, default=0.0, help="Seconds the stand-in takes per write")
+    parser.add_argument("--rss-every", type=float, default=10.0, help="Seconds between RSS samples")
+    parser.add_argument("--log", default=os.devnull, help="File for the logger's own output")
+    parser.add_argument("--baseline", default="", help="Earlier report to compare against")
+    parser.add_argument("-o", "--output", default="soak.json", help="JSON report")
+    from decode_pool import add_decode_arguments, decode_options
+    from influx_writer import add_writer_arguments, writer_options
+
+    add_writer_arguments(parser)
+    add_decode_arguments(parser)
+    args = parser.parse_args()
+
+    steps = [int(n) for n in args.sensors.split(",") if n.strip()]
+    if not steps:
+        parser.error("--sensors needs at least one fleet size")
+    step_seconds = args.step_seconds
+    if step_seconds <= 2 * args.interval + args.flush_interval + 3:
+        parser.error("--step-seconds must cover a few write cycles: more than 2 * --interval + --flush-interval + 3")
+    if args.hours > 0:
+        steps, step_seconds = steps[-1:], args.hours * 3600
+    opts = writer_options(args)
+    if opts.get("spool") is not None:
+        parser.error("--spool is not supported by the harness")
+    opts.pop("spool", None)
+    opts.pop("spool_batch", None)
+
+    import multiprocessing
+
+    # The stand-in runs in its own process so parsing the writes does not load the logger under test.
+    ours, theirs = multiprocessing.Pipe()
+    standin = multiprocessing.Process(target=_standin_process, args=(theirs, args.write_delay), daemon=True)
+    standin.start()
+    url = f"http://127.0.0.1:{ours.recv()}"
+
+    out = sys.stdout
+
+    def log(line: str) -> None:
+        print(line, file=out, flush=True)
+
+    params = {k: v for k, v in vars(args).items() if k not in ("log", "baseline", "output")}
+    log(f"[{_now().isoformat()}] {len(steps)} step(s) of {step_seconds:.0f}s against the stand-in on {url}")
+    try:
+        with open(args.log, "w") as logger_output, contextlib.redirect_stdout(logger_output):
+            measured = asyncio.run(
+                soak(
+                    steps,
+                    step_seconds,
+                    url,
+                    period=args.period,
+                    churn=args.churn,
+                    interval=args.interval,
+                    stale=args.stale,
+                    max_sensors=args.max_sensors,
+                    writer_opts=opts,
+                    decode_opts=decode_options(args),
+                    rss_every=args.rss_every,
+                    log=log,
+                )
+            )
+    finally:
+        ours.send("stop")
+        standin.join(5)
+    clean = [step for step in measured["steps"] if not any(step["dropped"].values())]
+    last = measured["steps"][-1]
+    report = {
+        "generated": _now().isoformat(),
+        "release": _release(),
+        "params": params,
+        "max_sustained_ads_per_s": max((step["sustained_ads_per_s"] for step in clean), default=None),
+        "first_drop": first_drop(measured["steps"]),
+        # Over the last step only, after its warm-up: earlier steps grow the fleet and with it the RSS.
+        "rss_growth_mb_per_hour": rss_growth(measured["rss"], skip=last["started_s"] + min(last["seconds"] / 4, 600.0)),
+        **measured,
+    }
+    with open(args.output, "w") as fh:
+        json.dump(report, fh, indent=1)
+    log(f"[{_now().isoformat()}] report written to {args.output}; first drop: {report['first_drop']}")
+    if args.baseline:
+        with open(args.baseline) as fh:
+            for line in compare(json.load(fh), report):
+                log(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# (segment sequence number, byte offset within that segment)
+Position = Tuple[int, int]
+
+_SUFFIX = ".lp"
+_ACK_FILE = "ack"
+# Batches InfluxDB refused outright (4xx); kept for inspection, never replayed.
+_REJECT_FILE = "rejected"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _segment_name(seq: int) -> str:
+    return f"{seq:016d}{_SUFFIX}"
+
+
+class Spool:
+    """Append-only, segment-rotated line-protocol spool on local disk.
+
+    Lines are appended to the newest segment and read back from the last
+    acknowledged position, one bounded batch at a time. Fully acknowledged
+    segments are deleted; when the spool exceeds `max_bytes`, the oldest
+    segments are evicted even if they were never written to InfluxDB.
+    """
+
+    def __init__(self, directory: str, *, segment_bytes: int = 4 << 20, max_bytes: int = 256 << 20) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max(max_bytes, 2 * segment_bytes)
+        self.evicted_bytes = 0
+        self._segments: List[int] = sorted(int(p.stem) for p in self.directory.glob(f"*{_SUFFIX}"))
+        self._sizes = {seq: self._path(seq).stat().st_size for seq in self._segments}
+        self._ack = self._load_ack()
+        if not self._segments:
+            self._segments.append(0)
+            self._sizes[0] = 0
+        self._repair_tail()
+        self._fh = open(self._path(self._segments[-1]), "ab")
+
+    def _path(self, seq: int) -> Path:
+        return self.directory / _segment_name(seq)
+
+    def _load_ack(self) -> Position:
+        try:
+            seq, offset = (self.directory / _ACK_FILE).read_text().split()
+            return int(seq), int(offset)
+        except (OSError, ValueError):
+            return (self._segments[0], 0) if self._segments else (0, 0)
+
+    def _save_ack(self) -> None:
+        tmp = self.directory / (_ACK_FILE + ".tmp")
+        tmp.write_text(f"{self._ack[0]} {self._ack[1]}\n")
+        os.replace(tmp, self.directory / _ACK_FILE)
+
+    def _repair_tail(self) -> None:
+        # Drop a partial last line left behind by a crash mid-append.
+        seq = self._segments[-1]
+        size = self._sizes[seq]
+        if not size:
+            return
+        with open(self._path(seq), "r+b") as fh:
+            start = max(0, size - 4096)
+            fh.seek(start)
+            tail = fh.read()
+            if tail.endswith(b"\n"):
+                return
+            cut = tail.rfind(b"\n")
+            keep = start + cut + 1 if cut >= 0 else 0
+            fh.truncate(keep)
+        self._sizes[seq] = keep
+
+    @property
+    def pending_bytes(self) -> int:
+        seq, offset = self._ack
+        return sum(self._sizes[s] for s in self._segments if s >= seq) - offset
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def append(self, line: str) -> None:
+        data = line.encode() + b"\n"
+        self._fh.write(data)
+        seq = self._segments[-1]
+        self._sizes[seq] += len(data)
+        if self._sizes[seq] >= self.segment_bytes:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        self.sync()
+        self._fh.close()
+        seq = self._segments[-1] + 1
+        self._segments.append(seq)
+        self._sizes[seq] = 0
+        self._fh = open(self._path(seq), "ab")
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and len(self._segments) > 1:
+            seq = self._segments.pop(0)
+            size = self._sizes.pop(seq)
+            if self._ack[0] <= seq:
+                self.evicted_bytes += size - (self._ack[1] if self._ack[0] == seq else 0)
+                self._ack = (self._segments[0], 0)
+                self._save_ack()
+            self._path(seq).unlink(missing_ok=True)
+            print(f"[{_now().isoformat()}] spool full, evicted segment {seq} ({size} bytes)", flush=True)
+
+    def sync(self) -> None:
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+
+    def read_batch(self, max_lines: int) -> Tuple[List[str], Position]:
+        """Read up to `max_lines` unacknowledged lines, streaming from disk."""
+        self._fh.flush()
+        lines: List[str] = []
+        seq, offset = self._ack
+        for s in self._segments:
+            if s < seq:
+                continue
+            if s > seq:
+                seq, offset = s, 0
+            if offset >= self._sizes[s]:
+                continue
+            with open(self._path(s), "rb") as fh:
+                fh.seek(offset)
+                for raw in fh:
+                    if not raw.endswith(b"\n"):
+                        break
+                    lines.append(raw[:-1].decode())
+                    offset += len(raw)
+                    if len(lines) >= max_lines:
+                        return lines, (seq, offset)
+        return lines, (seq, offset)
+
+    def ack(self, position: Position) -> None:
+        """Mark everything before `position` as written and drop finished segments."""
+        self._ack = position
+        self._save_ack()
+        active = self._segments[-1]
+        while self._segments[0] < position[0] and self._segments[0] != active:
+            seq = self._segments.pop(0)
+            self._sizes.pop(seq)
+            self._path(seq).unlink(missing_ok=True)
+
+    def reject(self, lines: List[str]) -> None:
+        """Set aside lines InfluxDB will never accept; the file is capped at one segment plus one old copy."""
+        path = self.directory / _REJECT_FILE
+        if path.exists() and path.stat().st_size >= self.segment_bytes:
+            os.replace(path, self.directory / (_REJECT_FILE + ".1"))
+        with open(path, "a") as fh:
+            fh.write("".join(line + "\n" for line in lines))
+
+    def close(self) -> None:
+        self.sync()
+        self._fh.close()
+
+
+def open_spool(directory: Optional[str], segment_mb: float, max_mb: float) -> Optional[Spool]:
+    if not directory:
+        return None
+    return Spool(directory, segment_bytes=int(segment_mb * (1 << 20)), max_bytes=int(max_mb * (1 << 20)))
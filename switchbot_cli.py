@@ -0,0 +1,162 @@
+import argparse
+import importlib
+import json
+import subprocess
+import sys
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+# Third-party modules that cost real time on a Pi Zero; no subcommand may pull them in at import.
+HEAVY = ("bleak", "influxdb_client", "TheengsDecoder", "numpy", "pyarrow")
+
+
+class Command(NamedTuple):
+    module: str
+    help: str
+    budget_ms: float  # import cost on top of _BASELINE on a desktop; scale with --scale on slower machines
+    eager: Tuple[str, ...] = ()  # HEAVY modules the command cannot work without, allowed at import
+
+
+COMMANDS: Dict[str, Command] = {
+    "scan": Command("scan_switchbot", "Scan and print SwitchBot meters", 15),
+    "read": Command("read_sensor", "Print the latest reading of some MACs as JSON", 15),
+    "log": Command("logger_influx_scan", "Log advertisements to InfluxDB and other sinks", 60),
+    "log-gatt": Command("logger_influx", "Poll meters over GATT and log to InfluxDB", 50),
+    "live": Command("live_state", "Query the logger's live state socket", 10),
+    "rssi": Command("rssi_monitor", "RSSI and link statistics (loss, jitter) of meters, live stream or own scan", 10),
+    "rssi-connect": Command("rssi_connect", "Print RSSI over a GATT connection", 10),
+    "gatt-read": Command("read_meter_gatt", "Read one meter over GATT", 10),
+    "gatt-dump": Command("gatt_dump", "List the GATT services of a device", 10),
+    "gatt-inventory": Command("gatt_inventory", "Battery/firmware/hardware of every meter over GATT as JSON", 20),
+    "gatt-probe": Command("gatt_probe", "Write a raw GATT command and print notifications", 10),
+    "replay": Command("replay", "Replay a capture into the logger or a reader", 15),
+    "duty-sim": Command("duty_cycle", "Simulate adaptive scan duty-cycling", 15),
+    "soak": Command("soak", "Load-test the logger with virtual meters and a stand-in InfluxDB", 15),
+    "bench": Command("bench_decoder", "Benchmark the advertisement decoder", 10),
+    "decode-bench": Command("decode_pool", "Compare loop lag and drops of inline and pooled decoding", 15),
+    "bulk-decode": Command("bulk_decode", "Decode large dumps to CSV/Parquet with NumPy", 15, ("numpy",)),
+    "store": Command("local_store", "Query the local SQLite store", 25),
+    "export": Command("influx_export", "Export InfluxDB history to per-sensor CSV/Parquet files", 15),
+    "influx-standin": Command("influx_standin", "Run a local InfluxDB API stand-in with synthetic data", 15),
+    "rollups": Command("grafana_rollups", "Generate InfluxDB rollup tasks and dashboard", 15),
+    "federation": Command("federation", "Run a scanner node, a collector or the loss bench", 25),
+    "mqtt-broker": Command("mqtt_client", "Run a stand-in MQTT broker", 10),
+}
+
+# Every command needs argparse and asyncio; load them (and the command's `eager` modules) first so the
+# budget covers only what the command's own modules add.
+_BASELINE = ("argparse", "asyncio")
+_PROBE = """
+import json, sys, time
+t = time.perf_counter()
+try:
+    import {baseline}
+except ImportError as exc:
+    print(json.dumps({{"missing": exc.name}}))
+    sys.exit()
+base = time.perf_counter()
+import {module}
+done = time.perf_counter()
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"base_ms": (base - t) * 1000, "ms": (done - base) * 1000, "heavy": heavy}}))
+"""
+
+
+def _usage() -> str:
+    width = max(len(name) for name in COMMANDS)
+    lines = ["usage: switchbot COMMAND [ARGS ...]", "", "commands:"]
+    lines += [f"  {name:<{width}}  {cmd.help}" for name, cmd in COMMANDS.items()]
+    lines.append(f"  {'import-times':<{width}}  Check each command's import time against its budget")
+    lines += ["", "Run `switchbot COMMAND --help` for the options of one command."]
+    return "\n".join(lines)
+
+
+def measure(cmd: Command, repeat: int = 3) -> dict:
+    """Best-of-`repeat` import times of `cmd` in a fresh interpreter and the heavy modules it loaded.
+
+    Returns {"missing": name} when one of its `eager` modules is not installed.
+    """
+    best: dict = {}
+    probe = _PROBE.format(baseline=", ".join(_BASELINE + cmd.eager), module=cmd.module, heavy=HEAVY)
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True)
+        if out.returncode:
+            lines = out.stderr.strip().splitlines()
+            return {"error": lines[-1] if lines else f"exit status {out.returncode}"}
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if "missing" in result:
+            return result
+        for key in ("base_ms", "ms"):
+            best[key] = round(min(best.get(key, result[key]), result[key]), 1)
+        best["heavy"] = [m for m in result["heavy"] if m not in cmd.eager]
+    return best
+
+
+def import_times(names: Sequence[str], scale: float, repeat: int, as_json: bool) -> int:
+    """Print each command's import time; return how many are over budget, load a heavy module or fail to import.
+
+    Commands whose `eager` dependencies are not installed are skipped.
+    """
+    failures = 0
+    report = []
+    for name in names:
+        cmd = COMMANDS[name]
+        result = measure(cmd, repeat)
+        budget = cmd.budget_ms * scale
+        if "missing" in result:
+            status, line = "skip", f"{result['missing']} is not installed"
+        elif "error" in result:
+            status, line = "FAIL", result["error"]
+        else:
+            heavy = result["heavy"]
+            status = "ok  " if result["ms"] <= budget and not heavy else "FAIL"
+            line = f"{result['ms']:6.1f} ms / {budget:5.0f} ms (+{result['base_ms']:.0f} ms baseline)"
+            if heavy:
+                line += f"  loads {', '.join(heavy)}"
+        failures += status == "FAIL"
+        report.append({"command": name, "module": cmd.module, "status": status.strip(), "budget_ms": budget, **result})
+        if not as_json:
+            print(f"{status} {name:<14} {line}", flush=True)
+    if as_json:
+        print(json.dumps(report, indent=2))
+    return failures
+
+
+def _import_times_main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(
+        prog="switchbot import-times",
+        description="Measure each command's cold import time and fail if it is over budget or loads "
+        f"one of {', '.join(HEAVY)} before it is needed.",
+    )
+    parser.add_argument("command", nargs="*", help="Commands to check (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiply every budget (e.g. 8 on a Pi Zero)")
+    parser.add_argument("--repeat", type=int, default=3, help="Imports per command; the fastest one counts")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.command if name not in COMMANDS]
+    if unknown:
+        parser.error(f"unknown command(s): {', '.join(unknown)}")
+    failures = import_times(args.command or list(COMMANDS), args.scale, max(1, args.repeat), args.json)
+    sys.exit(1 if failures else 0)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(_usage())
+        return
+    name, rest = argv[0], argv[1:]
+    if name == "import-times":
+        _import_times_main(rest)
+        return
+    cmd = COMMANDS.get(name)
+    if cmd is None:
+        print(_usage(), file=sys.stderr)
+        sys.exit(f"switchbot: unknown command {name!r}")
+    # Only the chosen command's module (and what it needs) is ever imported.
+    module = importlib.import_module(cmd.module)
+    sys.argv = [f"switchbot {name}", *rest]
+    module.main()
+
+
+if __name__ == "__main__":
+    main()
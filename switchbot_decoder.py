@@ -0,0 +1,218 @@
+import json
+import struct
+from typing import Callable, Dict, Optional
+
+_theengs = None
+_theengs_loaded = False
+
+SWITCHBOT_COMPANY_IDS = (0x0969, 0x0059)
+FD3D_UUID = "0000fd3d-0000-1000-8000-00805f9b34fb"
+
+# Service data (fd3d): type, status, battery, alert/temp fraction, temp int, hum.
+_SERVICE_TH = struct.Struct("<BBBBBB")
+# Service data (fd3d) for devices that only advertise type/status/battery.
+_SERVICE_SHORT = struct.Struct("<BBB")
+# Manufacturer data (after the company ID): MAC, 2 bytes, temp fraction, temp int, hum.
+_MANUFACTURER_TH = struct.Struct("<6s2xBBB")
+
+
+def _uuid16_from_uuid(uuid: str) -> str:
+    u = uuid.lower()
+    if u.startswith("0000") and u.endswith("-0000-1000-8000-00805f9b34fb"):
+        return u[4:8]
+    return u.replace("-", "")
+
+
+def _hex(b: bytes) -> str:
+    return b.hex()
+
+
+def _make_manufacturer_hex(manufacturer_data: dict[int, bytes]) -> Optional[str]:
+    if not manufacturer_data:
+        return None
+    # Prefer SwitchBot company IDs; fall back to the first entry.
+    for company_id in SWITCHBOT_COMPANY_IDS:
+        if company_id in manufacturer_data:
+            data = manufacturer_data[company_id]
+            return company_id.to_bytes(2, "little").hex() + _hex(data)
+    company_id, data = next(iter(manufacturer_data.items()))
+    return company_id.to_bytes(2, "little").hex() + _hex(data)
+
+
+def _make_service_data(adv) -> tuple[Optional[str], Optional[str]]:
+    if not adv.service_data:
+        return None, None
+    # Prefer SwitchBot fd3d service data if present.
+    for uuid, data in adv.service_data.items():
+        if _uuid16_from_uuid(uuid) == "fd3d":
+            return _hex(data), "fd3d"
+    uuid, data = next(iter(adv.service_data.items()))
+    return _hex(data), _uuid16_from_uuid(uuid)
+
+
+def _looks_like_switchbot(name: str, adv) -> bool:
+    if "switchbot" in name.lower():
+        return True
+    if adv.manufacturer_data:
+        if 0x0969 in adv.manufacturer_data or 0x0059 in adv.manufacturer_data:
+            return True
+    if adv.service_data:
+        return any(_uuid16_from_uuid(u) == "fd3d" for u in adv.service_data.keys())
+    return False
+
+
+def _make_theengs_payload(name: str, address: str, rssi: Optional[int], adv) -> dict:
+    manufacturer_hex = _make_manufacturer_hex(adv.manufacturer_data)
+    service_hex, service_uuid = _make_service_data(adv)
+
+    payload = {
+        "name": name,
+        "id": address,
+    }
+    if rssi is not None:
+        payload["rssi"] = rssi
+    if manufacturer_hex:
+        payload["manufacturerdata"] = manufacturer_hex
+    if service_hex:
+        payload["servicedata"] = service_hex
+    if service_uuid:
+        payload["servicedatauuid"] = service_uuid
+    return payload
+
+
+def _load_theengs():
+    """Import TheengsDecoder on first use (it is optional and slow to import); None if missing."""
+    global _theengs, _theengs_loaded
+    if not _theengs_loaded:
+        _theengs_loaded = True
+        try:
+            import TheengsDecoder  # type: ignore
+
+            _theengs = TheengsDecoder
+        except Exception:  # pragma: no cover - optional dependency
+            _theengs = None
+    return _theengs
+
+
+def _decode_with_theengs(payload: dict) -> Optional[dict]:
+    theengs = _load_theengs()
+    if theengs is None:
+        return None
+    decoded = theengs.decodeBLE(json.dumps(payload))
+    if not decoded:
+        return None
+    try:
+        return json.loads(decoded)
+    except json.JSONDecodeError:
+        return None
+
+
+def _fd3d(service_data: Dict[str, bytes]) -> Optional[bytes]:
+    if not service_data:
+        return None
+    data = service_data.get(FD3D_UUID)
+    if data is not None:
+        return data
+    for uuid, data in service_data.items():
+        if _uuid16_from_uuid(uuid) == "fd3d":
+            return data
+    return None
+
+
+def _switchbot_manufacturer(manufacturer_data: Dict[int, bytes]) -> Optional[bytes]:
+    if not manufacturer_data:
+        return None
+    data = manufacturer_data.get(0x0969)
+    if data is None:
+        data = manufacturer_data.get(0x0059)
+    return data
+
+
+def _format_mac(raw: bytes) -> str:
+    return raw.hex(":").upper()
+
+
+def _temperature(frac_byte: int, int_byte: int) -> float:
+    temp = (int_byte & 0x7F) + (frac_byte & 0x0F) / 10.0
+    if not (int_byte & 0x80):
+        temp = -temp
+    return round(temp, 1)
+
+
+def _meter_fields(out: dict, frac_byte: int, int_byte: int, hum_byte: int) -> dict:
+    tempc = _temperature(frac_byte, int_byte)
+    out["tempc"] = tempc
+    out["tempf"] = round(tempc * 1.8 + 32, 1)
+    out["hum"] = hum_byte & 0x7F
+    return out
+
+
+def _decode_meter(service: bytes, manufacturer: Optional[bytes], out: dict) -> Optional[dict]:
+    """WoSensorTH / Meter Plus: temperature and humidity in the fd3d service data."""
+    if len(service) >= _SERVICE_TH.size:
+        _, _, batt, alert_frac, temp_int, hum = _SERVICE_TH.unpack_from(service)
+        out["batt"] = batt & 0x7F
+        out["tempalert"] = (alert_frac >> 6) & 0x03
+        out["humalert"] = (alert_frac >> 4) & 0x03
+        return _meter_fields(out, alert_frac, temp_int, hum)
+    # Newer firmware moved the reading to the manufacturer data, like the outdoor meter.
+    return _decode_outdoor(service, manufacturer, out)
+
+
+def _decode_outdoor(service: bytes, manufacturer: Optional[bytes], out: dict) -> Optional[dict]:
+    """WoSensorTHO: battery in the fd3d service data, reading in the manufacturer data."""
+    if manufacturer is None or len(manufacturer) < _MANUFACTURER_TH.size:
+        return None
+    _, frac, temp_int, hum = _MANUFACTURER_TH.unpack_from(manufacturer)
+    if len(service) >= _SERVICE_SHORT.size:
+        out["batt"] = _SERVICE_SHORT.unpack_from(service)[2] & 0x7F
+    return _meter_fields(out, frac, temp_int, hum)
+
+
+# Device type byte (bit[6:0] of service data byte 0) -> (model, model_id, decoder).
+_DECODERS: Dict[int, tuple[str, str, Callable[[bytes, Optional[bytes], dict], Optional[dict]]]] = {
+    0x54: ("Meter", "WoSensorTH", _decode_meter),
+    0x69: ("Meter Plus", "WoSensorTHP", _decode_meter),
+    0x77: ("Outdoor Meter", "W3400010", _decode_outdoor),
+}
+
+
+def decode(
+    name: str,
+    address: str,
+    rssi: Optional[int],
+    manufacturer_data: Dict[int, bytes],
+    service_data: Dict[str, bytes],
+) -> Optional[dict]:
+    """Decode a SwitchBot meter advertisement from raw bytes, or None if unsupported."""
+    service = _fd3d(service_data)
+    if not service:
+        return None
+    entry = _DECODERS.get(service[0] & 0x7F)
+    if entry is None:
+        return None
+    model, model_id, decoder = entry
+    manufacturer = _switchbot_manufacturer(manufacturer_data)
+
+    out = {"name": name, "id": address}
+    if rssi is not None:
+        out["rssi"] = rssi
+    out["brand"] = "SwitchBot"
+    out["model"] = model
+    out["model_id"] = model_id
+    out["type"] = "THB"
+    if manufacturer is not None and len(manufacturer) >= 6:
+        out["mac"] = _format_mac(manufacturer[:6])
+    elif len(address) == 17:
+        out["mac"] = address.upper()
+    return decoder(service, manufacturer, out)
+
+
+def decode_advertisement(device, adv, *, fallback: bool = True) -> Optional[dict]:
+    """Decode a Bleak advertisement natively, falling back to TheengsDecoder if installed."""
+    name = device.name or ""
+    rssi = getattr(adv, "rssi", None)
+    decoded = decode(name, device.address, rssi, adv.manufacturer_data, adv.service_data)
+    if decoded is not None or not fallback or _load_theengs() is None:
+        return decoded
+    return _decode_with_theengs(_make_theengs_payload(name, device.address, rssi, adv))